@@ -2,8 +2,16 @@ import json
 import re
 import json
 import re
+from llm.cascade import validate_code_bundle
 from llm.gemini_llm import ask_gemini
-from rag.vector_store import search_vector_store
+from llm.resilience import resilient_call
+from rag.vector_store import search_cpt_codes, search_icd_codes
+
+def rule_based_bundle(cpt_docs, icd_docs):
+    """The top retrieved codes as a JSON bundle, used when the LLM is unavailable."""
+    cpts = [doc.split(":")[0].strip() for doc in cpt_docs]
+    icds = [doc.split(":")[0].strip() for doc in icd_docs]
+    return json.dumps({"cpt": cpts[0] if cpts else "", "icd": icds, "modifiers": [], "procedures": cpts})
 
 def convert_to_CPT_ICD_modifier_bundle(inputs: dict) -> dict:
     context = inputs["context"]
@@ -12,8 +20,10 @@ def convert_to_CPT_ICD_modifier_bundle(inputs: dict) -> dict:
     cpt_query = f"CPT codes for {context['visit_type']} {context['duration']}"
     icd_query = f"ICD-10 codes for {context['diagnosis']} {context['symptoms']}"
 
-    relevant_cpt = search_vector_store(cpt_query)
-    relevant_icd = search_vector_store(icd_query)
+    cpt_docs = search_cpt_codes(cpt_query)
+    icd_docs = search_icd_codes(icd_query)
+    relevant_cpt = "\n".join(cpt_docs)
+    relevant_icd = "\n".join(icd_docs)
 
     prompt = f"""You are a medical coder. Suggest CPT, ICD-10, and modifier codes based on the following patient encounter details and relevant medical codes:
 
@@ -38,7 +48,10 @@ Return as JSON:
   "procedures": ["<CPTs>"]
 }}
 """
-    response_text = ask_gemini(prompt)
+    deadline = inputs.get("deadline")
+    response_text = resilient_call("convert", lambda: ask_gemini(prompt, "convert", validate_code_bundle, deadline),
+                                   prompt=prompt, deadline=deadline,
+                                   fallback=lambda: rule_based_bundle(cpt_docs, icd_docs))
     print(f"CODE AGENT --- LLM RESPONSE: {response_text}")
     
     # Use regex to find the JSON block
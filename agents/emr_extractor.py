@@ -1,7 +1,10 @@
 from langchain_core.pydantic_v1 import BaseModel, Field
-from vertexai.generative_models import GenerativeModel, Tool, FunctionDeclaration
+from vertexai.generative_models import Tool, FunctionDeclaration
 from rag.vector_store import query_emr_context
+from llm.cascade import cascade_router, empty_values, encounter_validator, function_call_args
+from llm.resilience import resilient_call
 import os
+import re
 
 
 # Define the data structure for the extracted information using Pydantic
@@ -25,21 +28,30 @@ function_declaration = FunctionDeclaration(
 
 # Create the tool
 encounter_tool = Tool(function_declarations=[function_declaration])
+# Notes often lack a provider, place of service or ordered tests; only these must be filled
+validate_encounter = encounter_validator(EncounterContext, required=("visit_type", "diagnosis"))
 
 def extract_encounter_context(encounter: EncounterContext):
     """Extracts encounter context from a SOAP note."""
     return encounter
 
+def rule_based_context(soap_note: str) -> dict:
+    """A minimal context parsed without the LLM, used when it is unavailable."""
+    duration = re.search(r"(\d+)[- ]minute", soap_note)
+    return {
+        "visit_type": "follow-up" if "follow-up" in soap_note.lower() else "office visit",
+        "duration": f"{duration.group(1)} minutes" if duration else "",
+        "diagnosis": [],
+        "symptoms": [],
+        "ordered_tests": [],
+        "provider": "",
+        "pos": "office",
+    }
+
 def review_and_extract_emr_data(inputs: dict) -> dict:
     soap_note = inputs.get("soap_note", "")
     emr_fields = query_emr_context(soap_note)
 
-    # Define the tool + model
-    model = GenerativeModel(
-        model_name="gemini-2.5-pro",
-        tools=[encounter_tool]
-    )
-
     prompt = f"""
     You are an expert medical billing AI.
 
@@ -53,14 +65,19 @@ def review_and_extract_emr_data(inputs: dict) -> dict:
     {emr_fields}
     """
 
-    response = model.generate_content(prompt)
+    deadline = inputs.get("deadline")
+    response = resilient_call("extract",
+                              lambda: cascade_router.route("extract", prompt, validate_encounter, [encounter_tool],
+                                                           deadline),
+                              prompt=prompt, deadline=deadline, fallback=lambda: None)
+    if response is None:
+        return {"context": rule_based_context(soap_note)}
     print(f"EMR AGENT --- LLM Response: {response}")
 
     try:
         tool_call = response.candidates[0].content.parts[0].function_call
         if tool_call.name == "extract_encounter_context":
-            args = {key: value for key, value in tool_call.args.items()}
-            return {"context": args}
+            return {"context": {**empty_values(EncounterContext), **function_call_args(response)}}
     except (IndexError, AttributeError) as e:
         print(f"Error extracting tool call: {e}")
         print(f"LLM Response: {response}")
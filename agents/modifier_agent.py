@@ -1,6 +1,8 @@
 import json
 import re
+from llm.cascade import validate_modifiers
 from llm.gemini_llm import ask_gemini
+from llm.resilience import resilient_call
 
 def apply_risk_modifiers(inputs: dict):
     bundle = inputs["bundle"]
@@ -28,7 +30,11 @@ Return only a JSON object with a single key 'modifiers' which is a list of strin
 Example: {{"modifiers": ["25", "59"]}}
 """
 
-    response_text = ask_gemini(prompt)
+    # Without the LLM, fall back to the payer rule check: modifier 25 when validation asked for one
+    fallback = json.dumps({"modifiers": ["25"] if inputs.get("requires_modifier") else []})
+    deadline = inputs.get("deadline")
+    response_text = resilient_call("modify", lambda: ask_gemini(prompt, "modify", validate_modifiers, deadline),
+                                   prompt=prompt, deadline=deadline, fallback=lambda: fallback)
     print(f"MODIFIER AGENT --- LLM Response: {response_text}")
     
     # Use regex to find the JSON block
@@ -1,11 +1,11 @@
-from rag.vector_store import search_vector_store
+from rag.vector_store import search_payer_rules
 
 def check_payer_rules(inputs: dict) -> dict:
     bundle = inputs["bundle"]
     payer = "Aetna"
 
-    query = f"{bundle['cpt']} {bundle['procedures']} modifier {payer}"
-    docs = search_vector_store(query)
+    query = f"{bundle['cpt']} {bundle['procedures']} modifier"
+    docs = search_payer_rules(query, payer=payer)
 
     needs_modifier = any("CO-197" in doc for doc in docs)
     return {
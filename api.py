@@ -1,13 +1,30 @@
+import os
 from fastapi import FastAPI, Request
 from langgraph.billing_graph import build_graph
+from llm.cascade import cascade_router
+from llm.resilience import deadline_after, resilient_caller
+
+# End-to-end budget for one claim; callers can shorten it with an X-Request-Timeout header (seconds)
+REQUEST_BUDGET = float(os.environ.get("CLAIM_REQUEST_BUDGET", "60"))
 
 app = FastAPI()
 graph = build_graph()
 
+def request_budget(request: Request) -> float:
+    try:
+        return min(float(request.headers.get("x-request-timeout", REQUEST_BUDGET)), REQUEST_BUDGET)
+    except ValueError:
+        return REQUEST_BUDGET
+
 @app.post("/generate-claim")
 async def generate_claim(request: Request):
     body = await request.json()
     result = graph.invoke({
-        "soap_note": body["soap_note"]
+        "soap_note": body["soap_note"],
+        "deadline": deadline_after(request_budget(request)),
     })
     return result
+
+@app.get("/llm-stats")
+def llm_stats():
+    return {**resilient_caller.stats(), "cascade": cascade_router.stats()}
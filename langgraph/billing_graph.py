@@ -11,6 +11,8 @@ class AgentState(TypedDict):
     justification: Optional[str]
     evidence: Optional[List[str]]
     edi: Optional[str]
+    # Absolute request deadline in epoch seconds; LLM stages never run past it
+    deadline: Optional[float]
 
 def build_graph():
     graph = StateGraph(AgentState)
@@ -0,0 +1,289 @@
+"""
+Model-tier cascade for the Gemini stages.
+
+Each request goes to the fast model first (GEMINI_FAST_MODEL, default
+gemini-2.5-flash). Its output is validated for the stage: a schema-valid
+EncounterContext tool call for extract, a well-formed code bundle for convert,
+and parseable modifier JSON for modify. The request escalates to the pro model
+(GEMINI_PRO_MODEL, default gemini-2.5-pro) only when validation fails or
+confidence is below CASCADE_MIN_CONFIDENCE. Confidence is the validator's score
+(for convert, the share of codes found in the complete catalogs) times
+exp(avg_logprobs) when the response carries log-probabilities.
+
+When no tier passes, the best answer seen is returned (a valid low-confidence
+one, else an invalid one), so the agents keep their own handling of malformed
+output. Only upstream errors on every tier raise, which lets llm.resilience
+count them against the circuit breaker.
+
+Each tier's call is hedged on its own: if it is slower than the stage's observed
+latency percentile for that tier, a duplicate goes to the same tier and the
+first answer wins, so escalation and hedging do not repeat each other's calls.
+Each call carries a transport timeout of the stage time left (the stage budget,
+capped by the request deadline), so an abandoned call does not keep its worker
+thread busy.
+
+Vertex AI is imported on the first real call, so the router can be exercised
+offline by passing a stand-in generate(model_name, prompt, tools, timeout) function.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from llm.resilience import DeadlineExceeded, Hedger, stage_timeout
+from rag.embed_catalog import CPT_CATALOG, ICD_CATALOG, read_catalog
+
+FAST_MODEL = os.environ.get("GEMINI_FAST_MODEL", "gemini-2.5-flash")
+PRO_MODEL = os.environ.get("GEMINI_PRO_MODEL", "gemini-2.5-pro")
+MIN_CONFIDENCE = float(os.environ.get("CASCADE_MIN_CONFIDENCE", "0.7"))
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code types whose catalog lists every valid code, so a miss means the code is
+# likely wrong. data/cpt.txt is only a seed sample; add "cpt" once it is replaced
+# by the full CPT list.
+COMPLETE_CATALOGS = {"icd"}
+
+_MODIFIER = re.compile(r"^[A-Z0-9]{2}$")
+_CPT = re.compile(r"^\d{4}[0-9A-Z]$")
+
+
+class ValidationFailed(ValueError):
+    """The response does not have the structure the stage needs."""
+
+
+def response_text(response):
+    return response if isinstance(response, str) else response.text
+
+
+def model_confidence(response):
+    """exp(avg_logprobs) of the first candidate, or 1.0 when the response has none."""
+    try:
+        avg_logprobs = response.candidates[0].avg_logprobs
+    except (AttributeError, IndexError, TypeError):
+        return 1.0
+    return 1.0 if avg_logprobs is None else min(1.0, math.exp(avg_logprobs))
+
+
+def parse_json_response(text):
+    """Parses a JSON object from a reply, with or without a ```json fence."""
+    match = re.search(r"```json\n(.*?)```", text, re.DOTALL)
+    try:
+        parsed = json.loads(match.group(1) if match else text)
+    except json.JSONDecodeError as e:
+        raise ValidationFailed(f"reply is not JSON: {e}") from e
+    if not isinstance(parsed, dict):
+        raise ValidationFailed("reply is not a JSON object")
+    return parsed
+
+
+def normalize_icd(code):
+    return str(code).replace(".", "").upper().strip()
+
+
+def load_known_codes(icd_file=os.path.join(PROJECT_ROOT, ICD_CATALOG),
+                     cpt_file=os.path.join(PROJECT_ROOT, CPT_CATALOG)):
+    """(CPT codes, normalized ICD-10 codes) in the catalog that rag.embed_catalog embeds."""
+    cpt, icd = set(), set()
+    for _, _, metadata in read_catalog(icd_file, cpt_file):
+        if metadata["type"] == "cpt":
+            cpt.add(metadata["code"])
+        else:
+            icd.add(normalize_icd(metadata["code"]))
+    return cpt, icd
+
+
+# Loaded at import so a missing catalog fails at startup, not inside an LLM stage
+KNOWN_CODES = load_known_codes()
+
+
+def _plain(value):
+    """Converts proto map and repeated values (MapComposite, RepeatedComposite) to dicts and lists."""
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return value
+    if hasattr(value, "items"):
+        return {key: _plain(item) for key, item in value.items()}
+    try:
+        return [_plain(item) for item in value]
+    except TypeError:
+        return value
+
+
+def function_call_args(response):
+    """The args of the function call in the first part of the reply, as plain Python values."""
+    return _plain(response.candidates[0].content.parts[0].function_call.args)
+
+
+def empty_values(schema):
+    """"" or [] per field of a pydantic model, for the fields a function call left out."""
+    json_schema = getattr(schema, "model_json_schema", None) or schema.schema
+    return {name: [] if field.get("type") == "array" else "" for name, field in json_schema()["properties"].items()}
+
+
+def encounter_validator(schema, required=()):
+    """
+    Validator for the extract stage: the first part must be a function call whose
+    args, with omitted fields left empty, fit schema and fill every required field.
+    """
+    parse = getattr(schema, "model_validate", None) or schema.parse_obj
+    defaults = empty_values(schema)
+
+    def validate(response):
+        try:
+            args = function_call_args(response)
+        except (AttributeError, IndexError, TypeError) as e:
+            raise ValidationFailed(f"no function call in reply: {e}") from e
+        missing = [name for name in required if not args.get(name)]
+        if missing:
+            raise ValidationFailed(f"function call leaves {', '.join(missing)} empty")
+        try:
+            parse({**defaults, **args})
+        except Exception as e:
+            raise ValidationFailed(f"function call args do not match {schema.__name__}: {e}") from e
+        return 1.0
+
+    return validate
+
+
+def validate_code_bundle(response, codes=None, complete=COMPLETE_CATALOGS):
+    """
+    Validator for the convert stage. The bundle must be well-formed; confidence is
+    the share of its codes found in the catalogs listed in complete (1.0 if none).
+    """
+    bundle = parse_json_response(response_text(response))
+    known_cpt, known_icd = codes or KNOWN_CODES
+    cpt = str(bundle.get("cpt", "")).strip()
+    icd = bundle.get("icd")
+    procedures = bundle.get("procedures", [])
+    if not cpt or not isinstance(icd, list) or not icd or not isinstance(procedures, list):
+        raise ValidationFailed("bundle needs a cpt, a non-empty icd list and a procedures list")
+    cpts = [cpt] + [str(code).strip() for code in procedures]
+    malformed = [code for code in cpts if not _CPT.match(code)]
+    if malformed:
+        raise ValidationFailed(f"malformed CPT codes {malformed}")
+
+    checks = []
+    if "icd" in complete:
+        checks += [normalize_icd(code) in known_icd for code in icd]
+    if "cpt" in complete:
+        checks += [code in known_cpt for code in cpts]
+    return sum(checks) / len(checks) if checks else 1.0
+
+
+def validate_modifiers(response):
+    """Validator for the modify stage: {"modifiers": [two-character codes]}."""
+    modifiers = parse_json_response(response_text(response)).get("modifiers")
+    if not isinstance(modifiers, list) or not all(isinstance(m, str) and _MODIFIER.match(m) for m in modifiers):
+        raise ValidationFailed(f"modifiers must be a list of two-character codes, got {modifiers!r}")
+    return 1.0
+
+
+_vertex_lock = threading.Lock()
+_vertex_models = {}
+
+
+def vertex_generate(model_name, prompt, tools=None, timeout=None):
+    """
+    Calls Vertex AI, initializing it and each (model, tools) GenerativeModel on
+    first use. generate_content takes no timeout, so a timed call sends the
+    model's own request with a transport timeout in seconds.
+    """
+    with _vertex_lock:
+        if not _vertex_models:
+            import vertexai
+            vertexai.init(project=os.environ["GOOGLE_CLOUD_PROJECT"], location=os.environ["GOOGLE_CLOUD_LOCATION"])
+        key = (model_name, tuple(map(id, tools or ())))
+        if key not in _vertex_models:
+            from vertexai.generative_models import GenerativeModel
+            _vertex_models[key] = GenerativeModel(model_name=model_name, tools=tools)
+        model = _vertex_models[key]
+    if timeout is None:
+        return model.generate_content(prompt)
+    request = model._prepare_request(contents=prompt)
+    return model._parse_response(model._prediction_client.generate_content(request=request, timeout=timeout))
+
+
+class CascadeRouter:
+    """Routes each stage's request through the model tiers, cheapest first."""
+
+    def __init__(self, tiers=None, generate=vertex_generate, min_confidence=None, hedger=None):
+        self.tiers = tiers or [FAST_MODEL, PRO_MODEL]
+        self.generate = generate
+        self.hedger = hedger or Hedger(thread_name_prefix="llm-tier")
+        self.min_confidence = MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, stage, tier, outcome, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(stage, {}).setdefault(tier, {
+                "calls": 0, "accepted": 0, "invalid": 0, "low_confidence": 0, "errors": 0, "latency_s": 0.0})
+            stats["calls"] += 1
+            stats[outcome] += 1
+            stats["latency_s"] += seconds
+
+    def stats(self):
+        """Per stage and tier: counts, hedged calls, hit_rate (accepted / calls) and mean latency."""
+        hedges = self.hedger.hedges()
+        with self._lock:
+            return {
+                stage: {
+                    tier: {**{k: v for k, v in s.items() if k != "latency_s"},
+                           "hedged": hedges.get(f"{stage}:{tier}", 0),
+                           "hit_rate": round(s["accepted"] / s["calls"], 4),
+                           "mean_latency_ms": round(1000 * s["latency_s"] / s["calls"], 1)}
+                    for tier, s in tiers.items()
+                }
+                for stage, tiers in self._stats.items()
+            }
+
+    def route(self, stage, prompt, validate=None, tools=None, deadline=None):
+        """
+        Returns the first response that validates with enough confidence, escalating
+        tier by tier within the stage timeout for deadline.
+        """
+        low_confidence_response = invalid_response = None
+        error = None
+        end = time.perf_counter() + stage_timeout(stage, deadline)
+        for position, tier in enumerate(self.tiers):
+            last_tier = position == len(self.tiers) - 1
+            start = time.perf_counter()
+            if start >= end:
+                error = DeadlineExceeded(f"no time left for {stage} on {tier}")
+                break
+            try:
+                response = self.hedger.run(
+                    f"{stage}:{tier}",
+                    lambda tier=tier: self.generate(tier, prompt, tools, max(end - time.perf_counter(), 0.0)), end - start)
+            except Exception as e:
+                self._record(stage, tier, "errors", time.perf_counter() - start)
+                error = e
+                continue
+            elapsed = time.perf_counter() - start
+
+            try:
+                confidence = (validate(response) if validate else 1.0) * model_confidence(response)
+            except ValidationFailed as e:
+                print(f"CASCADE --- {stage} reply from {tier} rejected: {e}")
+                self._record(stage, tier, "invalid", elapsed)
+                invalid_response = response
+                continue
+
+            if confidence >= self.min_confidence or last_tier:
+                self._record(stage, tier, "accepted", elapsed)
+                return response
+            self._record(stage, tier, "low_confidence", elapsed)
+            low_confidence_response = response
+
+        # A valid low-confidence answer beats an invalid one; an invalid one beats none
+        if low_confidence_response is not None:
+            return low_confidence_response
+        if invalid_response is not None:
+            return invalid_response
+        raise error
+
+
+cascade_router = CascadeRouter()
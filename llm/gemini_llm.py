@@ -1,11 +1,6 @@
-import vertexai
-from vertexai.generative_models import GenerativeModel
-import os
+from llm.cascade import cascade_router
 
-vertexai.init(project=os.environ["GOOGLE_CLOUD_PROJECT"], location=os.environ["GOOGLE_CLOUD_LOCATION"])
-
-model = GenerativeModel("gemini-2.5-pro")
-
-def ask_gemini(prompt: str) -> str:
-    response = model.generate_content(prompt)
+def ask_gemini(prompt: str, stage: str = "default", validate=None, deadline=None) -> str:
+    """Answers with the fast model when its reply passes validate, else with the pro model (see llm.cascade)."""
+    response = cascade_router.route(stage, prompt, validate, deadline=deadline)
     return response.text
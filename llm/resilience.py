@@ -0,0 +1,291 @@
+"""
+Latency budgets for the LLM stages of the billing graph.
+
+Every request carries an absolute deadline (epoch seconds in AgentState). Each
+stage's call is bounded by the smaller of its own budget and the time left
+until that deadline. Hedging is per model call rather than per stage, so a
+duplicate never repeats a whole model cascade: llm.cascade runs each tier's
+call through a Hedger, which fires a duplicate when the call has not returned
+by the hedge delay (the observed latency percentile for that stage and tier)
+and takes the first answer. Upstream failures and timeouts feed a circuit
+breaker; a call cut short by the client's own deadline (a stage timeout below
+the stage budget) does not count against it. While the breaker is open, or
+when a call fails, the stage degrades to the last good response for the same
+prompt or to its rule-based fallback, without waiting on Vertex.
+
+Stage calls and model calls run on separate worker pools. A losing or timed-out call cannot be
+interrupted: it is abandoned, its future is cancelled if it has not started,
+and its result is discarded. The Vertex calls carry a transport timeout of the
+time left (see llm.cascade), so an abandoned call frees its thread by then.
+
+Configuration (seconds unless noted):
+    LLM_STAGE_BUDGET_<STAGE>   per-stage budget, e.g. LLM_STAGE_BUDGET_CONVERT=10
+    LLM_HEDGE_PERCENTILE       latency percentile used as the hedge delay (default 95)
+    LLM_HEDGE_DELAY            hedge delay until enough latencies are observed (default 5)
+    LLM_BREAKER_FAILURES       consecutive failures that open the breaker (default 5)
+    LLM_BREAKER_RESET          seconds the breaker stays open before a trial call (default 30)
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+DEFAULT_STAGE_BUDGETS = {"extract": 20.0, "convert": 15.0, "modify": 10.0}
+DEFAULT_BUDGET = 15.0
+MIN_HEDGE_SAMPLES = 20
+LATENCY_WINDOW = 200
+RESPONSE_CACHE_SIZE = 1024
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage has no time left and no fallback to degrade to."""
+
+
+class UpstreamUnavailable(RuntimeError):
+    """Raised when the circuit breaker is open and a stage has no fallback."""
+
+
+def deadline_after(seconds):
+    """Absolute deadline, in epoch seconds, for a request with the given budget."""
+    return time.time() + seconds
+
+
+def remaining(deadline):
+    """Seconds left until deadline (None means no deadline)."""
+    return None if deadline is None else deadline - time.time()
+
+
+def stage_budget(stage):
+    return float(os.environ.get(f"LLM_STAGE_BUDGET_{stage.upper()}", DEFAULT_STAGE_BUDGETS.get(stage, DEFAULT_BUDGET)))
+
+
+def stage_timeout(stage, deadline=None):
+    """The stage budget, clamped to the time left until the request deadline."""
+    left = remaining(deadline)
+    return stage_budget(stage) if left is None else min(stage_budget(stage), left)
+
+
+class LatencyTracker:
+    """Recent successful call latencies per stage, used to pick the hedge delay."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._latencies.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, stage):
+        percentile = float(os.environ.get("LLM_HEDGE_PERCENTILE", "95"))
+        with self._lock:
+            samples = list(self._latencies.get(stage, ()))
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return float(os.environ.get("LLM_HEDGE_DELAY", "5"))
+        return float(np.percentile(samples, percentile))
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; after reset_timeout one trial call is let through (half-open)."""
+
+    def __init__(self, failure_threshold=None, reset_timeout=None, clock=time.monotonic):
+        self.failure_threshold = failure_threshold or int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+        self.reset_timeout = reset_timeout or float(os.environ.get("LLM_BREAKER_RESET", "30"))
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.clock() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """Ends a call that says nothing about upstream health, freeing the half-open trial."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+class ResponseCache:
+    """Bounded LRU of the last good response per (stage, prompt)."""
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(stage, prompt):
+        return stage, hashlib.sha256(str(prompt).encode()).hexdigest()
+
+    def get(self, stage, prompt):
+        with self._lock:
+            key = self.key(stage, prompt)
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, stage, prompt, response):
+        with self._lock:
+            key = self.key(stage, prompt)
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class Hedger:
+    """Runs calls on worker threads within a timeout, hedging a call slower than its key's hedge delay."""
+
+    def __init__(self, latencies=None, max_workers=32, thread_name_prefix="llm-call"):
+        self.latencies = latencies or LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._hedges = {}
+        self._lock = threading.Lock()
+
+    def hedges(self):
+        """Duplicate calls fired so far, per key."""
+        with self._lock:
+            return dict(self._hedges)
+
+    def run(self, key, call, timeout, hedge=True):
+        """
+        Returns the first result of call, firing one duplicate if it is slower than
+        the hedge delay for key (never, with hedge=False). Raises DeadlineExceeded
+        if no call answers within timeout.
+        """
+        start = time.monotonic()
+        end = start + timeout
+        hedge_at = start + self.latencies.hedge_delay(key) if hedge else end
+        pending = {self._executor.submit(call)}
+        hedged = False
+        while pending:
+            now = time.monotonic()
+            if now >= end:
+                break
+            done, pending = wait(pending, timeout=(end if hedged else min(end, hedge_at)) - now,
+                                 return_when=FIRST_COMPLETED)
+            succeeded = [future for future in done if future.exception() is None]
+            if succeeded:
+                for slower in pending:
+                    slower.cancel()
+                self.latencies.record(key, time.monotonic() - start)
+                return succeeded[0].result()
+            if done and not pending:
+                raise next(iter(done)).exception()
+            if pending and not hedged and hedge_at <= time.monotonic() < end:
+                hedged = True
+                with self._lock:
+                    self._hedges[key] = self._hedges.get(key, 0) + 1
+                pending.add(self._executor.submit(call))
+        for future in pending:
+            future.cancel()
+        raise DeadlineExceeded(f"{key} did not answer within {timeout:.2f}s")
+
+
+class ResilientCaller:
+    """Runs upstream calls under stage budgets with a circuit breaker and fallbacks."""
+
+    def __init__(self, breaker=None, cache=None, max_workers=32):
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = cache or ResponseCache()
+        # Stage calls are not hedged here: llm.cascade hedges each model call, on its own threads
+        self._runner = Hedger(max_workers=max_workers, thread_name_prefix="llm-stage")
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _count(self, stage, outcome):
+        with self._lock:
+            counts = self._stats.setdefault(stage, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"breaker": self.breaker.state, "stages": {s: dict(c) for s, c in self._stats.items()}}
+
+    def call(self, stage, call, prompt=None, deadline=None, fallback=None):
+        """
+        Returns call()'s result within the stage budget. On timeout, failure or an
+        open breaker it returns the cached response for prompt, else fallback(),
+        else raises DeadlineExceeded / UpstreamUnavailable / the call's error.
+        """
+        timeout = stage_timeout(stage, deadline)
+        if timeout > 0 and self.breaker.allow():
+            try:
+                result = self._runner.run(stage, call, timeout, hedge=False)
+            except DeadlineExceeded as e:
+                if timeout < stage_budget(stage):
+                    # Cut short by the request deadline, not by a slow upstream
+                    self.breaker.release()
+                    self._count(stage, "deadline")
+                else:
+                    self.breaker.record_failure()
+                    self._count(stage, "timeout")
+                failure = e
+            except Exception as e:
+                self.breaker.record_failure()
+                self._count(stage, "error")
+                failure = e
+            else:
+                self.breaker.record_success()
+                self._count(stage, "ok")
+                if prompt is not None:
+                    self.cache.put(stage, prompt, result)
+                return result
+        elif timeout <= 0:
+            failure = DeadlineExceeded(f"no time left for {stage}")
+            self._count(stage, "deadline")
+        else:
+            failure = UpstreamUnavailable(f"circuit open, skipping {stage}")
+            self._count(stage, "short_circuit")
+
+        if prompt is not None:
+            cached = self.cache.get(stage, prompt)
+            if cached is not None:
+                self._count(stage, "cached_fallback")
+                return cached
+        if fallback is not None:
+            self._count(stage, "rule_fallback")
+            return fallback()
+        raise failure
+
+
+# Shared by all stages: they call the same Vertex endpoint, so they share its health
+resilient_caller = ResilientCaller()
+
+
+def resilient_call(stage, call, prompt=None, deadline=None, fallback=None):
+    return resilient_caller.call(stage, call, prompt=prompt, deadline=deadline, fallback=fallback)
@@ -1,5 +1,15 @@
+import argparse
+import os
 from rag.document_loader import bootstrap_vector_store
+from rag.embed_catalog import CATALOG_PATH
+from rag.vector_store import load_embedded_catalog
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the payer_knowledge vector store.")
+    parser.add_argument("--catalog", default=CATALOG_PATH,
+                        help="embedded ICD/CPT catalog from rag/embed_catalog.py, loaded when it exists")
+    args = parser.parse_args()
     bootstrap_vector_store()
+    if os.path.exists(args.catalog):
+        print(f"Loaded {load_embedded_catalog(args.catalog):,} catalog entries from {args.catalog}.")
     print("Vector store seeded.")
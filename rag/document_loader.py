@@ -1,4 +1,13 @@
-from rag.vector_store import client
+from rag.vector_store import ANY_PAYER, client
+
+PAYERS = ["Aetna", "BlueCross", "UHC", "Cigna"]
+
+def payer_for_rule(rule):
+    """Returns the payer a rule names, or ANY_PAYER for rules that are not payer specific."""
+    for payer in PAYERS:
+        if payer.lower() in rule.lower():
+            return payer
+    return ANY_PAYER
 
 def bootstrap_vector_store():
     coll = client.get_or_create_collection("payer_knowledge")
@@ -13,4 +22,5 @@ def bootstrap_vector_store():
 
     with open("data/payer_rules.txt") as f:
         for line in f:
-            coll.add(documents=[line.strip()], metadatas=[{"type": "payer_rule"}], ids=[f"payer-{hash(line)}"])
+            coll.add(documents=[line.strip()], metadatas=[{"type": "payer_rule", "payer": payer_for_rule(line)}],
+                     ids=[f"payer-{hash(line)}"])
@@ -0,0 +1,240 @@
+"""
+Offline embedding of the full ICD-10-CM and CPT catalog for the payer_knowledge
+collection.
+
+Entries are embedded in batches across a process pool with Chroma's default
+local model (all-MiniLM-L6-v2), the same model the collection uses for query
+text. The vectors are stored int8-quantized with one float scale per vector,
+next to their ids, documents and metadata, in a single compressed .npz. On
+re-runs, entries whose content hash is unchanged reuse their stored vectors.
+rag.vector_store.load_embedded_catalog loads the file into the collection
+without embedding anything again.
+
+Run from the repository root:
+    python -m rag.embed_catalog --workers 8
+    python -m rag.embed_catalog --eval 1000 --k 10    # recall@k of int8 vs float32
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+ICD_CATALOG = "score-denial-risk-model/data/ccsr_icd10cm_2025_v1.csv"
+CPT_CATALOG = "data/cpt.txt"
+CATALOG_PATH = "data/catalog_embeddings.npz"
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+BATCH_SIZE = 256
+# Rows dequantized at a time when scoring, bounding the float32 working set
+SEARCH_BLOCK = 8192
+
+_embedding_function = None
+
+
+def read_catalog(icd_file=ICD_CATALOG, cpt_file=CPT_CATALOG):
+    """Returns (id, document, metadata) tuples; documents use the 'CODE: description' form of data/*.txt."""
+    entries = {}
+    with open(icd_file, newline="") as f:
+        reader = csv.reader(f, quotechar="'")
+        next(reader)
+        for row in reader:
+            if len(row) < 2:
+                continue
+            code, description = row[0].strip(), row[1].strip()
+            entries.setdefault(f"icd-{code}", (f"{code}: {description}", {"type": "icd", "code": code}))
+    with open(cpt_file) as f:
+        for line in f:
+            code, _, description = line.strip().partition(":")
+            if code:
+                entries.setdefault(f"cpt-{code}", (line.strip(), {"type": "cpt", "code": code.strip()}))
+    return [(entry_id, document, metadata) for entry_id, (document, metadata) in entries.items()]
+
+
+def content_hash(document):
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\0{document}".encode()).hexdigest()[:16]
+
+
+def quantize(vectors):
+    """Symmetric per-vector int8 quantization; returns (int8 vectors, float32 scales)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize(quantized, scales):
+    return quantized.astype(np.float32) * scales[:, None]
+
+
+class QuantizedCatalog:
+    """Catalog entries with int8 embeddings, as stored in the .npz file."""
+
+    def __init__(self, ids, documents, types, codes, hashes, vectors, scales, model=EMBEDDING_MODEL):
+        self.ids = np.asarray(ids, dtype=str)
+        self.documents = np.asarray(documents, dtype=str)
+        self.types = np.asarray(types, dtype=str)
+        self.codes = np.asarray(codes, dtype=str)
+        self.hashes = np.asarray(hashes, dtype=str)
+        self.vectors = vectors
+        self.scales = scales
+        self.model = model
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["ids"], data["documents"], data["types"], data["codes"], data["hashes"],
+                       data["vectors"], data["scales"], str(data["model"]))
+
+    def save(self, path):
+        # Written under a temporary name so an interrupted run keeps the previous file
+        with open(path + ".tmp", "wb") as f:
+            np.savez_compressed(f, ids=self.ids, documents=self.documents, types=self.types, codes=self.codes,
+                                hashes=self.hashes, vectors=self.vectors, scales=self.scales,
+                                model=np.array(self.model))
+        os.replace(path + ".tmp", path)
+
+    def metadatas(self, start=0, end=None):
+        return [{"type": t, "code": c} for t, c in zip(self.types[start:end].tolist(), self.codes[start:end].tolist())]
+
+    def embeddings(self, start=0, end=None):
+        return dequantize(self.vectors[start:end], self.scales[start:end])
+
+    def search(self, query_vectors, k, entry_type=None):
+        """Returns the row indices of the k highest inner-product entries for each query vector."""
+        query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        rows = np.arange(len(self)) if entry_type is None else np.flatnonzero(self.types == entry_type)
+        scores = np.empty((len(query_vectors), len(rows)), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_BLOCK):
+            block = rows[start:start + SEARCH_BLOCK]
+            scores[:, start:start + len(block)] = query_vectors @ dequantize(self.vectors[block], self.scales[block]).T
+        return rows[top_k(scores, k)]
+
+
+def top_k(scores, k):
+    """Column indices of the k largest scores per row, best first."""
+    k = min(k, scores.shape[1])
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def _init_worker():
+    global _embedding_function
+    from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+    _embedding_function = DefaultEmbeddingFunction()
+
+
+def _embed_batch(documents):
+    return np.asarray(_embedding_function(list(documents)), dtype=np.float32)
+
+
+def embed_documents(documents, workers=None, batch_size=BATCH_SIZE):
+    """Embeds documents with the local default model, batches spread over a process pool."""
+    if not documents:
+        return np.empty((0, 0), dtype=np.float32)
+    batches = [documents[start:start + batch_size] for start in range(0, len(documents), batch_size)]
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _init_worker()
+        return np.vstack([_embed_batch(batch) for batch in batches])
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        return np.vstack(list(pool.map(_embed_batch, batches)))
+
+
+def build_catalog(entries, previous=None, embed=embed_documents):
+    """
+    Returns (catalog, float vectors of the newly embedded rows, their row
+    indices). Entries whose id and content hash match previous are reused.
+    """
+    hashes = [content_hash(document) for _, document, _ in entries]
+    reuse = {}
+    if previous is not None and previous.model == EMBEDDING_MODEL:
+        reuse = {entry_id: row for row, entry_id in enumerate(previous.ids)}
+
+    reused_rows, previous_rows, new_rows = [], [], []
+    for row, ((entry_id, _, _), entry_hash) in enumerate(zip(entries, hashes)):
+        previous_row = reuse.get(entry_id)
+        if previous_row is not None and previous.hashes[previous_row] == entry_hash:
+            reused_rows.append(row)
+            previous_rows.append(previous_row)
+        else:
+            new_rows.append(row)
+
+    new_vectors = embed([entries[row][1] for row in new_rows]) if new_rows else None
+    dim = new_vectors.shape[1] if new_vectors is not None else previous.vectors.shape[1]
+    vectors = np.zeros((len(entries), dim), dtype=np.int8)
+    scales = np.ones(len(entries), dtype=np.float32)
+    if reused_rows:
+        vectors[reused_rows] = previous.vectors[previous_rows]
+        scales[reused_rows] = previous.scales[previous_rows]
+    if new_rows:
+        vectors[new_rows], scales[new_rows] = quantize(new_vectors)
+
+    catalog = QuantizedCatalog(
+        [entry_id for entry_id, _, _ in entries], [document for _, document, _ in entries],
+        [metadata["type"] for _, _, metadata in entries], [metadata["code"] for _, _, metadata in entries],
+        hashes, vectors, scales)
+    return catalog, new_vectors, np.asarray(new_rows, dtype=np.int64)
+
+
+def recall_at_k(float_vectors, catalog, query_rows, k):
+    """Mean overlap between the float32 and the int8 top-k for the entries at query_rows used as queries."""
+    queries = float_vectors[query_rows]
+    expected = top_k(queries @ float_vectors.T, k)
+    found = catalog.search(queries, k)
+    return float(np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)]))
+
+
+def run(output=CATALOG_PATH, icd_file=ICD_CATALOG, cpt_file=CPT_CATALOG, workers=None, batch_size=BATCH_SIZE,
+        eval_queries=0, k=10, seed=0):
+    entries = read_catalog(icd_file, cpt_file)
+    # The recall baseline needs float vectors for every entry, so --eval re-embeds everything
+    previous = QuantizedCatalog.load(output) if os.path.exists(output) and not eval_queries else None
+
+    start = time.perf_counter()
+    catalog, new_vectors, new_rows = build_catalog(
+        entries, previous, lambda documents: embed_documents(documents, workers, batch_size))
+    elapsed = time.perf_counter() - start
+    catalog.save(output)
+
+    embedded = len(new_rows)
+    float_bytes = len(catalog) * catalog.vectors.shape[1] * 4
+    quantized_bytes = catalog.vectors.nbytes + catalog.scales.nbytes
+    print(f"Embedded {embedded:,} entries, reused {len(catalog) - embedded:,}, in {elapsed:.1f}s"
+          + (f" ({embedded / max(elapsed, 1e-9):,.0f} entries/s)" if embedded else ""))
+    print(f"Wrote {output}: {len(catalog):,} vectors, {quantized_bytes / 2 ** 20:.1f} MiB int8+scales "
+          f"vs {float_bytes / 2 ** 20:.1f} MiB float32, {os.path.getsize(output) / 2 ** 20:.1f} MiB on disk")
+
+    if eval_queries:
+        query_rows = np.random.default_rng(seed).choice(len(catalog), min(eval_queries, len(catalog)), replace=False)
+        recall = recall_at_k(new_vectors, catalog, query_rows, k)
+        print(f"recall@{k} of int8 vs float32 over {len(query_rows):,} queries: {recall:.4f}")
+    return catalog
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embed the ICD-10-CM/CPT catalog into int8-quantized vectors.")
+    parser.add_argument("--output", default=CATALOG_PATH)
+    parser.add_argument("--icd-file", default=ICD_CATALOG)
+    parser.add_argument("--cpt-file", default=CPT_CATALOG)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="documents per embedding call")
+    parser.add_argument("--eval", type=int, default=0, metavar="N",
+                        help="re-embed everything and report recall@k for N sampled entries as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    run(args.output, args.icd_file, args.cpt_file, args.workers, args.batch_size, args.eval, args.k, args.seed)
+
+
+if __name__ == "__main__":
+    main()
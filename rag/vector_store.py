@@ -2,6 +2,63 @@ import chromadb
 client = chromadb.HttpClient(host="localhost", port=8000)
 collection = client.get_or_create_collection("payer_knowledge")
 
+# Payer rules that apply to every payer are tagged with this instead of a payer name
+ANY_PAYER = "any"
+
+CPT_TOP_K = 3
+ICD_TOP_K = 3
+PAYER_RULE_TOP_K = 2
+
+def _search(query, where, k):
+    results = collection.query(query_texts=[query], n_results=k, where=where)
+    return results["documents"][0]
+
+def search_cpt_codes(query, k=CPT_TOP_K):
+    return _search(query, {"type": "cpt"}, k)
+
+def search_icd_codes(query, k=ICD_TOP_K):
+    return _search(query, {"type": "icd"}, k)
+
+# Whether the stored payer rules carry a payer tag; None until a rule is found
+_payer_tagged = None
+
+def payer_rules_tagged():
+    """
+    Whether the store's payer rules are tagged with a payer, checked once on a
+    stored rule. Stores seeded before rules were tagged are searched unfiltered.
+    """
+    global _payer_tagged
+    if _payer_tagged is None:
+        metadatas = collection.get(where={"type": "payer_rule"}, limit=1, include=["metadatas"])["metadatas"]
+        if not metadatas:
+            return True  # nothing to search yet; check again once the store is seeded
+        _payer_tagged = "payer" in (metadatas[0] or {})
+        if not _payer_tagged:
+            print("VECTOR STORE --- payer rules are not tagged by payer; searching all payer rules "
+                  "(reseed with main.py to tag rules by payer)")
+    return _payer_tagged
+
+def search_payer_rules(query, payer=None, k=PAYER_RULE_TOP_K):
+    """
+    Payer rules for the given payer plus the rules that apply to any payer (all
+    rules if payer is None, or if the store predates payer tags). A payer with
+    no rules of its own only gets the rules for any payer.
+    """
+    where = {"type": "payer_rule"}
+    if payer is None or not payer_rules_tagged():
+        return _search(query, where, k)
+    return _search(query, {"$and": [where, {"payer": {"$in": [payer, ANY_PAYER]}}]}, k)
+
+def load_embedded_catalog(path, batch_size=5000):
+    """Upserts a catalog written by rag/embed_catalog.py with its precomputed embeddings; returns the entry count."""
+    from rag.embed_catalog import QuantizedCatalog
+    catalog = QuantizedCatalog.load(path)
+    for start in range(0, len(catalog), batch_size):
+        end = start + batch_size
+        collection.upsert(ids=catalog.ids[start:end].tolist(), documents=catalog.documents[start:end].tolist(),
+                          metadatas=catalog.metadatas(start, end), embeddings=catalog.embeddings(start, end).tolist())
+    return len(catalog)
+
 def search_vector_store(query):
     results = collection.query(query_texts=[query], n_results=3)
     return results["documents"][0]
@@ -1,21 +1,52 @@
 import os
+import sys
 import traceback
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from datetime import date
+from typing import List, Literal, Optional
 import pandas as pd
 import joblib
 import lightgbm as lgb
 
-# Load model and encoder
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from prediction_cache import PredictionCache
+from denial_rate_store import DenialRateStore
+
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-clf = joblib.load(os.path.join(project_root, "denial_risk_model_lgbm.pkl"))
-le = joblib.load(os.path.join(project_root, "label_encoder_icd_ccs_id.pkl"))
+
+# Load model and encoder
+def load_model():
+    global clf, le
+    clf = joblib.load(os.path.join(project_root, "denial_risk_model_lgbm.pkl"))
+    le = joblib.load(os.path.join(project_root, "label_encoder_icd_ccs_id.pkl"))
+
+load_model()
 ccs_df = pd.read_csv(os.path.join(project_root, "data", "ccsr_icd10cm_2025_v1.csv"), dtype=str)
 ccs_df = ccs_df.rename(columns={
     "'ICD-10-CM CODE'": "icd10",
     "'CCSR CATEGORY 1'": "ccs_category"
 })
 ccs_df["icd10"] = ccs_df["icd10"].str.replace(".", "").str.upper().str.strip()
+icd_to_ccs = ccs_df.drop_duplicates("icd10").set_index("icd10")["ccs_category"].to_dict()
+
+# Identical feature tuples repeat constantly, so scores are memoized per model
+prediction_cache = PredictionCache(maxsize=int(os.environ.get("PREDICTION_CACHE_SIZE", "100000")))
+
+# Load (cpt, payer) denial statistics, building them from the claims file on first start
+DENIAL_RATE_STORE_PATH = os.environ.get(
+    "DENIAL_RATE_STORE_PATH", os.path.join(project_root, "denial_rate_store.json"))
+window_days = os.environ.get("DENIAL_RATE_WINDOW_DAYS")
+if os.path.exists(DENIAL_RATE_STORE_PATH):
+    denial_rate_store = DenialRateStore.load(DENIAL_RATE_STORE_PATH)
+else:
+    claims_path = os.path.join(project_root, "data", "claim_data.csv")
+    if os.path.exists(claims_path):
+        denial_rate_store = DenialRateStore.from_claims_csv(
+            claims_path, window_days=int(window_days) if window_days else None)
+        denial_rate_store.save(DENIAL_RATE_STORE_PATH)
+    else:
+        denial_rate_store = DenialRateStore(window_days=int(window_days) if window_days else None)
 
 # Setup FastAPI
 app = FastAPI()
@@ -30,25 +61,34 @@ class ClaimInput(BaseModel):
     modifier_count: int
     has_modifier_25: int
     procedures_count: int
-    past_denial_rate: float
+    past_denial_rate: Optional[float] = None
     primary_icd: str
 
+class AdjudicatedOutcome(BaseModel):
+    cpt: str
+    payer: str
+    denied: Literal[0, 1]
+    service_date: Optional[date] = None
+
 @app.post("/predict")
 def predict_denial(claim: ClaimInput):
     try:
         # Normalize ICD
         primary_icd = claim.primary_icd.replace(".", "").upper().strip()
-        match = ccs_df[ccs_df["icd10"] == primary_icd]
-        if match.empty:
-            ccs_id = "Unknown"
-        else:
-            ccs_id = match.iloc[0]["ccs_category"]
+        ccs_id = icd_to_ccs.get(primary_icd, "Unknown")
 
         # Encode CCS ID
         if ccs_id not in le.classes_:
             ccs_id = "Unknown"
         icd_ccs_id_encoded = le.transform([ccs_id])[0]
 
+        # Fill in past denial rate from the feature store when not supplied
+        past_denial_rate = claim.past_denial_rate
+        if past_denial_rate is None:
+            past_denial_rate = denial_rate_store.lookup(claim.cpt, claim.payer)
+            if past_denial_rate is None:
+                past_denial_rate = denial_rate_store.overall_rate() or 0.0
+
         # Build feature vector
         input_row = {
             "cpt": claim.cpt,
@@ -59,12 +99,17 @@ def predict_denial(claim: ClaimInput):
             "modifier_count": claim.modifier_count,
             "has_modifier_25": claim.has_modifier_25,
             "procedures_count": claim.procedures_count,
-            "past_denial_rate": claim.past_denial_rate,
+            "past_denial_rate": past_denial_rate,
             "icd_ccs_id_encoded": icd_ccs_id_encoded,
         }
 
-        X = pd.DataFrame([input_row])
-        probability = clf.predict_proba(X)[0][1]
+        model = clf
+        cache_key = tuple(input_row.values())
+        probability = prediction_cache.get(model, cache_key)
+        if probability is None:
+            X = pd.DataFrame([input_row])
+            probability = model.predict_proba(X)[0][1]
+            prediction_cache.put(model, cache_key, probability)
         predicted = int(probability > 0.5)
 
         return {
@@ -76,3 +121,28 @@ def predict_denial(claim: ClaimInput):
     except Exception as e:
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/outcomes")
+def record_outcomes(outcomes: List[AdjudicatedOutcome]):
+    # The request model has already validated the whole batch, so no outcome is applied before a bad one is found
+    try:
+        for outcome in outcomes:
+            denial_rate_store.update(outcome.cpt, outcome.payer, outcome.denied, outcome.service_date)
+        denial_rate_store.save(DENIAL_RATE_STORE_PATH)
+    except Exception as e:
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"applied": len(outcomes), "pairs": len(denial_rate_store)}
+
+@app.post("/reload-model")
+def reload_model():
+    try:
+        load_model()
+    except Exception as e:
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "reloaded"}
+
+@app.get("/cache-stats")
+def cache_stats():
+    return prediction_cache.stats()
@@ -0,0 +1,152 @@
+import json
+import os
+from datetime import date
+from threading import Lock
+
+import pandas as pd
+
+
+def _key(cpt, payer):
+    return str(cpt).strip(), str(payer).strip()
+
+
+def _day(service_date):
+    """Day ordinal of a service date; None (undated) if it is missing or unparseable, as in update_from_frame."""
+    if service_date is None:
+        return None
+    if isinstance(service_date, str):
+        try:
+            service_date = date.fromisoformat(service_date[:10])
+        except ValueError:
+            return None
+    return service_date.toordinal()
+
+
+class DenialRateStore:
+    """
+    In-process (cpt, payer) denial statistics used for the past_denial_rate feature.
+
+    Running (denied, total) counts are kept per pair so lookups are O(1) and new
+    adjudicated outcomes are applied incrementally. With window_days set, counts
+    are also bucketed per service day and buckets older than the window (relative
+    to the latest service date seen) are expired lazily.
+    """
+
+    def __init__(self, window_days=None):
+        self.window_days = window_days
+        self._totals = {}
+        self._buckets = {}
+        self._as_of = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._totals)
+
+    def _add(self, key, denied, total, day):
+        counts = self._totals.setdefault(key, [0, 0])
+        counts[0] += denied
+        counts[1] += total
+        if self.window_days is None or day is None:
+            return
+        bucket = self._buckets.setdefault(key, {}).setdefault(day, [0, 0])
+        bucket[0] += denied
+        bucket[1] += total
+        if self._as_of is None or day > self._as_of:
+            self._as_of = day
+
+    def _expire(self, key):
+        buckets = self._buckets.get(key)
+        if not buckets or self._as_of is None:
+            return
+        cutoff = self._as_of - self.window_days
+        if min(buckets) > cutoff:
+            return
+        counts = self._totals[key]
+        for day in [d for d in buckets if d <= cutoff]:
+            denied, total = buckets.pop(day)
+            counts[0] -= denied
+            counts[1] -= total
+        if counts[1] <= 0:
+            del self._totals[key]
+            del self._buckets[key]
+
+    def update(self, cpt, payer, denied, service_date=None):
+        """Applies a single adjudicated outcome."""
+        with self._lock:
+            self._add(_key(cpt, payer), int(denied), 1, _day(service_date))
+
+    def update_from_frame(self, df):
+        """
+        Applies a batch of adjudicated outcomes with columns cpt, payer, denied
+        and optionally service_date.
+        """
+        df = df.dropna(subset=["cpt", "payer", "denied"])
+        df = df[df["denied"].isin([0, 1])]
+        group_cols = [df["cpt"].astype(str).str.strip(), df["payer"].astype(str).str.strip()]
+        windowed = self.window_days is not None and "service_date" in df.columns
+        if windowed:
+            # Unparseable dates count as undated outcomes, like update() without a service_date
+            days = pd.to_datetime(df["service_date"], errors="coerce")
+            group_cols.append(days.map(lambda d: d.toordinal(), na_action="ignore"))
+        stats = df["denied"].astype(int).groupby(group_cols, dropna=False).agg(["sum", "count"])
+        with self._lock:
+            for index, (denied, total) in stats.iterrows():
+                day = int(index[2]) if windowed and not pd.isna(index[2]) else None
+                self._add((index[0], index[1]), int(denied), int(total), day)
+
+    def lookup(self, cpt, payer):
+        """Returns the denial rate for (cpt, payer), or None if the pair is unseen."""
+        key = _key(cpt, payer)
+        with self._lock:
+            if self.window_days is not None:
+                self._expire(key)
+            counts = self._totals.get(key)
+            if not counts:
+                return None
+            return counts[0] / counts[1]
+
+    def overall_rate(self):
+        """Returns the denial rate across all pairs, used as the prior for unseen pairs."""
+        with self._lock:
+            if self.window_days is not None:
+                for key in list(self._buckets):
+                    self._expire(key)
+            denied = sum(counts[0] for counts in self._totals.values())
+            total = sum(counts[1] for counts in self._totals.values())
+        return denied / total if total else None
+
+    def save(self, path):
+        """Snapshots the store to a JSON file, replacing it atomically."""
+        with self._lock:
+            snapshot = {
+                "window_days": self.window_days,
+                "as_of": self._as_of,
+                "pairs": [
+                    [cpt, payer, counts[0], counts[1],
+                     [[day, *bucket] for day, bucket in self._buckets.get((cpt, payer), {}).items()]]
+                    for (cpt, payer), counts in self._totals.items()
+                ],
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            snapshot = json.load(f)
+        store = cls(window_days=snapshot["window_days"])
+        store._as_of = snapshot["as_of"]
+        for cpt, payer, denied, total, buckets in snapshot["pairs"]:
+            store._totals[(cpt, payer)] = [denied, total]
+            if buckets:
+                store._buckets[(cpt, payer)] = {day: [d, t] for day, d, t in buckets}
+        return store
+
+    @classmethod
+    def from_claims_csv(cls, path, window_days=None):
+        """Materializes the store from a claims file, as data_processor.py does for training."""
+        store = cls(window_days=window_days)
+        store.update_from_frame(pd.read_csv(path, on_bad_lines='skip'))
+        return store
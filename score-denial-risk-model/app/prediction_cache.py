@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of denial probabilities keyed on the normalized feature tuple.
+
+    The cache is bound to a single model object. When a different model is seen
+    (e.g. after a reload) every entry is dropped, so scores from an old model are
+    never served for a new one.
+    """
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._model = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _bind(self, model):
+        if model is not self._model:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._model = model
+
+    def get(self, model, key):
+        """Returns the cached probability for key, or None on a miss."""
+        with self._lock:
+            self._bind(model)
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, model, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._bind(model)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
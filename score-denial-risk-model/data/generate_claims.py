@@ -1,87 +1,206 @@
+"""
+Generates synthetic claims for data/claim_data.csv (or a Parquet file) with
+vectorized NumPy, in chunks spread over a process pool.
+
+Every chunk draws from its own stream spawned from --seed, so the output only
+depends on --seed, --rows and --chunk-size, not on --workers.
+
+    python data/generate_claims.py --rows 50000000 --format parquet --output data/claims_50m.parquet
+    python data/generate_claims.py --distribution realistic --seed 7
+
+--distribution uniform draws every column independently and uniformly, as the
+original generator did. realistic skews the payer, CPT and ICD mix, ties
+duration and modifiers to the visit level, and draws denied from a logistic
+model conditioned on payer, CPT, modifier 25, procedures and ICD count.
+"""
+
+import argparse
 import csv
-import random
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Run from the score-denial-risk-model directory
+CCSR_FILE_PATH = 'data/ccsr_icd10cm_2025_v1.csv'
+CLAIMS_FILE_PATH = 'data/claim_data.csv'
+
+COLUMNS = ['cpt', 'payer', 'pos', 'duration', 'icd_count', 'modifier_count', 'has_modifier_25',
+           'procedures_count', 'denied', 'primary_icd', 'icd_list', 'secondary_cpt']
+
+PAYERS = ["Aetna", "BlueCross", "UHC", "Cigna"]
+CPT_CODES = np.arange(99203, 99208)
 
-# The script is expected to be run from the 'data' directory.
-# The data files are in the same directory.
-ccsr_file_path = 'data/ccsr_icd10cm_2025_v1.csv'
-claims_file_path = 'data/claim_data.csv'
-
-# Load ICD-10 codes from the CSV file
-print(f"Loading ICD-10 codes from {ccsr_file_path}")
-icd_codes = []
-try:
-    with open(ccsr_file_path, 'r', newline='') as f:
-        # The file is quoted and comma-delimited, handle the single quotes properly
+# realistic distribution: mix weights and denial log-odds contributions
+PAYER_WEIGHTS = [0.30, 0.35, 0.20, 0.15]
+PAYER_DENIAL_LOGIT = [0.0, -0.35, 0.45, 0.20]
+CPT_WEIGHTS = [0.30, 0.32, 0.20, 0.10, 0.08]
+CPT_DENIAL_LOGIT = [-0.50, -0.20, 0.25, 0.55, 0.80]
+BASE_DENIAL_LOGIT = -1.4
+MODIFIER_25_DENIAL_LOGIT = 0.60
+PER_PROCEDURE_DENIAL_LOGIT = 0.15
+PER_ICD_DENIAL_LOGIT = -0.20
+ICD_ZIPF_EXPONENT = 1.1
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+_icd_codes = None
+_icd_weights = None
+
+
+def load_icd_codes(path=CCSR_FILE_PATH):
+    """Returns the ICD-10 codes (first column) of the single-quoted CCSR file."""
+    icd_codes = []
+    with open(path, 'r', newline='') as f:
         reader = csv.reader(f, quotechar="'", delimiter=',')
-        header = next(reader) # Skip header row
+        next(reader)  # Skip header row
         for row in reader:
-            if row: # Ensure row is not empty
-                # The ICD code is the first element, remove any leading/trailing whitespace
+            if row:
                 icd_codes.append(row[0].strip())
-except FileNotFoundError:
-    print(f"Error: The file {ccsr_file_path} was not found. Make sure it's in the same directory as the script.")
-    exit()
-except Exception as e:
-    print(f"An error occurred while reading {ccsr_file_path}: {e}")
-    exit()
-
-payers = ["Aetna", "BlueCross", "UHC", "Cigna"]
-
-# Append new claims to the claim_data.csv file
-print(f"Appending claims to {claims_file_path}")
-try:
-    # Check if the claims file is empty to write headers
-    is_file_empty = not os.path.exists(claims_file_path) or os.path.getsize(claims_file_path) == 0
-
-    with open(claims_file_path, 'w', newline='') as f:
-        writer = csv.writer(f) # Use default quoting (double quotes)
-
-        if is_file_empty:
-            writer.writerow(['cpt', 'payer', 'pos', 'duration', 'icd_count', 'modifier_count', 'has_modifier_25', 'procedures_count', 'denied', 'primary_icd', 'icd_list', 'secondary_cpt'])
-
-        for i in range(500000):
-            cpt = random.randint(99203, 99207)
-            payer = random.choice(payers)
-            pos = random.randint(11, 12)
-            duration = random.randint(15, 35)
-            icd_count = random.randint(1, 3)
-            modifier_count = random.randint(0, 2)
-            has_modifier_25 = random.randint(0, 1)
-            procedures_count = random.randint(1, 4)
-            denied = random.randint(0, 1)
-            
-            if not icd_codes:
-                print("Warning: ICD code list is empty. Cannot generate claims.")
-                break
-                
-            primary_icd = random.choice(icd_codes)
-            
-            icd_list = [primary_icd]
-            for _ in range(icd_count - 1):
-                icd_list.append(random.choice(icd_codes))
-                
-            secondary_cpt = random.randint(80050, 80150)
-            
-            # Format the icd_list as a string that looks like a Python list representation
-            icd_list_str = str(icd_list)
-
-            writer.writerow([
-                cpt,
-                payer,
-                pos,
-                duration,
-                icd_count,
-                modifier_count,
-                has_modifier_25,
-                procedures_count,
-                denied,
-                primary_icd,
-                icd_list_str,
-                secondary_cpt
-            ])
-except IOError as e:
-    print(f"Error writing to {claims_file_path}: {e}")
-
-print(f"Successfully generated and appended 500 claims to {claims_file_path}")
+    if not icd_codes:
+        raise ValueError(f"No ICD-10 codes found in {path}")
+    return np.array(icd_codes, dtype=object)
+
+
+def icd_popularity(n_codes, seed):
+    """Zipf-like code popularity over a seeded shuffle of the codes, shared by every chunk."""
+    ranks = np.random.default_rng(seed).permutation(n_codes) + 1
+    weights = 1.0 / ranks ** ICD_ZIPF_EXPONENT
+    return weights / weights.sum()
+
+
+def format_icd_lists(picks, icd_count):
+    """Formats each row's first icd_count codes like str(list), e.g. "['A000', 'B01']"."""
+    quoted = "'" + picks + "'"
+    icd_list = "[" + quoted[:, 0]
+    for k in range(1, picks.shape[1]):
+        icd_list = icd_list + np.where(icd_count > k, ", " + quoted[:, k], "")
+    return icd_list + "]"
+
+
+def generate_chunk(n, seed_seq, icd_codes, distribution, icd_weights=None):
+    """Generates n claims from one spawned SeedSequence; returns a DataFrame with COLUMNS."""
+    rng = np.random.default_rng(seed_seq)
+    icd_count = rng.integers(1, 4, n)
+    procedures_count = rng.integers(1, 5, n)
+    pos = rng.integers(11, 13, n)
+    secondary_cpt = rng.integers(80050, 80151, n)
+
+    if distribution == 'uniform':
+        cpt_index = rng.integers(0, len(CPT_CODES), n)
+        payer_index = rng.integers(0, len(PAYERS), n)
+        duration = rng.integers(15, 36, n)
+        modifier_count = rng.integers(0, 3, n)
+        has_modifier_25 = rng.integers(0, 2, n)
+        denied = rng.integers(0, 2, n)
+        picks = icd_codes[rng.integers(0, len(icd_codes), (n, 3))]
+    else:
+        cpt_index = rng.choice(len(CPT_CODES), n, p=CPT_WEIGHTS)
+        payer_index = rng.choice(len(PAYERS), n, p=PAYER_WEIGHTS)
+        # Higher visit levels run longer and carry more modifiers
+        duration = np.clip(15 + 5 * cpt_index + rng.integers(-3, 4, n), 15, 35)
+        modifier_count = np.minimum(rng.poisson(0.3 + 0.25 * cpt_index), 2)
+        has_modifier_25 = ((modifier_count > 0) & (rng.random(n) < 0.6)).astype(np.int64)
+        logit = (BASE_DENIAL_LOGIT
+                 + np.asarray(PAYER_DENIAL_LOGIT)[payer_index]
+                 + np.asarray(CPT_DENIAL_LOGIT)[cpt_index]
+                 + MODIFIER_25_DENIAL_LOGIT * has_modifier_25
+                 + PER_PROCEDURE_DENIAL_LOGIT * (procedures_count - 1)
+                 + PER_ICD_DENIAL_LOGIT * (icd_count - 1))
+        denied = (rng.random(n) < 1.0 / (1.0 + np.exp(-logit))).astype(np.int64)
+        picks = icd_codes[rng.choice(len(icd_codes), (n, 3), p=icd_weights)]
+
+    return pd.DataFrame({
+        'cpt': CPT_CODES[cpt_index],
+        'payer': np.asarray(PAYERS, dtype=object)[payer_index],
+        'pos': pos,
+        'duration': duration,
+        'icd_count': icd_count,
+        'modifier_count': modifier_count,
+        'has_modifier_25': has_modifier_25,
+        'procedures_count': procedures_count,
+        'denied': denied,
+        'primary_icd': picks[:, 0],
+        'icd_list': format_icd_lists(picks, icd_count),
+        'secondary_cpt': secondary_cpt,
+    }, columns=COLUMNS)
+
+
+def _init_worker(icd_codes, icd_weights):
+    global _icd_codes, _icd_weights
+    _icd_codes, _icd_weights = icd_codes, icd_weights
+
+
+def _generate_part(n, seed_seq, distribution, output_format, header):
+    """Returns one chunk as CSV bytes or, for Parquet, an Arrow table."""
+    claims = generate_chunk(n, seed_seq, _icd_codes, distribution, _icd_weights)
+    if output_format == 'parquet':
+        return pa.Table.from_pandas(claims, preserve_index=False)
+    return claims.to_csv(index=False, header=header, lineterminator='\r\n').encode()
+
+
+def generate_claims(rows, output, output_format='csv', seed=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=None,
+                    distribution='uniform', ccsr_file=CCSR_FILE_PATH):
+    """Writes rows synthetic claims to output, overwriting it; returns the seconds taken."""
+    workers = workers or os.cpu_count()
+    icd_codes = load_icd_codes(ccsr_file)
+    root_seq = np.random.SeedSequence(seed)
+    popularity_seq, *chunk_seqs = root_seq.spawn(1 + -(-rows // chunk_size))
+    icd_weights = icd_popularity(len(icd_codes), popularity_seq) if distribution == 'realistic' else None
+    sizes = [min(chunk_size, rows - start) for start in range(0, rows, chunk_size)]
+
+    start = time.perf_counter()
+    parquet_writer = None
+    with open(output, 'wb') as out:
+        def write(part):
+            nonlocal parquet_writer
+            if output_format == 'csv':
+                out.write(part)
+                return
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(out, part.schema)
+            parquet_writer.write_table(part)
+
+        # Chunks are generated in parallel but written in order; at most two per worker are in flight
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(icd_codes, icd_weights)) as pool:
+            for i, (n, chunk_seq) in enumerate(zip(sizes, chunk_seqs)):
+                if len(in_flight) >= 2 * workers:
+                    write(in_flight.popleft().result())
+                in_flight.append(pool.submit(_generate_part, n, chunk_seq, distribution, output_format, i == 0))
+            while in_flight:
+                write(in_flight.popleft().result())
+        if parquet_writer is not None:
+            parquet_writer.close()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic claims.')
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible output (default: random)')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--output', default=None,
+                        help=f'output file, overwritten (default: {CLAIMS_FILE_PATH} or its .parquet twin)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows generated per task')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--distribution', choices=['uniform', 'realistic'], default='uniform')
+    parser.add_argument('--ccsr-file', default=CCSR_FILE_PATH)
+    args = parser.parse_args(argv)
+
+    output = args.output or (CLAIMS_FILE_PATH if args.format == 'csv'
+                             else os.path.splitext(CLAIMS_FILE_PATH)[0] + '.parquet')
+    print(f"Generating {args.rows:,} {args.distribution} claims into {output}")
+    elapsed = generate_claims(args.rows, output, args.format, args.seed, args.chunk_size, args.workers,
+                              args.distribution, args.ccsr_file)
+    print(f"Wrote {args.rows:,} claims to {output} in {elapsed:.1f}s ({args.rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+"""
+Load test for the denial-risk API: replays claims against /predict at a fixed
+concurrency (closed loop) or a Poisson arrival rate (open loop) and reports
+throughput, latency percentiles, and CPU and memory per server process.
+
+The app is driven either in-process through httpx's ASGI transport, or over
+HTTP against uvicorn workers spawned by the harness (or an already running
+server with --url). Results are written as JSON; pass an earlier result file as
+--baseline to compare against it.
+
+Run from the score-denial-risk-model directory:
+    python loadtest/run_load_test.py --mode inprocess --concurrency 16 --duration 20
+    python loadtest/run_load_test.py --mode http --workers 4 --rate 400 --duration 60 \
+        --baseline loadtest/results/baseline.json
+
+In open-loop mode latency is measured from each request's scheduled arrival, so
+time spent waiting for a free connection counts against the server.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+import pandas as pd
+import psutil
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'data'))
+
+CLAIMS_FILE = os.path.join(PROJECT_ROOT, 'model', 'claims_test.parquet')
+RESULTS_DIR = os.path.join(PROJECT_ROOT, 'loadtest', 'results')
+MODEL_FILES = ['denial_risk_model_lgbm.pkl', 'label_encoder_icd_ccs_id.pkl']
+
+CLAIM_FIELDS = ['cpt', 'payer', 'pos', 'duration', 'icd_count', 'modifier_count', 'has_modifier_25',
+                'procedures_count', 'primary_icd']
+PERCENTILES = [50, 90, 95, 99]
+# Metrics compared against a baseline, and whether a higher value is better
+COMPARED_METRICS = {'throughput_rps': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False,
+                    'error_rate': False}
+# Config keys that must match a baseline for the comparison to mean anything,
+# including the workload: the replayed claims and how long they were measured
+COMPARABLE_CONFIG = ['mode', 'workers', 'concurrency', 'rate', 'cache_size', 'omit_past_denial_rate',
+                     'claims', 'claim_count', 'duration', 'warmup']
+SAMPLE_INTERVAL = 0.5
+
+
+def load_claims(claims_file=None, synthetic_rows=0, seed=0, with_past_denial_rate=True):
+    """Returns /predict request bodies from a claims split (Parquet or CSV) or from the synthetic generator."""
+    if synthetic_rows:
+        from generate_claims import generate_chunk, load_icd_codes
+        icd_codes = load_icd_codes(os.path.join(PROJECT_ROOT, 'data', 'ccsr_icd10cm_2025_v1.csv'))
+        claims = generate_chunk(synthetic_rows, np.random.SeedSequence(seed), icd_codes, 'uniform')
+    else:
+        claims_file = claims_file or CLAIMS_FILE
+        if claims_file.endswith('.parquet'):
+            claims = pd.read_parquet(claims_file)
+        else:
+            claims = pd.read_csv(claims_file, dtype={'cpt': str, 'pos': str})
+
+    fields = list(CLAIM_FIELDS)
+    if with_past_denial_rate and 'past_denial_rate' in claims.columns:
+        fields.append('past_denial_rate')
+    claims = claims[fields].dropna()
+    for column in ('cpt', 'payer', 'pos', 'primary_icd'):
+        claims[column] = claims[column].astype(str)
+    return claims.to_dict(orient='records')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, port, env):
+    """Spawns uvicorn with the given number of workers and waits until it answers."""
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=PROJECT_ROOT, env=env)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            if httpx.get(f'{url}/cache-stats', timeout=1).status_code == 200:
+                return process, url
+        except httpx.TransportError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("uvicorn did not start within 120s")
+
+
+def server_processes(process):
+    """uvicorn runs the app in child processes when --workers > 1, else in the parent."""
+    parent = psutil.Process(process.pid)
+    workers = [p for p in parent.children(recursive=True)
+               if not any('resource_tracker' in part for part in p.cmdline())]
+    return workers or [parent]
+
+
+class ResourceSampler:
+    """Samples CPU % and RSS of a set of processes in the background."""
+
+    def __init__(self, processes):
+        self.processes = {p.pid: p for p in processes}
+        self.samples = {pid: {'cpu_percent': [], 'rss_mb': []} for pid in self.processes}
+        self._task = None
+
+    async def _run(self):
+        for p in self.processes.values():
+            p.cpu_percent(None)
+        while True:
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            for pid, p in self.processes.items():
+                try:
+                    with p.oneshot():
+                        self.samples[pid]['cpu_percent'].append(p.cpu_percent(None))
+                        self.samples[pid]['rss_mb'].append(p.memory_info().rss / 2 ** 20)
+                except psutil.NoSuchProcess:
+                    pass
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self):
+        return {
+            str(pid): {
+                'cpu_percent_mean': round(float(np.mean(s['cpu_percent'])), 1) if s['cpu_percent'] else None,
+                'cpu_percent_max': round(float(np.max(s['cpu_percent'])), 1) if s['cpu_percent'] else None,
+                'rss_mb_max': round(float(np.max(s['rss_mb'])), 1) if s['rss_mb'] else None,
+            }
+            for pid, s in self.samples.items()
+        }
+
+
+class Recorder:
+    """Collects per-request latencies and outcomes after the warmup period."""
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = []
+        self.status_counts = {}
+        self.errors = 0
+
+    def record(self, started, finished, status):
+        if started < self.measure_from:
+            return
+        if status is None:
+            self.errors += 1
+            status = 'transport_error'
+        elif status != 200:
+            self.errors += 1
+        self.latencies.append(finished - started)
+        self.status_counts[str(status)] = self.status_counts.get(str(status), 0) + 1
+
+
+async def _send(client, claim, recorder, started):
+    try:
+        response = await client.post('/predict', json=claim)
+        status = response.status_code
+    except httpx.HTTPError:
+        status = None
+    recorder.record(started, time.perf_counter(), status)
+
+
+async def closed_loop(client, claims, recorder, concurrency, end):
+    """concurrency users each send their next request as soon as the last one returns."""
+    async def user(offset):
+        i = offset
+        while time.perf_counter() < end:
+            await _send(client, claims[i % len(claims)], recorder, time.perf_counter())
+            i += concurrency
+
+    await asyncio.gather(*(user(offset) for offset in range(concurrency)))
+
+
+async def open_loop(client, claims, recorder, rate, concurrency, end, seed):
+    """Requests arrive as a Poisson process; at most concurrency are in flight at once."""
+    rng = np.random.default_rng(seed)
+    slots = asyncio.Semaphore(concurrency)
+    pending = set()
+
+    async def request(claim, scheduled):
+        async with slots:
+            await _send(client, claim, recorder, scheduled)
+
+    scheduled = time.perf_counter()
+    i = 0
+    while True:
+        scheduled += rng.exponential(1.0 / rate)
+        if scheduled >= end:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.ensure_future(request(claims[i % len(claims)], scheduled))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        i += 1
+    if pending:
+        await asyncio.gather(*pending)
+
+
+async def drive(client, claims, processes, args):
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    end = measure_from + args.duration
+    recorder = Recorder(measure_from)
+    sampler = ResourceSampler(processes)
+    sampler.start()
+    if args.rate:
+        await open_loop(client, claims, recorder, args.rate, args.concurrency, end, args.seed)
+    else:
+        await closed_loop(client, claims, recorder, args.concurrency, end)
+    elapsed = time.perf_counter() - measure_from
+    await sampler.stop()
+    return recorder, sampler, elapsed
+
+
+def summarize(recorder, elapsed):
+    latencies_ms = np.array(recorder.latencies) * 1000
+    requests = len(latencies_ms)
+    summary = {
+        'requests': requests,
+        'errors': recorder.errors,
+        'error_rate': round(recorder.errors / requests, 6) if requests else None,
+        'status_counts': recorder.status_counts,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 1) if elapsed > 0 else None,
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}_ms'] = round(float(np.percentile(latencies_ms, p)), 3) if requests else None
+    summary['mean_ms'] = round(float(latencies_ms.mean()), 3) if requests else None
+    summary['max_ms'] = round(float(latencies_ms.max()), 3) if requests else None
+    return summary
+
+
+def model_fingerprint():
+    """Short content hashes of the model artifacts, so results can be tied to a model version."""
+    fingerprint = {}
+    for name in MODEL_FILES:
+        path = os.path.join(PROJECT_ROOT, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                fingerprint[name] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return fingerprint
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def config_mismatches(config, baseline_config):
+    """Returns {key: (baseline, current)} for the COMPARABLE_CONFIG keys that differ."""
+    return {key: (baseline_config.get(key), config.get(key))
+            for key in COMPARABLE_CONFIG if baseline_config.get(key) != config.get(key)}
+
+
+def compare(result, baseline, tolerance):
+    """Returns {metric: {baseline, current, change, regressed}} for COMPARED_METRICS."""
+    comparison = {}
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        before, after = baseline['summary'].get(metric), result['summary'].get(metric)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else (0.0 if after == before else float('inf'))
+        worse = -change if higher_is_better else change
+        comparison[metric] = {'baseline': before, 'current': after, 'change': round(change, 4),
+                              'regressed': worse > tolerance}
+    return comparison
+
+
+async def run_async(args, claims):
+    if args.mode == 'inprocess':
+        # Import here so PREDICTION_CACHE_SIZE applies and http runs don't load the model twice
+        from app.app import app
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://inprocess') as client:
+            return await drive(client, claims, [psutil.Process()], args)
+
+    process = None
+    url = args.url
+    if not url:
+        env = dict(os.environ)
+        if args.cache_size is not None:
+            env['PREDICTION_CACHE_SIZE'] = str(args.cache_size)
+        process, url = start_server(args.workers, args.port or free_port(), env)
+    try:
+        processes = server_processes(process) if process else []
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+            return await drive(client, claims, processes, args)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the denial-risk /predict endpoint.')
+    parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+    parser.add_argument('--url', help='test an already running server instead of spawning uvicorn (http mode)')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers to spawn (http mode)')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--concurrency', type=int, default=16, help='users (closed loop) or max in-flight (open loop)')
+    parser.add_argument('--rate', type=float, default=None, help='Poisson arrival rate in requests/s (open loop)')
+    parser.add_argument('--duration', type=float, default=30.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5.0, help='seconds of load before measuring')
+    parser.add_argument('--timeout', type=float, default=30.0, help='per-request timeout in seconds (http mode)')
+    parser.add_argument('--claims', default=CLAIMS_FILE, help='claims split (Parquet or CSV) to replay')
+    parser.add_argument('--synthetic', type=int, default=0, help='replay this many generated claims instead')
+    parser.add_argument('--omit-past-denial-rate', action='store_true',
+                        help='leave past_denial_rate out so the server looks it up in its feature store')
+    parser.add_argument('--cache-size', type=int, default=None, help='PREDICTION_CACHE_SIZE for the server (0 disables)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', default=None, help='free-form label stored with the result')
+    parser.add_argument('--output', default=None, help=f'result JSON (default: {RESULTS_DIR}/<timestamp>.json)')
+    parser.add_argument('--baseline', default=None, help='earlier result JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='relative change counted as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on a regression')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'inprocess' and args.cache_size is not None:
+        os.environ['PREDICTION_CACHE_SIZE'] = str(args.cache_size)
+    claims = load_claims(args.claims, args.synthetic, args.seed, not args.omit_past_denial_rate)
+    if not claims:
+        parser.error("no claims to replay")
+    source = f"synthetic:{args.synthetic}" if args.synthetic else os.path.relpath(args.claims, PROJECT_ROOT)
+    config = {
+        'mode': args.mode, 'url': args.url, 'workers': args.workers if args.mode == 'http' else None,
+        'concurrency': args.concurrency, 'rate': args.rate, 'duration': args.duration,
+        'warmup': args.warmup, 'claims': source, 'claim_count': len(claims),
+        'omit_past_denial_rate': args.omit_past_denial_rate, 'cache_size': args.cache_size,
+        'seed': args.seed, 'cpu_count': os.cpu_count(),
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # Checked before the run so a mismatched baseline doesn't cost a full test
+        mismatches = config_mismatches(config, baseline.get('config', {}))
+        if mismatches:
+            parser.error(f"{args.baseline} was run with a different config: "
+                         + ", ".join(f"{key} {before!r} vs {after!r}" for key, (before, after) in mismatches.items()))
+
+    print(f"Replaying {len(claims):,} claims from {source} ({args.mode}, "
+          f"{f'rate {args.rate:g}/s' if args.rate else 'closed loop'}, concurrency {args.concurrency})")
+
+    recorder, sampler, elapsed = asyncio.run(run_async(args, claims))
+
+    result = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'label': args.label,
+        'git_revision': git_revision(),
+        'model': model_fingerprint(),
+        'config': config,
+        'summary': summarize(recorder, elapsed),
+        'processes': sampler.summary(),
+    }
+
+    summary = result['summary']
+    print(f"{summary['requests']:,} requests in {summary['elapsed_s']}s: {summary['throughput_rps']} req/s, "
+          f"errors {summary['errors']}")
+    print("latency ms: " + ", ".join(f"p{p} {summary[f'p{p}_ms']}" for p in PERCENTILES)
+          + f", max {summary['max_ms']}")
+    for pid, usage in result['processes'].items():
+        print(f"  pid {pid}: cpu mean {usage['cpu_percent_mean']}% max {usage['cpu_percent_max']}%, "
+              f"rss max {usage['rss_mb_max']} MB")
+
+    regressed = False
+    if baseline:
+        result['baseline'] = {'path': args.baseline, 'timestamp': baseline.get('timestamp'),
+                              'comparison': compare(result, baseline, args.tolerance)}
+        print(f"Compared with {args.baseline}:")
+        for metric, c in result['baseline']['comparison'].items():
+            regressed |= c['regressed']
+            print(f"  {metric}: {c['baseline']} -> {c['current']} ({c['change']:+.1%})"
+                  + ("  REGRESSION" if c['regressed'] else ""))
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+
+    if regressed and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+"""
+Trains the denial-risk classifier served by app/app.py and writes its artifacts:
+denial_risk_model_lgbm.pkl (OrdinalEncoder for cpt/payer/pos followed by an
+LGBMClassifier) and label_encoder_icd_ccs_id.pkl, both in the project root.
+
+The train/val splits written by pre-processor/data_processor.py are encoded once
+and cached as LightGBM binary Datasets keyed by a hash of their content, so
+later runs skip parsing and binning. The early-stopping runs (one, or a grid
+with --sweep, trained in parallel in a process pool) train from the cache and
+pick the parameters and iteration count. The serving pipeline (encoder plus
+LGBMClassifier, as app.py loads it) is then refit from the DataFrames at that
+iteration count, so the cache speeds up the search, not the final refit. A
+timing report is written next to the splits.
+
+With --ccs-block, a second booster is trained on the same features plus the
+sparse multi-hot CCS block written by the pre-processor (ccs_<split>.npz), fed
+to LightGBM without densifying it. It is saved as denial_risk_model_ccs.txt
+and its validation AUC is reported next to the serving model's; app.py does not
+build the block for requests, so it is not served.
+
+Works from the project root or from model/:
+    python model/train_denial_risk_model.py
+    python model/train_denial_risk_model.py --sweep --workers 4
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from lightgbm import LGBMClassifier
+from sklearn.compose import ColumnTransformer
+from sklearn.metrics import average_precision_score, roc_auc_score
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder, OrdinalEncoder
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(MODEL_DIR)
+MODEL_PATH = os.path.join(PROJECT_ROOT, "denial_risk_model_lgbm.pkl")
+LABEL_ENCODER_PATH = os.path.join(PROJECT_ROOT, "label_encoder_icd_ccs_id.pkl")
+# Written by pre-processor/data_processor.py, run from the project root
+CCS_FEATURES_PATH = os.path.join(PROJECT_ROOT, "ccs_features.json")
+
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "pre-processor"))
+
+# Feature order must match the input_row built by app.py's /predict
+CATEGORICAL_FEATURES = ["cpt", "payer", "pos"]
+FEATURES = CATEGORICAL_FEATURES + [
+    "duration", "icd_count", "modifier_count", "has_modifier_25", "procedures_count",
+    "past_denial_rate", "icd_ccs_id_encoded",
+]
+TARGET = "denied"
+UNKNOWN_CCS = "Unknown"
+
+BASE_PARAMS = {
+    "objective": "binary",
+    "metric": ["auc", "binary_logloss"],
+    "learning_rate": 0.05,
+    "num_leaves": 64,
+    "min_child_samples": 50,
+    "colsample_bytree": 0.9,
+    "subsample": 0.9,
+    "subsample_freq": 1,
+    "random_state": 42,
+    "verbose": -1,
+}
+# Binning parameters baked into the cached Datasets (part of the cache key)
+DATASET_PARAMS = {"max_bin": 255, "verbose": -1}
+SWEEP_GRID = {
+    "learning_rate": [0.03, 0.1],
+    "num_leaves": [31, 64, 128],
+    "min_child_samples": [20, 100],
+}
+MAX_ROUNDS = 5000
+EARLY_STOPPING_ROUNDS = 200
+
+
+def read_split(model_dir, name):
+    """Reads claims_<name>.parquet, falling back to the older claims_<name>.csv."""
+    for ext, reader in ((".parquet", pd.read_parquet), (".csv", pd.read_csv)):
+        path = os.path.join(model_dir, f"claims_{name}{ext}")
+        if os.path.exists(path):
+            df = reader(path)
+            for col in CATEGORICAL_FEATURES:
+                df[col] = df[col].astype(str)
+            return df, path
+    return None, None
+
+
+def fit_ccs_encoder(train):
+    """LabelEncoder over the training CCS ids; missing ids and unseen ones at serving map to Unknown."""
+    le = LabelEncoder()
+    le.fit(pd.concat([train["icd_ccs_id"].astype("string").fillna(UNKNOWN_CCS),
+                      pd.Series([UNKNOWN_CCS], dtype="string")]))
+    return le
+
+
+def encode_ccs(le, df):
+    ids = df["icd_ccs_id"].astype("string").fillna(UNKNOWN_CCS)
+    ids = ids.where(ids.isin(le.classes_), UNKNOWN_CCS)
+    return le.transform(ids)
+
+
+def make_pipeline(params, n_estimators):
+    encoder = ColumnTransformer(
+        [("cat", OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=-1), CATEGORICAL_FEATURES)],
+        remainder="passthrough",
+    )
+    clf_params = {k: v for k, v in params.items() if k != "metric"}
+    return Pipeline([("enc", encoder), ("clf", LGBMClassifier(n_estimators=n_estimators, **clf_params))])
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_key(split_paths, le):
+    """Hash of everything that determines the binned Datasets' content."""
+    key = hashlib.sha256()
+    for path in split_paths:
+        key.update(file_digest(path).encode())
+    key.update(json.dumps({
+        "features": FEATURES, "ccs_classes": list(map(str, le.classes_)), "dataset_params": DATASET_PARAMS,
+        "lightgbm": lgb.__version__,
+    }, sort_keys=True).encode())
+    return key.hexdigest()[:16]
+
+
+def build_datasets(train, val, le, cache_dir, key):
+    """Returns the binary Dataset paths for train and val, building them on a cache miss."""
+    train_path = os.path.join(cache_dir, f"train-{key}.bin")
+    val_path = os.path.join(cache_dir, f"val-{key}.bin")
+    if os.path.exists(train_path) and os.path.exists(val_path):
+        return train_path, val_path, True
+
+    os.makedirs(cache_dir, exist_ok=True)
+    encoder = make_pipeline(BASE_PARAMS, 1).named_steps["enc"]
+    X_train = encoder.fit_transform(train[FEATURES]).astype(np.float64)
+    X_val = encoder.transform(val[FEATURES]).astype(np.float64)
+    categorical = list(range(len(CATEGORICAL_FEATURES)))
+    dtrain = lgb.Dataset(X_train, label=train[TARGET].to_numpy(), categorical_feature=categorical,
+                         params=DATASET_PARAMS, free_raw_data=False)
+    dval = lgb.Dataset(X_val, label=val[TARGET].to_numpy(), categorical_feature=categorical,
+                       reference=dtrain, params=DATASET_PARAMS, free_raw_data=False)
+    # Write under temporary names so an interrupted run never leaves a truncated cache entry
+    for dataset, path in ((dtrain, train_path), (dval, val_path)):
+        dataset.save_binary(path + ".tmp")
+    for path in (train_path, val_path):
+        os.replace(path + ".tmp", path)
+    return train_path, val_path, False
+
+
+def train_one(params, train_path, val_path, num_threads):
+    """Trains one parameter set with early stopping; returns its validation result."""
+    start = time.perf_counter()
+    dtrain = lgb.Dataset(train_path)
+    dval = lgb.Dataset(val_path, reference=dtrain)
+    booster = lgb.train(
+        {**params, "num_threads": num_threads},
+        dtrain,
+        num_boost_round=MAX_ROUNDS,
+        valid_sets=[dval],
+        valid_names=["valid"],
+        callbacks=[lgb.early_stopping(EARLY_STOPPING_ROUNDS, first_metric_only=True, verbose=False)],
+    )
+    scores = booster.best_score["valid"]
+    return {
+        "params": {k: v for k, v in params.items() if k in SWEEP_GRID},
+        "best_iteration": booster.best_iteration,
+        "val_auc": scores["auc"],
+        "val_logloss": scores["binary_logloss"],
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def sweep_params(base_params, grid):
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield {**base_params, **dict(zip(names, values))}
+
+
+def run_sweep(param_sets, train_path, val_path, workers):
+    """Trains the parameter sets in a process pool, splitting the cores between workers."""
+    if workers == 1 or len(param_sets) == 1:
+        return [train_one(params, train_path, val_path, os.cpu_count()) for params in param_sets]
+    threads = max(1, os.cpu_count() // workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(train_one, params, train_path, val_path, threads) for params in param_sets]
+        return [future.result() for future in futures]
+
+
+def train_ccs_block(train_df, val_df, model_dir, params, output_path, ccs_features_path=CCS_FEATURES_PATH):
+    """
+    Trains a booster on FEATURES plus the row-aligned sparse CCS block of each
+    split, with early stopping, and saves it to output_path.
+    """
+    from ccs_features import load_ccs_matrix, to_lgb_dataset
+
+    start = time.perf_counter()
+    ccs_columns = None
+    if os.path.exists(ccs_features_path):
+        with open(ccs_features_path) as f:
+            ccs_columns = json.load(f)
+    encoder = make_pipeline(BASE_PARAMS, 1).named_steps["enc"]
+    datasets = {}
+    for name, df in (("train", train_df), ("val", val_df)):
+        ccs_matrix = load_ccs_matrix(os.path.join(model_dir, f"ccs_{name}.npz"))
+        if ccs_matrix.shape[0] != len(df):
+            raise ValueError(f"ccs_{name}.npz has {ccs_matrix.shape[0]} rows but claims_{name} has {len(df)}")
+        if ccs_columns is not None and len(ccs_columns) != ccs_matrix.shape[1]:
+            ccs_columns = None
+        encoded = encoder.fit_transform(df[FEATURES]) if name == "train" else encoder.transform(df[FEATURES])
+        datasets[name] = to_lgb_dataset(
+            pd.DataFrame(encoded, columns=FEATURES), ccs_matrix, label=df[TARGET].to_numpy(), ccs_columns=ccs_columns,
+            categorical_feature=list(range(len(CATEGORICAL_FEATURES))), params=DATASET_PARAMS,
+            reference=datasets.get("train"))
+
+    booster = lgb.train(
+        params, datasets["train"], num_boost_round=MAX_ROUNDS, valid_sets=[datasets["val"]], valid_names=["valid"],
+        callbacks=[lgb.early_stopping(EARLY_STOPPING_ROUNDS, first_metric_only=True, verbose=False)],
+    )
+    booster.save_model(output_path, num_iteration=booster.best_iteration)
+    return {
+        "features": booster.num_feature(),
+        "best_iteration": booster.best_iteration,
+        "val_auc": booster.best_score["valid"]["auc"],
+        "seconds": round(time.perf_counter() - start, 3),
+        "artifact": output_path,
+    }
+
+
+def evaluate(pipeline, df, le):
+    X = df[FEATURES[:-1]].assign(icd_ccs_id_encoded=encode_ccs(le, df))
+    proba = pipeline.predict_proba(X)[:, 1]
+    return {"auc": round(float(roc_auc_score(df[TARGET], proba)), 5),
+            "pr_auc": round(float(average_precision_score(df[TARGET], proba)), 5)}
+
+
+def train(model_dir=MODEL_DIR, cache_dir=None, sweep=False, workers=None,
+          model_path=MODEL_PATH, label_encoder_path=LABEL_ENCODER_PATH, report_path=None, ccs_block=False):
+    """Runs the full training cycle and returns the timing/metrics report."""
+    workers = workers or os.cpu_count()
+    cache_dir = cache_dir or os.path.join(model_dir, "lgb_cache")
+    report_path = report_path or os.path.join(model_dir, "training_report.json")
+    timings = {}
+    start = phase = time.perf_counter()
+
+    def lap(name):
+        nonlocal phase
+        now = time.perf_counter()
+        timings[name] = round(now - phase, 3)
+        phase = now
+
+    train_df, train_path = read_split(model_dir, "train")
+    val_df, val_path = read_split(model_dir, "val")
+    if train_df is None or val_df is None:
+        raise FileNotFoundError(f"claims_train/claims_val splits not found in {model_dir}; "
+                                f"run pre-processor/data_processor.py first")
+    test_df, _ = read_split(model_dir, "test")
+    le = fit_ccs_encoder(train_df)
+    for df in (train_df, val_df):
+        df["icd_ccs_id_encoded"] = encode_ccs(le, df)
+    lap("load_splits")
+
+    # scale_pos_weight depends on the labels, so it is fixed per training set
+    neg, pos = int((train_df[TARGET] == 0).sum()), int((train_df[TARGET] == 1).sum())
+    base_params = {**BASE_PARAMS, "scale_pos_weight": neg / max(pos, 1)}
+
+    key = dataset_key([train_path, val_path], le)
+    train_bin, val_bin, cache_hit = build_datasets(train_df, val_df, le, cache_dir, key)
+    lap("datasets")
+
+    param_sets = list(sweep_params(base_params, SWEEP_GRID)) if sweep else [base_params]
+    results = run_sweep(param_sets, train_bin, val_bin, workers)
+    best_index = max(range(len(results)), key=lambda i: results[i]["val_auc"])
+    best, best_params = results[best_index], param_sets[best_index]
+    lap("sweep")
+
+    # Refit the serving pipeline at the early-stopped iteration count
+    pipeline = make_pipeline({**best_params, "n_jobs": -1}, best["best_iteration"])
+    pipeline.fit(train_df[FEATURES], train_df[TARGET], clf__categorical_feature=list(range(len(CATEGORICAL_FEATURES))))
+    lap("refit")
+
+    metrics = {"val": evaluate(pipeline, val_df, le)}
+    if test_df is not None:
+        metrics["test"] = evaluate(pipeline, test_df, le)
+    lap("evaluate")
+
+    ccs_report = None
+    if ccs_block:
+        ccs_report = train_ccs_block(train_df, val_df, model_dir, best_params,
+                                     os.path.join(model_dir, "denial_risk_model_ccs.txt"))
+        lap("ccs_block")
+
+    joblib.dump(pipeline, model_path)
+    joblib.dump(le, label_encoder_path)
+    lap("save")
+    timings["total"] = round(time.perf_counter() - start, 3)
+
+    report = {
+        "train_rows": len(train_df), "val_rows": len(val_df),
+        "dataset_key": key, "dataset_cache_hit": cache_hit,
+        "workers": min(workers, len(param_sets)), "cpu_count": os.cpu_count(),
+        "best": best, "metrics": metrics, "ccs_block": ccs_report, "timings_s": timings,
+        "sweep": sorted(results, key=lambda r: -r["val_auc"]),
+        "artifacts": [model_path, label_encoder_path],
+    }
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the denial-risk model and write the serving artifacts.")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="directory holding the claims_* splits")
+    parser.add_argument("--cache-dir", default=None,
+                        help="binary Dataset cache used by the early-stopping runs and the sweep; the serving "
+                             "pipeline is refit from the splits (default: <model-dir>/lgb_cache)")
+    parser.add_argument("--sweep", action="store_true", help="train the SWEEP_GRID parameter sets and keep the best")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parallel sweep workers")
+    parser.add_argument("--ccs-block", action="store_true",
+                        help="also train a booster with the sparse CCS block (ccs_<split>.npz) and report its AUC")
+    parser.add_argument("--model-output", default=MODEL_PATH)
+    parser.add_argument("--label-encoder-output", default=LABEL_ENCODER_PATH)
+    parser.add_argument("--report", default=None, help="timing report (default: <model-dir>/training_report.json)")
+    args = parser.parse_args(argv)
+
+    report = train(args.model_dir, args.cache_dir, args.sweep, args.workers,
+                   args.model_output, args.label_encoder_output, args.report, args.ccs_block)
+    best = report["best"]
+    print(f"Datasets {'loaded from cache' if report['dataset_cache_hit'] else 'built'} (key {report['dataset_key']})")
+    if args.sweep:
+        print(f"Swept {len(report['sweep'])} parameter sets on {report['workers']} worker(s); "
+              f"best {best['params']} at iteration {best['best_iteration']} (val AUC {best['val_auc']:.4f})")
+    else:
+        print(f"Early stopping at iteration {best['best_iteration']} (val AUC {best['val_auc']:.4f})")
+    for split, m in report["metrics"].items():
+        print(f"{split}: AUC {m['auc']:.4f}, PR-AUC {m['pr_auc']:.4f}")
+    if report["ccs_block"]:
+        ccs = report["ccs_block"]
+        print(f"With the CCS block ({ccs['features']} features): val AUC {ccs['val_auc']:.4f} at iteration "
+              f"{ccs['best_iteration']}; saved {ccs['artifact']}")
+    print("Timings: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in report["timings_s"].items()))
+    print(f"Saved {args.model_output} and {args.label_encoder_output}")
+
+
+if __name__ == "__main__":
+    main()
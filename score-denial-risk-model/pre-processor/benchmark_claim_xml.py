@@ -0,0 +1,247 @@
+"""
+Per-message micro-benchmark for the claim XML passes. Generates synthetic claims
+with a growing number of service lines, checks the current implementation
+against the original one (kept below as the reference) and reports microseconds
+per message for each, on lxml and ElementTree trees (parsing excluded).
+
+    python pre-processor/benchmark_claim_xml.py [--services 1 10 50 200 1000] [--repeat 200]
+"""
+
+import argparse
+import random
+import time
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+from lxml import etree
+
+from claim_message_engine import FEATURE_MAPPING_FILE
+from extract_features import compile_feature_mapping, extract_features_from_tree, read_feature_mapping
+from scrub_claim import scrub_tree
+
+
+def _attrs(values):
+    return ' '.join(f'{name}={quoteattr(str(value))}' for name, value in values.items())
+
+
+def make_claim_xml(services, seed=0):
+    """Returns a synthetic claim message with the given number of service lines."""
+    rng = random.Random(seed)
+    service_lines = ''.join(
+        f'<service {_attrs({"service-id": i, "procedure-code": rng.choice(["99213", "99214", "80050", "J3301"]), "procedure-modifier-1": "25", "service-charge-amount": "125.00", "service-units": "UN", "service-unit-count": "1", "service-date": "2024-03-01", "place-of-service-code": "11", "ordering-provider-npi": "1234567890", "ordering-provider-state": "CA", "ordering-provider-zipcode": "94110"})}>'
+        f'<provider {_attrs({"first-name": "Ada", "last-name": "Lovelace", "npi": "1234567890", "street-1": "1 Main St", "city": "Oakland", "state": "CA", "zip": "94601"})}/>'
+        f'<secondaryident {_attrs({"provider-id": "X12", "qualifier": "G2"})}/>'
+        '</service>'
+        for i in range(services)
+    )
+    diagnoses = {f'diagnosis-{i}': f'E11.{i}' for i in range(1, rng.randint(2, 11))}
+    return (
+        '<claim-message>'
+        f'<transaction {_attrs({"submitter-name": "Clinic", "submitter-contact-name": "Jo", "submitter-contact-phone": "5551234", "submitter-contact-email": "jo@example.com", "receiver-name": "Clearinghouse"})}>'
+        f'<billing {_attrs({"name": "Clinic", "street-1": "2 Side St", "city": "Oakland", "state": "CA", "zip": "94601", "payto-npi": "1112223334", "payto-state": "CA", "payto-zip": "94601"})}>'
+        f'<secondaryident {_attrs({"provider-id": "B1", "payto-provider-id": "B2"})}/></billing>'
+        f'<subscriber {_attrs({"first-name": "Jane", "last-name": "Doe", "policy-number": "P123", "payer-name": "Aetna", "payer-identifier": "60054", "relation-to-insured-code": "18", "payer-responsibility-code": "P", "plan-name": "PPO", "city": "Oakland"})}>'
+        f'<patient {_attrs({"first-name": "Jane", "last-name": "Doe", "gender": "F", "birth-date": "1980-01-01", "zip": "94601"})}/>'
+        f'<otherpayercob {_attrs({"first-name": "John", "last-name": "Doe", "policy-number": "Q9"})}/>'
+        f'<claim {_attrs({"claim-id": seed, "rendering-provider-npi": "9998887776", "rendering-provider-specialty-code": "207Q00000X", "referring-provider-npi": "5554443332", "service-facility-state": "CA", "service-facility-zip": "94601", **diagnoses})}>'
+        f'<rendering-provider {_attrs({"first-name": "Ren", "last-name": "Der", "npi": "9998887776"})}/>'
+        f'<referring-provider {_attrs({"first-name": "Ref", "last-name": "Err", "npi": "5554443332"})}/>'
+        f'{service_lines}</claim></subscriber></transaction></claim-message>'
+    )
+
+
+# Edge cases for the equivalence checks: missing elements, services outside a
+# claim, several claims, elements named like the root, and repeated elements.
+EDGE_CASES = [
+    '<claim-message/>',
+    '<claim-message><subscriber payer-name="A"/><service procedure-code="1"/></claim-message>',
+    '<m><claim claim-id="1"><service procedure-code="1"/></claim><claim claim-id="2">'
+    '<service procedure-code="2"/><x><service procedure-code="3"/></x></claim></m>',
+    '<claim claim-id="root"><service procedure-code="1"/><claim claim-id="inner"><service procedure-code="2"/>'
+    '</claim></claim>',
+    '<m><billing payto-npi="1"/><x><billing payto-npi="2"/></x><patient/><!-- note --><patient gender="M"/></m>',
+    '<patient first-name="Root"><patient first-name="A" zip="1"/><patient first-name="B"/>'
+    '<provider npi="1" city="X" other="keep"/><provider npi="2"/></patient>',
+]
+
+
+def legacy_extract_features(root, feature_mapping):
+    """extract_features_from_xml before the table-driven walk (after parsing)."""
+    features = {feature: '' for feature in feature_mapping}
+
+    subscriber = root.find('.//subscriber')
+    if subscriber is not None:
+        features['payer-name'] = subscriber.get('payer-name', '')
+        features['payer-responsibility-code'] = subscriber.get('payer-responsibility-code', '')
+        features['payer-identifier'] = subscriber.get('payer-identifier', '')
+        features['relation-to-insured'] = subscriber.get('relation-to-insured-code', '')
+
+    billing = root.find('.//billing')
+    if billing is not None:
+        features['billing-npi'] = billing.get('payto-npi', '')
+        features['billing-state'] = billing.get('payto-state', '')
+        features['billing-zip'] = billing.get('payto-zip', '')
+
+    patient = root.find('.//patient')
+    if patient is not None:
+        features['patient-gender'] = patient.get('gender', '')
+        features['patient-birth-date'] = patient.get('birth-date', '')
+
+    claim = root.find('.//claim')
+    if claim is not None:
+        features['claim-id'] = claim.get('claim-id', '')
+        features['rendering-provider-specialty-code'] = claim.get('rendering-provider-specialty-code', '')
+        features['rendering-provider-npi'] = claim.get('rendering-provider-npi', '')
+        features['referring-provider-npi'] = claim.get('referring-provider-npi', '')
+        features['service-facility-state'] = claim.get('service-facility-state', '')
+        features['service-facility-zip'] = claim.get('service-facility-zip', '')
+
+        for i in range(1, 11):
+            diag_code = claim.get('diagnosis-' + str(i), '')
+            features['diagnosis-' + str(i)] = diag_code
+
+    services = root.findall('.//claim/service')
+    if services:
+        first_service = services[0]
+        features['service-id'] = first_service.get('service-id', '')
+        features['procedure-code'] = first_service.get('procedure-code', '')
+        features['procedure-modifier-1'] = first_service.get('procedure-modifier-1', '')
+        features['procedure-modifier-2'] = first_service.get('procedure-modifier-2', '')
+        features['procedure-modifier-3'] = first_service.get('procedure-modifier-3', '')
+        features['procedure-modifier-4'] = first_service.get('procedure-modifier-4', '')
+        features['service-charge-amount'] = first_service.get('service-charge-amount', '')
+        features['service-units'] = first_service.get('service-units', '')
+        features['service-unit-count'] = first_service.get('service-unit-count', '')
+        features['service-start-date'] = first_service.get('service-date', '')
+        features['place-of-service-code'] = first_service.get('place-of-service-code', '')
+        features['drug-ndc-code'] = first_service.get('drug-ndc-code', '')
+        features['ordering-provider-npi'] = first_service.get('ordering-provider-npi', '')
+        features['ordering-provider-state'] = first_service.get('ordering-provider-state', '')
+        features['ordering-provider-zipcode'] = first_service.get('ordering-provider-zipcode', '')
+
+        for i, service in enumerate(services):
+            if i < 10:
+                features[f'procedure-{i+1}'] = service.get('procedure-code', '')
+            else:
+                break
+
+    return [features]
+
+
+def legacy_scrub_tree(root):
+    """scrub_xml_data before the single-walk policy table (after parsing)."""
+    # Scrub patient node
+    patient = root.find('.//patient')
+    if patient is not None:
+        for attr in ['first-name', 'last-name', 'street-1', 'city', 'state', 'zip']:
+            if attr in patient.attrib:
+                patient.set(attr, 'REDACTED')
+
+    # Scrub subscriber node
+    subscriber = root.find('.//subscriber')
+    if subscriber is not None:
+        for attr in ['first-name', 'last-name', 'policy-number', 'street-1', 'city', 'state', 'zip', 'plan-name', 'payer-name']:
+            if attr in subscriber.attrib:
+                subscriber.set(attr, 'REDACTED')
+
+    # Scrub otherpayercob nodes
+    for otherpayer in root.findall('.//otherpayercob'):
+        for attr in ['first-name', 'last-name', 'policy-number', 'street-1', 'city', 'state', 'zip']:
+            if attr in otherpayer.attrib:
+                otherpayer.set(attr, 'REDACTED')
+
+    # Scrub transaction node
+    transaction = root.find('.//transaction')
+    if transaction is not None:
+        for attr in ['submitter-name', 'submitter-contact-name', 'submitter-contact-phone', 'submitter-contact-email', 'submitter-contact-fax', 'receiver-name']:
+            if attr in transaction.attrib:
+                transaction.set(attr, 'REDACTED')
+
+    # Scrub billing nodes
+    for billing in root.findall('.//billing'):
+        for attr in ['name', 'street-1', 'street-2', 'city', 'state', 'zip', 'payto-name', 'payto-street-1', 'payto-street-2', 'payto-city', 'payto-state', 'payto-zip']:
+            if attr in billing.attrib:
+                billing.set(attr, 'REDACTED')
+
+    # Scrub secondaryident nodes
+    for secondaryident in root.findall('.//secondaryident'):
+        for attr in ['provider-id', 'payto-provider-id']:
+            if attr in secondaryident.attrib:
+                secondaryident.set(attr, 'REDACTED')
+
+    # Scrub provider nodes
+    provider_tags = ['provider', 'rendering-provider', 'referring-provider']
+    for tag in provider_tags:
+        for provider_node in root.findall('.//' + tag):
+            for attr in ['first-name', 'last-name', 'street-1', 'city', 'state', 'zip', 'npi']:
+                if attr in provider_node.attrib:
+                    provider_node.set(attr, 'REDACTED')
+
+
+def time_per_message(function, payloads, repeat, rounds=5):
+    """Best-of-rounds microseconds per call, to keep scheduler noise out of the comparison."""
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for payload in payloads:
+                function(payload)
+        best = min(best, time.perf_counter() - start)
+    return best / (repeat * len(payloads)) * 1e6
+
+
+def benchmark_extract(service_counts, repeat):
+    feature_mapping = compile_feature_mapping(read_feature_mapping(FEATURE_MAPPING_FILE))
+    feature_names = feature_mapping.feature_names
+    parsers = {
+        'lxml': lambda payload: etree.fromstring(payload.encode('utf-8')),  # extract_features_from_xml
+        'ElementTree': ET.fromstring,  # claim_message_engine.py
+    }
+
+    payloads = EDGE_CASES + [make_claim_xml(n, seed) for n in service_counts for seed in range(5)]
+    for parse in parsers.values():
+        for payload in payloads:
+            root = parse(payload)
+            assert extract_features_from_tree(root, feature_mapping) == legacy_extract_features(root, feature_names), \
+                f'Feature rows differ for {payload[:80]}'
+    print(f'extract: table-driven output matches the original on {len(payloads)} claims')
+
+    for name, parse in parsers.items():
+        print(f"\n{name} tree{'services':>12}{'original us':>14}{'table us':>12}{'speedup':>10}")
+        for services in service_counts:
+            roots = [parse(make_claim_xml(services, seed)) for seed in range(5)]
+            legacy = time_per_message(lambda root: legacy_extract_features(root, feature_names), roots, repeat)
+            current = time_per_message(lambda root: extract_features_from_tree(root, feature_mapping), roots, repeat)
+            print(f"{'':{len(name) + 5}}{services:>12}{legacy:>14.1f}{current:>12.1f}{legacy / current:>9.2f}x")
+
+
+def benchmark_scrub(service_counts, repeat):
+    payloads = EDGE_CASES + [make_claim_xml(n, seed) for n in service_counts for seed in range(5)]
+    for payload in payloads:
+        current, legacy = ET.fromstring(payload), ET.fromstring(payload)
+        scrub_tree(current)
+        legacy_scrub_tree(legacy)
+        assert ET.tostring(current, encoding='unicode') == ET.tostring(legacy, encoding='unicode'), \
+            f'Scrubbed XML differs for {payload[:80]}'
+    print(f'\nscrub: single-walk output matches the original on {len(payloads)} claims')
+
+    # Scrubbing an already scrubbed tree redoes the same work, so trees are reused across repeats
+    print(f"\n{'services':>8}{'original us':>14}{'policy us':>12}{'speedup':>10}")
+    for services in service_counts:
+        roots = [ET.fromstring(make_claim_xml(services, seed)) for seed in range(5)]
+        legacy = time_per_message(legacy_scrub_tree, roots, repeat)
+        current = time_per_message(scrub_tree, roots, repeat)
+        print(f'{services:>8}{legacy:>14.1f}{current:>12.1f}{legacy / current:>9.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--services', type=int, nargs='+', default=[1, 10, 50, 200, 1000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    benchmark_extract(args.services, args.repeat)
+    benchmark_scrub(args.services, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
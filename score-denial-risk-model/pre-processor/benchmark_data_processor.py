@@ -0,0 +1,118 @@
+"""
+Memory/throughput benchmark for data_processor.py: checks that the in-memory and
+the chunked pipeline produce the same claims and CCS blocks on data/claim_data.csv
+(which has malformed rows) and on a synthetic file, then runs both modes on a
+larger synthetic file and reports wall time, claims/s and peak RSS.
+
+Run from the score-denial-risk-model directory:
+    python pre-processor/benchmark_data_processor.py --rows 2000000 --chunksize 200000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from data_processor import CCS_FILE_PATH, INPUT_CLAIMS_FILE, load_ccs_mapping, run_chunked, run_in_memory
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_processor.py")
+
+
+def write_synthetic_claims(path, rows, ccs_file, seed=0, chunk=500_000):
+    codes = load_ccs_mapping(ccs_file)["icd10"].dropna().to_numpy()
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk):
+        n = min(chunk, rows - start)
+        icd_count = rng.integers(1, 4, n)
+        picks = codes[rng.integers(0, len(codes), (n, 3))]
+        icd_list = ["['" + "', '".join(p[:c]) + "']" for p, c in zip(picks, icd_count)]
+        pd.DataFrame({
+            "cpt": rng.integers(99203, 99208, n),
+            "payer": rng.choice(["Aetna", "BlueCross", "UHC", "Cigna"], n),
+            "pos": rng.integers(11, 13, n),
+            "duration": rng.integers(15, 36, n),
+            "icd_count": icd_count,
+            "modifier_count": rng.integers(0, 3, n),
+            "has_modifier_25": rng.integers(0, 2, n),
+            "procedures_count": rng.integers(1, 5, n),
+            "denied": rng.integers(0, 2, n),
+            "primary_icd": picks[:, 0],
+            "icd_list": icd_list,
+            "secondary_cpt": rng.integers(80050, 80151, n),
+        }).to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+
+def check_equivalence(input_file, ccs_file, chunksize, workers, work_dir):
+    """Runs both modes up to the DuckDB claims table and compares the results."""
+    ccs_df = load_ccs_mapping(ccs_file)
+    con_memory, con_chunked = duckdb.connect(), duckdb.connect()
+    take_memory, labels_memory = run_in_memory(con_memory, input_file, ccs_df)
+    take_chunked, labels_chunked = run_chunked(con_chunked, input_file, ccs_df, ccs_file,
+                                               chunksize, workers, work_dir)
+    claims_memory = con_memory.execute("SELECT * FROM claims ORDER BY claim_row").fetchdf()
+    claims_chunked = con_chunked.execute("SELECT * FROM claims ORDER BY claim_row").fetchdf()
+    rows = np.arange(len(claims_memory))
+
+    assert labels_memory == labels_chunked, "CCS labels differ"
+    pd.testing.assert_frame_equal(claims_memory, claims_chunked, check_dtype=False)
+    assert (take_memory(rows) != take_chunked(rows)).nnz == 0, "CCS matrices differ"
+    print(f"Equivalence check passed on {len(claims_memory)} claims")
+
+
+def run_mode(input_file, ccs_file, output_dir, extra_args):
+    """Runs data_processor.py in a child process; returns (seconds, peak RSS MB incl. workers)."""
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, SCRIPT, "--input", input_file, "--ccs-file", ccs_file,
+                             "--output-dir", output_dir, *extra_args], cwd=output_dir)
+    _, status, usage = os.wait4(proc.pid, 0)
+    if status != 0:
+        raise RuntimeError(f"data_processor.py exited with status {status}")
+    # ru_maxrss is reported in kilobytes on Linux
+    return time.perf_counter() - start, usage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--ccs-file", default=CCS_FILE_PATH)
+    parser.add_argument("--claims-file", default=INPUT_CLAIMS_FILE,
+                        help="Real claims file checked for equivalence with a small chunk size.")
+    args = parser.parse_args()
+    ccs_file = os.path.abspath(args.ccs_file)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if os.path.exists(args.claims_file):
+            check_equivalence(os.path.abspath(args.claims_file), ccs_file, 100, min(args.workers, 4), work_dir)
+        small_file = os.path.join(work_dir, "claims_small.csv")
+        write_synthetic_claims(small_file, 20_000, ccs_file)
+        check_equivalence(small_file, ccs_file, 3_000, min(args.workers, 4), work_dir)
+
+        input_file = os.path.join(work_dir, "claims.csv")
+        print(f"Generating {args.rows:,} synthetic claims")
+        write_synthetic_claims(input_file, args.rows, ccs_file)
+
+        results = []
+        for name, extra_args in [
+            ("in-memory", []),
+            (f"chunked x{args.workers}", ["--chunksize", str(args.chunksize), "--workers", str(args.workers)]),
+        ]:
+            output_dir = os.path.join(work_dir, name.split()[0])
+            os.makedirs(output_dir)
+            seconds, peak_mb = run_mode(input_file, ccs_file, output_dir, extra_args)
+            results.append((name, seconds, peak_mb))
+
+    print(f"\n{'mode':<16}{'seconds':>10}{'claims/s':>14}{'peak RSS MB':>14}")
+    for name, seconds, peak_mb in results:
+        print(f"{name:<16}{seconds:>10.1f}{args.rows / seconds:>14,.0f}{peak_mb:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Columnar warehouse for the clearinghouse extracts, as an alternative to the
+row-oriented claims.db built by create_and_load_db.py.
+
+* claim_features lines are written as Parquet under <warehouse>/claim_features,
+  hive-partitioned by year and month of service_start_date
+* payer_gateway_responses and claim_status are typed tables in <warehouse>/warehouse.duckdb
+* claim_denial_labels materializes each claim's final adjudication: the latest
+  payer gateway response per ClaimK9Number, joined to the latest claim_status row
+  for its clearinghouse tracking number, with a denied flag from DENIAL_PATTERNS
+
+Each refresh only reads source rows at or past the per-source watermark and
+recomputes the labels of the claims those rows touch. Rows at the watermark that
+are already stored (same key and watermark value) are skipped, so late rows
+sharing the latest timestamp are still picked up. Rows with a NULL watermark
+cannot be ordered; they are compared by key against the stored NULL-watermark
+rows on every refresh. Run from the directory holding the
+extracts (see create_and_load_db.SOURCES):
+
+    python pre-processor/build_claims_warehouse.py [--warehouse warehouse] [--denial-pattern DENI ...]
+"""
+
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import time
+from datetime import date
+
+import duckdb
+
+from create_and_load_db import SOURCES, create_tables
+
+# Status text matched case-insensitively against STATUS_COLUMNS to flag a denial
+DENIAL_PATTERNS = ['DENI', 'REJECT']
+
+# Final adjudication columns searched for DENIAL_PATTERNS (p = payer gateway response, s = claim status)
+STATUS_COLUMNS = [
+    'p.PayerProcessingStatus',
+    's.PAYERPROCESSINGSTATUS',
+    's.PAYERPROCESSINGSTATUSTYPEDESC',
+    's.CLEARINGHOUSEPROCESSINGSTATUS',
+    's.CURRENTCLEARINGHOUSEPROCESSINGSTATUS',
+]
+
+# Change-tracking expression per source; a refresh reads rows newer than the last value seen
+WATERMARKS = {
+    'claim_features': 'startedutc',
+    'payer_gateway_responses': 'COALESCE(CreatedDate, TransactionTimestamp)',
+    'claim_status': 'COALESCE(MODIFIEDDATE, CREATEDDATE)',
+}
+
+# Columns identifying a source row version, used to skip rows re-read at the watermark
+WATERMARK_KEYS = {
+    'claim_features': ['ClaimMessageId', 'service_id'],
+    'payer_gateway_responses': ['PayerGatewayResponseId'],
+    'claim_status': ['CLAIMID', 'ENCOUNTERPROCEDUREID'],
+}
+
+# SQLite declared types in create_and_load_db.py -> DuckDB types
+DUCKDB_TYPES = {
+    'INTEGER': 'BIGINT',
+    'REAL': 'DOUBLE',
+    'TEXT': 'VARCHAR',
+    'DATE': 'DATE',
+    'DATETIME': 'TIMESTAMP',
+}
+
+REFRESH_FILE = re.compile(r'r(\d{6})_[0-9a-f-]+\.parquet$')
+
+
+def source_schemas():
+    """Returns {table: [(column, duckdb_type)]} from the SQLite schema in create_and_load_db.py."""
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    schemas = {
+        table: [(row[1], DUCKDB_TYPES[row[2]]) for row in conn.execute(f'PRAGMA table_info({table})')]
+        for table, _ in SOURCES
+    }
+    conn.close()
+    return schemas
+
+
+def typed_select(columns):
+    """Casts the all-VARCHAR CSV columns to their warehouse types; unparseable values become NULL."""
+    return ', '.join(
+        f'"{name}"' if col_type == 'VARCHAR' else f'TRY_CAST(NULLIF(TRIM("{name}"), \'\') AS {col_type}) AS "{name}"'
+        for name, col_type in columns
+    )
+
+
+def denial_expression(patterns):
+    matches = [f"{column} ILIKE '%' || ? || '%'" for column in STATUS_COLUMNS for _ in patterns]
+    params = [pattern for _ in STATUS_COLUMNS for pattern in patterns]
+    return f"CASE WHEN {' OR '.join(matches)} THEN 1 ELSE 0 END", params
+
+
+def init_warehouse(con, schemas):
+    for table in ('payer_gateway_responses', 'claim_status'):
+        columns = ', '.join(f'"{name}" {col_type}' for name, col_type in schemas[table])
+        con.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS claim_denial_labels (
+            ClaimK9Number VARCHAR PRIMARY KEY,
+            PayerGatewayResponseId BIGINT,
+            ClearinghouseTrackingNumber VARCHAR,
+            PayerName VARCHAR,
+            response_timestamp TIMESTAMP,
+            payer_processing_status VARCHAR,
+            payer_processing_status_type_code VARCHAR,
+            claim_status_name VARCHAR,
+            clearinghouse_processing_status VARCHAR,
+            denied INTEGER,
+            refresh_id INTEGER)
+    """)
+    con.execute("CREATE TABLE IF NOT EXISTS warehouse_watermark (source VARCHAR PRIMARY KEY, watermark TIMESTAMP)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS warehouse_refreshes (
+            refresh_id INTEGER PRIMARY KEY, finished_at TIMESTAMP,
+            claim_lines BIGINT, responses BIGINT, statuses BIGINT, labels BIGINT)
+    """)
+
+
+def remove_uncommitted_files(features_dir, last_refresh_id):
+    """Deletes Parquet files left by a refresh that failed before its commit."""
+    for path in glob.glob(os.path.join(features_dir, '**', '*.parquet'), recursive=True):
+        match = REFRESH_FILE.search(os.path.basename(path))
+        if match and int(match.group(1)) > last_refresh_id:
+            os.remove(path)
+
+
+def stage_new_rows(con, table, path, columns, stored=None):
+    """
+    Stages the rows of a source CSV at or past its watermark, or with a NULL
+    watermark, into new_<table>, minus those already in stored (a relation over
+    the ingested rows, None if there are none). Returns the number staged.
+    """
+    watermark = con.execute('SELECT watermark FROM warehouse_watermark WHERE source = ?', [table]).fetchone()
+    watermark = watermark and watermark[0]
+    expression = WATERMARKS[table]
+    staged = f"""
+        SELECT *, {expression} AS _watermark FROM (
+            SELECT {typed_select(columns)}
+            FROM read_csv(?, header = true, all_varchar = true, quote = '"', escape = '"')
+        )
+        WHERE ? IS NULL OR {expression} >= ? OR {expression} IS NULL
+    """
+    params = [path, watermark, watermark]
+    if stored is not None and watermark is not None:
+        keys = WATERMARK_KEYS[table]
+        matches = ' AND '.join(f'n."{key}" IS NOT DISTINCT FROM s."{key}"' for key in keys + ['_watermark'])
+        staged = f"""
+            SELECT n.* FROM ({staged}) n
+            ANTI JOIN (
+                SELECT {', '.join(f'"{key}"' for key in keys)}, {expression} AS _watermark FROM {stored}
+                WHERE {expression} >= ? OR {expression} IS NULL
+            ) s ON {matches}
+        """
+        params.append(watermark)
+    con.execute(f'CREATE OR REPLACE TEMP TABLE new_{table} AS SELECT * EXCLUDE (_watermark) FROM ({staged})', params)
+    return con.execute(f'SELECT COUNT(*) FROM new_{table}').fetchone()[0]
+
+
+def stored_rows(table, features_dir):
+    """The relation holding the committed rows of a source, or None before its first rows."""
+    if table != 'claim_features':
+        return table
+    pattern = os.path.join(features_dir, '*', '*', '*.parquet')
+    return f"read_parquet('{pattern}', hive_partitioning = true)" if glob.glob(pattern) else None
+
+
+def write_claim_lines(con, features_dir, refresh_id):
+    """Appends the staged claim lines to the year/month partitioned Parquet dataset."""
+    os.makedirs(features_dir, exist_ok=True)
+    con.execute(f"""
+        COPY (
+            SELECT *, year(service_start_date) AS year, month(service_start_date) AS month
+            FROM new_claim_features
+        ) TO '{features_dir}' (FORMAT PARQUET, PARTITION_BY (year, month), APPEND,
+                               FILENAME_PATTERN 'r{refresh_id:06d}_{{uuid}}')
+    """)
+
+
+def refresh_labels(con, refresh_id, patterns, full):
+    """
+    Recomputes claim_denial_labels for every claim (full) or only for the claims
+    touched by the staged responses and statuses; returns the number of labels written.
+    """
+    if full:
+        con.execute('CREATE OR REPLACE TEMP TABLE affected AS '
+                    'SELECT DISTINCT ClaimK9Number FROM payer_gateway_responses')
+    else:
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE affected AS
+            SELECT ClaimK9Number FROM new_payer_gateway_responses
+            UNION
+            SELECT p.ClaimK9Number
+            FROM payer_gateway_responses p
+            JOIN new_claim_status s ON p.ClearinghouseTrackingNumber = s.CLEARINGHOUSETRACKINGNUMBER
+        """)
+    con.execute('DELETE FROM claim_denial_labels WHERE ClaimK9Number IN (SELECT ClaimK9Number FROM affected)')
+
+    denied, params = denial_expression(patterns)
+    con.execute(f"""
+        INSERT INTO claim_denial_labels
+        WITH latest_response AS (
+            SELECT * FROM payer_gateway_responses
+            WHERE ClaimK9Number IN (SELECT ClaimK9Number FROM affected)
+            QUALIFY row_number() OVER (
+                PARTITION BY ClaimK9Number
+                ORDER BY TransactionTimestamp DESC NULLS LAST, CreatedDate DESC NULLS LAST,
+                         PayerGatewayResponseId DESC NULLS LAST) = 1
+        ),
+        latest_status AS (
+            SELECT * FROM claim_status
+            WHERE CLEARINGHOUSETRACKINGNUMBER IN (SELECT ClearinghouseTrackingNumber FROM latest_response)
+            QUALIFY row_number() OVER (
+                PARTITION BY CLEARINGHOUSETRACKINGNUMBER
+                ORDER BY MODIFIEDDATE DESC NULLS LAST, CREATEDDATE DESC NULLS LAST) = 1
+        )
+        SELECT p.ClaimK9Number, p.PayerGatewayResponseId, p.ClearinghouseTrackingNumber, p.PayerName,
+               p.TransactionTimestamp, p.PayerProcessingStatus, p.PayerProcessingStatusTypeCode,
+               s.STATUSNAME, s.CLEARINGHOUSEPROCESSINGSTATUS,
+               {denied}, ?
+        FROM latest_response p
+        LEFT JOIN latest_status s ON p.ClearinghouseTrackingNumber = s.CLEARINGHOUSETRACKINGNUMBER
+        WHERE p.ClaimK9Number IS NOT NULL
+    """, params + [refresh_id])
+    return con.execute('SELECT COUNT(*) FROM claim_denial_labels WHERE refresh_id = ?', [refresh_id]).fetchone()[0]
+
+
+def refresh_warehouse(warehouse_dir='warehouse', patterns=DENIAL_PATTERNS, full=False):
+    """Ingests the source rows past each watermark and refreshes the affected denial labels."""
+    start = time.perf_counter()
+    os.makedirs(warehouse_dir, exist_ok=True)
+    features_dir = os.path.join(warehouse_dir, 'claim_features')
+    schemas = source_schemas()
+    con = duckdb.connect(os.path.join(warehouse_dir, 'warehouse.duckdb'))
+    init_warehouse(con, schemas)
+
+    last_refresh_id = con.execute('SELECT COALESCE(MAX(refresh_id), 0) FROM warehouse_refreshes').fetchone()[0]
+    refresh_id = last_refresh_id + 1
+    remove_uncommitted_files(features_dir, last_refresh_id)
+
+    counts = {table: stage_new_rows(con, table, path, schemas[table], stored_rows(table, features_dir))
+              for table, path in SOURCES}
+    for table, count in counts.items():
+        print(f'{table}: {count} new rows')
+    if counts['claim_features']:
+        write_claim_lines(con, features_dir, refresh_id)
+
+    # The Parquet files above only count once this transaction records the refresh
+    con.execute('BEGIN')
+    for table in ('payer_gateway_responses', 'claim_status'):
+        con.execute(f'INSERT INTO {table} SELECT * FROM new_{table}')
+    labels = refresh_labels(con, refresh_id, patterns, full)
+    for table, _ in SOURCES:
+        con.execute(f"""
+            INSERT INTO warehouse_watermark
+            SELECT ?, MAX({WATERMARKS[table]}) FROM new_{table} HAVING COUNT({WATERMARKS[table]}) > 0
+            ON CONFLICT (source) DO UPDATE SET watermark = EXCLUDED.watermark
+        """, [table])
+    con.execute('INSERT INTO warehouse_refreshes VALUES (?, now(), ?, ?, ?, ?)',
+                [refresh_id, counts['claim_features'], counts['payer_gateway_responses'],
+                 counts['claim_status'], labels])
+    con.execute('COMMIT')
+    con.close()
+
+    elapsed = time.perf_counter() - start
+    rows = sum(counts.values())
+    print(f'Refresh {refresh_id}: {rows} rows and {labels} labels in {elapsed:.1f}s '
+          f'({rows / max(elapsed, 1e-9):,.0f} rows/s)')
+    return refresh_id
+
+
+def load_training_set(start, end, warehouse_dir='warehouse', con=None):
+    """
+    Returns the labeled claim lines with service_start_date in [start, end] as a
+    DataFrame. Only the year/month partitions overlapping the range are read.
+    """
+    start, end = date.fromisoformat(str(start)), date.fromisoformat(str(end))
+    own_con = con is None
+    con = con or duckdb.connect(os.path.join(warehouse_dir, 'warehouse.duckdb'), read_only=True)
+    features = os.path.join(warehouse_dir, 'claim_features', '*', '*', '*.parquet')
+    df = con.execute("""
+        SELECT f.* EXCLUDE (year, month), l.* EXCLUDE (ClaimK9Number, refresh_id)
+        FROM read_parquet(?, hive_partitioning = true, hive_types = {'year': INTEGER, 'month': INTEGER}) f
+        JOIN claim_denial_labels l ON f.ClaimK9Number = l.ClaimK9Number
+        WHERE f.year * 12 + f.month BETWEEN ? AND ?
+          AND f.service_start_date BETWEEN ? AND ?
+    """, [features, start.year * 12 + start.month, end.year * 12 + end.month, start, end]).fetchdf()
+    if own_con:
+        con.close()
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds or refreshes the columnar claims warehouse.')
+    parser.add_argument('--warehouse', default='warehouse')
+    parser.add_argument('--denial-pattern', action='append', dest='patterns',
+                        help=f'status text marking a denial, repeatable (default: {" ".join(DENIAL_PATTERNS)})')
+    parser.add_argument('--full-labels', action='store_true',
+                        help='recompute every denial label, e.g. after changing --denial-pattern')
+    args = parser.parse_args(argv)
+    refresh_warehouse(args.warehouse, args.patterns or DENIAL_PATTERNS, args.full_labels)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import ast
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def parse_icd_list(icd_raw):
+    """Parses one raw icd_list value into normalized ICD codes ([] if unparseable)."""
+    if pd.isnull(icd_raw): return []
+    try:
+        codes = ast.literal_eval(icd_raw) if isinstance(icd_raw, str) else icd_raw
+        return [code.replace(".", "").upper().strip() for code in codes]
+    except Exception:
+        return []
+
+
+# Plain single-quoted lists such as "['E11.9', 'Z79.4']" (no escapes) can be split
+# without literal_eval; anything else falls back to parse_icd_list.
+_SIMPLE_ICD_LIST = re.compile(r"\[\s*(?:'[^'\\]*'\s*(?:,\s*'[^'\\]*'\s*)*)?\]")
+_QUOTED_CODE = re.compile(r"'([^']*)'")
+
+
+def _parse_icd_list_fast(icd_raw):
+    if isinstance(icd_raw, str) and _SIMPLE_ICD_LIST.fullmatch(icd_raw):
+        return [code.replace(".", "").upper().strip() for code in _QUOTED_CODE.findall(icd_raw)]
+    return parse_icd_list(icd_raw)
+
+
+def build_ccs_multi_hot(icd_lists, ccs_df, labels=None):
+    """
+    Expands each claim's ICD list to its set of CCS labels in one pass:
+    parse each distinct icd_list once, explode to (claim, icd) pairs, hash-join
+    against the CCSR table and scatter the pairs into a sparse claim x label matrix.
+    Returns the uint8 CSR matrix and the sorted label list. Pass labels to use a
+    fixed column vocabulary (e.g. across chunks) instead of the observed labels.
+    """
+    parsed = icd_lists.map({raw: _parse_icd_list_fast(raw) for raw in icd_lists.drop_duplicates()})
+    pairs = pd.DataFrame({"row": np.arange(len(parsed)), "icd10": parsed.to_numpy()}).explode("icd10")
+    pairs = pairs.merge(ccs_df[["icd10", "ccs_label"]].dropna(), on="icd10", how="inner")
+    pairs = pairs.drop_duplicates(["row", "ccs_label"])
+
+    labels = pd.Categorical(pairs["ccs_label"], categories=labels)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.uint8), (pairs["row"].to_numpy(), labels.codes)),
+        shape=(len(parsed), len(labels.categories)),
+    )
+    return matrix, list(labels.categories)
+
+
+def ccs_column_names(labels):
+    """Returns the ccs_* feature names for the given CCS labels, in order."""
+    return [f"ccs_{label.lower().replace(' ', '_').replace('-', '_')}" for label in labels]
+
+
+def save_ccs_matrix(path, matrix):
+    """Saves a multi-hot CCS block as a compressed sparse .npz file."""
+    sparse.save_npz(path, matrix.tocsr().astype(np.uint8), compressed=True)
+
+
+def load_ccs_matrix(path):
+    return sparse.load_npz(path).tocsr()
+
+
+class CcsPartStore:
+    """
+    Row-ordered CCS matrix parts spilled to disk, so the chunked pipeline never
+    holds the whole multi-hot block in memory. Parts may be written by other
+    processes (see part_path) and registered in order with add_part.
+    """
+
+    def __init__(self, directory, n_labels):
+        self.directory = directory
+        self.observed = np.zeros(n_labels, dtype=bool)
+        self._offsets = [0]
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith("part-") and name.endswith(".npz"):
+                os.remove(os.path.join(directory, name))
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def part_path(self, index):
+        return os.path.join(self.directory, f"part-{index:05d}.npz")
+
+    def add_part(self, n_rows, observed):
+        """Registers the next part (already saved at part_path) and returns its first row id."""
+        self.observed |= observed
+        self._offsets.append(self._offsets[-1] + n_rows)
+        return self._offsets[-2]
+
+    def take(self, rows):
+        """Returns the rows (global claim_row ids) in the given order, all label columns."""
+        rows = np.asarray(rows)
+        part_of_row = np.searchsorted(self._offsets, rows, side="right") - 1
+        pieces, positions = [], []
+        for part in np.unique(part_of_row):
+            selected = np.flatnonzero(part_of_row == part)
+            matrix = load_ccs_matrix(self.part_path(part))
+            pieces.append(matrix[rows[selected] - self._offsets[part]])
+            positions.append(selected)
+        if not pieces:
+            return sparse.csr_matrix((0, len(self.observed)), dtype=np.uint8)
+        order = np.argsort(np.concatenate(positions))
+        return sparse.vstack(pieces, format="csr")[order]
+
+
+def to_lgb_dataset(features, ccs_matrix, label=None, ccs_columns=None, **kwargs):
+    """
+    Builds a LightGBM Dataset from numeric dense features plus the sparse CCS
+    block without densifying it. Categorical string columns must already be
+    encoded; extra kwargs are passed to lgb.Dataset.
+    """
+    import lightgbm as lgb
+
+    dense = sparse.csr_matrix(features.to_numpy(dtype=np.float64))
+    X = sparse.hstack([dense, ccs_matrix.astype(np.float64)], format="csr")
+    feature_name = list(features.columns) + list(ccs_columns or [f"ccs_{i}" for i in range(ccs_matrix.shape[1])])
+    return lgb.Dataset(X, label=label, feature_name=feature_name, **kwargs)
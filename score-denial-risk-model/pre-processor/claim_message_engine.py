@@ -0,0 +1,158 @@
+"""
+Scrubs and extracts features from the ClaimMessage CSV in one pass.
+
+scrub_claim.scrub_csv and extract_features.extract_and_flatten_claim_data each
+read the whole file and parse every XML payload. This engine reads the CSV in
+chunks, parses each payload once with ElementTree, extracts the feature row from
+the tree and then redacts the same tree, and writes both outputs together. The
+outputs are the same as running the two scripts separately.
+
+Chunks are processed in a process pool and written back in input order.
+
+    python pre-processor/claim_message_engine.py --input ClaimMessage.csv \
+        --scrubbed-output ClaimMessage_scrubbed.csv --features-output claim_features.csv
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from extract_features import compile_feature_mapping, extract_features_from_tree, read_feature_mapping
+from scrub_claim import scrub_tree
+
+FEATURE_MAPPING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'claim_feature_mapping.txt')
+
+# Columns copied from the CSV row into each feature row
+MESSAGE_COLUMNS = ['ClaimMessageId', 'ClaimK9Number', 'startedutc']
+
+DEFAULT_CHUNK_SIZE = 500
+
+_feature_mapping = None
+_data_index = None
+_message_indexes = None
+
+
+def raise_field_size_limit():
+    """ClaimMessage payloads can exceed csv's default 128 KiB field limit."""
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+
+def process_message(row, data_index, message_indexes, feature_mapping):
+    """
+    Returns the scrubbed CSV row and the feature row (None if the row has no
+    data column or its XML does not parse) for one ClaimMessage row.
+    """
+    if len(row) <= data_index:
+        return row, None
+    try:
+        root = ET.fromstring(row[data_index])
+    except ET.ParseError:
+        # scrub_xml_data keeps unparseable payloads as they are and no features are extracted
+        return row, None
+
+    # Extract first: scrubbing redacts attributes such as payer-name that are features
+    features = extract_features_from_tree(root, feature_mapping)[0]
+    for column, index in message_indexes.items():
+        features[column] = row[index]
+
+    scrub_tree(root)
+    row = list(row)
+    row[data_index] = ET.tostring(root, encoding='unicode')
+    return row, features
+
+
+def _init_worker(feature_mapping, data_index, message_indexes):
+    global _feature_mapping, _data_index, _message_indexes
+    raise_field_size_limit()
+    _feature_mapping, _data_index, _message_indexes = feature_mapping, data_index, message_indexes
+
+
+def _process_chunk(rows):
+    return [process_message(row, _data_index, _message_indexes, _feature_mapping) for row in rows]
+
+
+def read_chunks(reader, chunk_size):
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(input_file, scrubbed_file, features_file, feature_mapping_file=FEATURE_MAPPING_FILE,
+        workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Writes the scrubbed CSV and the features CSV; returns the number of messages processed."""
+    raise_field_size_limit()
+    workers = workers or os.cpu_count()
+    feature_mapping = compile_feature_mapping(read_feature_mapping(feature_mapping_file))
+
+    start = time.perf_counter()
+    messages = 0
+    with open(input_file, 'r', newline='') as infile, \
+         open(scrubbed_file, 'w', newline='') as scrubbed_out, \
+         open(features_file, 'w', newline='') as features_out:
+        reader = csv.reader(infile)
+        scrubbed_writer = csv.writer(scrubbed_out)
+        features_writer = csv.DictWriter(features_out, fieldnames=feature_mapping.feature_names)
+
+        header = next(reader)
+        scrubbed_writer.writerow(header)
+        features_writer.writeheader()
+        try:
+            data_index = header.index('data')
+            message_indexes = {column: header.index(column) for column in MESSAGE_COLUMNS}
+        except ValueError as e:
+            print(f"Error: Column not found in the CSV file: {e}")
+            return 0
+
+        def write(results):
+            for scrubbed_row, features in results:
+                scrubbed_writer.writerow(scrubbed_row)
+                if features is not None:
+                    features_writer.writerow(features)
+            return len(results)
+
+        if workers == 1:
+            for chunk in read_chunks(reader, chunk_size):
+                messages += write([process_message(row, data_index, message_indexes, feature_mapping)
+                                   for row in chunk])
+        else:
+            # Chunks are processed in parallel but written in input order; at most
+            # two chunks per worker are in flight.
+            in_flight = deque()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(feature_mapping, data_index, message_indexes)) as pool:
+                for chunk in read_chunks(reader, chunk_size):
+                    if len(in_flight) >= 2 * workers:
+                        messages += write(in_flight.popleft().result())
+                    in_flight.append(pool.submit(_process_chunk, chunk))
+                while in_flight:
+                    messages += write(in_flight.popleft().result())
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {messages} messages in {elapsed:.1f}s ({messages / max(elapsed, 1e-9):,.0f} messages/s)")
+    return messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scrub PHI and extract claim features in one pass.')
+    parser.add_argument('--input', required=True, help='ClaimMessage CSV with a data column of claim XML')
+    parser.add_argument('--scrubbed-output', required=True)
+    parser.add_argument('--features-output', required=True)
+    parser.add_argument('--feature-mapping', default=FEATURE_MAPPING_FILE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='messages per worker task')
+    args = parser.parse_args(argv)
+    run(args.input, args.scrubbed_output, args.features_output, args.feature_mapping, args.workers, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
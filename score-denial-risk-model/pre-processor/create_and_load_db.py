@@ -1,12 +1,72 @@
-import sqlite3
+"""
+Bulk loads the claim feature, payer gateway response and claim status CSV
+extracts into claims.db.
+
+Each file is cut into chunks of whole CSV records. A process pool parses the
+chunks in parallel, and each worker writes its rows into its own shard database
+with executemany inside a single transaction. The main process merges the shards
+in file order with INSERT ... SELECT. Each merge is one transaction that also
+records the byte offset reached in load_progress, so an interrupted load resumes
+from the last merged chunk. With --workers 1 chunks are inserted directly,
+without shards. Secondary indexes are dropped for the load and rebuilt afterwards.
+
+    python pre-processor/create_and_load_db.py [--db claims.db] [--workers 4] [--chunk-mb 64]
+"""
+
+import argparse
 import csv
+import io
+import itertools
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# (table, source CSV) in load order
+SOURCES = [
+    ('claim_features', 'NON_PHI_DATA_SAFE/claim_features_extracted_customer_122_final.csv'),
+    ('payer_gateway_responses', 'NON_PHI_DATA_SAFE/PayerGatewayResponse_latest_customer_122.csv'),
+    ('claim_status', 'claim_status_customer_122.csv'),
+]
+
+INDEXES = {
+    'idx_cf_claimk9': 'CREATE INDEX IF NOT EXISTS idx_cf_claimk9 ON claim_features (ClaimK9Number)',
+    'idx_pgr_claimk9': 'CREATE INDEX IF NOT EXISTS idx_pgr_claimk9 ON payer_gateway_responses (ClaimK9Number)',
+    'idx_cs_clearinghousetrackingnumber': 'CREATE INDEX IF NOT EXISTS idx_cs_clearinghousetrackingnumber ON claim_status (CLEARINGHOUSETRACKINGNUMBER)',
+    'idx_cf_startedutc': 'CREATE INDEX IF NOT EXISTS idx_cf_startedutc ON claim_features (startedutc)',
+    'idx_cf_service_start_date': 'CREATE INDEX IF NOT EXISTS idx_cf_service_start_date ON claim_features (service_start_date)',
+    'idx_cf_service_end_date': 'CREATE INDEX IF NOT EXISTS idx_cf_service_end_date ON claim_features (service_end_date)',
+    'idx_cf_patient_birth_date': 'CREATE INDEX IF NOT EXISTS idx_cf_patient_birth_date ON claim_features (patient_birth_date)',
+    'idx_pgr_transactiontimestamp': 'CREATE INDEX IF NOT EXISTS idx_pgr_transactiontimestamp ON payer_gateway_responses (TransactionTimestamp)',
+    'idx_pgr_servicedate': 'CREATE INDEX IF NOT EXISTS idx_pgr_servicedate ON payer_gateway_responses (ServiceDate)',
+    'idx_pgr_createddate': 'CREATE INDEX IF NOT EXISTS idx_pgr_createddate ON payer_gateway_responses (CreatedDate)',
+}
 
-def create_and_load_db():
-    conn = sqlite3.connect('claims.db')
-    c = conn.cursor()
+# Load-time settings, restored afterwards. With WAL and synchronous=NORMAL a
+# commit does not fsync, but merged chunks survive the loader being killed.
+LOAD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': '-1048576',  # 1 GiB
+    'temp_store': 'MEMORY',
+}
+
+# Shards are scratch files that are rebuilt on failure, so they skip journaling
+SHARD_PRAGMAS = {
+    'journal_mode': 'OFF',
+    'synchronous': 'OFF',
+}
+
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+DEFAULT_BATCH_SIZE = 50_000
+
+
+def create_tables(conn):
+    cursor = conn.cursor()
 
     # Create claim_features table
-    c.execute('''
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS claim_features (
             ClaimMessageId INTEGER,
             ClaimK9Number TEXT,
@@ -66,7 +126,7 @@ def create_and_load_db():
     ''')
 
     # Create payer_gateway_responses table
-    c.execute('''
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS payer_gateway_responses (
             PayerGatewayResponseId INTEGER,
             PayerGatewayId INTEGER,
@@ -88,7 +148,7 @@ def create_and_load_db():
     ''')
 
     # Create claim_status table
-    c.execute('''
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS claim_status (
             CUSTOMERID INTEGER,
             CLAIMID INTEGER,
@@ -115,41 +175,255 @@ def create_and_load_db():
         )
     ''')
 
-    # Load data into claim_features table
-    with open('NON_PHI_DATA_SAFE/claim_features_extracted_customer_122_final.csv', 'r') as f:
-        reader = csv.reader(f)
-        next(reader)  # Skip header
-        for row in reader:
-            c.execute('INSERT INTO claim_features VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', row)
-
-    # Load data into payer_gateway_responses table
-    with open('NON_PHI_DATA_SAFE/PayerGatewayResponse_latest_customer_122.csv', 'r') as f:
-        reader = csv.reader(f)
-        next(reader)  # Skip header
-        for row in reader:
-            c.execute('INSERT INTO payer_gateway_responses VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', row)
-
-    # Load data into claim_status table
-    with open('claim_status_customer_122.csv', 'r') as f:
-        reader = csv.reader(f)
-        next(reader)  # Skip header
-        for row in reader:
-            c.execute('INSERT INTO claim_status VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', row)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS load_progress (
+            table_name TEXT PRIMARY KEY,
+            source TEXT,
+            source_size INTEGER,
+            byte_offset INTEGER,
+            rows_loaded INTEGER,
+            completed INTEGER
+        )
+    ''')
+
+
+
+def set_pragmas(conn, pragmas):
+    """Applies the given PRAGMAs and returns their previous values."""
+    previous = {}
+    for name, value in pragmas.items():
+        previous[name] = conn.execute(f'PRAGMA {name}').fetchone()[0]
+        conn.execute(f'PRAGMA {name} = {value}')
+    return previous
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def load_state(conn, table, source):
+    """
+    Returns (byte_offset, rows_loaded, completed) for the table. A fresh load
+    starts after the header. If the source changed since the progress was
+    recorded, the table is emptied and loaded again.
+    """
+    source, size = os.path.abspath(source), os.path.getsize(source)
+    row = conn.execute('SELECT source, source_size, byte_offset, rows_loaded, completed FROM load_progress '
+                       'WHERE table_name = ?', (table,)).fetchone()
+    if row and row[:2] == (source, size):
+        return row[2], row[3], bool(row[4])
+
+    if row:
+        print(f'{source} changed since the last load; reloading {table}')
+    with open(source, 'rb') as f:
+        header_end = record_end(f, 0, 0)
+    conn.execute('BEGIN')
+    conn.execute(f'DELETE FROM {table}')
+    conn.execute('INSERT OR REPLACE INTO load_progress VALUES (?, ?, ?, ?, 0, 0)', (table, source, size, header_end))
+    conn.execute('COMMIT')
+    return header_end, 0, False
+
+
+def record_end(f, start, target, block_bytes=1024 * 1024):
+    """
+    Returns the offset just past the first record-ending newline at or after
+    target, or the end of the file. start must be the start of a record. A
+    newline ends a record only when an even number of '"' precede it since
+    start (escaped quotes are doubled, so they keep the count even).
+    """
+    f.seek(start)
+    quotes, remaining = 0, target - start
+    while remaining > 0:
+        block = f.read(min(block_bytes, remaining))
+        if not block:
+            return f.tell()
+        quotes += block.count(b'"')
+        remaining -= len(block)
+
+    position = target
+    while block := f.read(block_bytes):
+        i = 0
+        while (newline := block.find(b'\n', i)) != -1:
+            quotes += block.count(b'"', i, newline)
+            if quotes % 2 == 0:
+                return position + newline + 1
+            i = newline + 1
+        quotes += block.count(b'"', i)
+        position += len(block)
+    return position
+
+
+def chunk_ranges(source, offset, chunk_bytes):
+    """Yields (start, end) byte ranges of whole CSV records from offset to the end of source."""
+    with open(source, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        while offset < size:
+            end = record_end(f, offset, offset + chunk_bytes)
+            yield offset, end
+            offset = end
+
+
+def read_chunk(source, start, end):
+    """Returns a csv.reader over one byte range of whole records of source."""
+    with open(source, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # newline=None translates \r\n like the text-mode open() the loader used to read with
+    return csv.reader(io.StringIO(data.decode('utf-8'), newline=None))
+
+
+def insert_rows(conn, table, reader, batch_size):
+    """
+    Inserts the reader's rows with executemany in batches of batch_size, inside
+    the caller's transaction. Values stay strings, as csv.reader yields them,
+    and SQLite applies the column affinities. Returns the number of rows.
+    """
+    insert = f'INSERT INTO {table} VALUES ({",".join("?" * len(table_columns(conn, table)))})'
+    rows = 0
+    while batch := list(itertools.islice(reader, batch_size)):
+        conn.executemany(insert, batch)
+        rows += len(batch)
+    return rows
+
+
+def load_chunk(source, start, end, table, table_sql, shard_path, batch_size):
+    """Parses one byte range of source into table in a new shard database; returns the number of rows."""
+    if os.path.exists(shard_path):
+        os.remove(shard_path)
+    conn = sqlite3.connect(shard_path, isolation_level=None)
+    set_pragmas(conn, SHARD_PRAGMAS)
+    conn.execute(table_sql)
+    conn.execute('BEGIN')
+    rows = insert_rows(conn, table, read_chunk(source, start, end), batch_size)
+    conn.execute('COMMIT')
+    conn.close()
+    return rows
+
+
+def merge_shard(conn, table, shard_path, end, rows_loaded):
+    """Appends a shard to table and advances load_progress in the same transaction."""
+    conn.execute('ATTACH DATABASE ? AS shard', (shard_path,))
+    conn.execute('BEGIN')
+    conn.execute(f'INSERT INTO {table} SELECT * FROM shard.{table}')
+    record_progress(conn, table, end, rows_loaded)
+    conn.execute('COMMIT')
+    conn.execute('DETACH DATABASE shard')
+    os.remove(shard_path)
+
+
+def record_progress(conn, table, byte_offset, rows_loaded):
+    conn.execute('UPDATE load_progress SET byte_offset = ?, rows_loaded = ? WHERE table_name = ?',
+                 (byte_offset, rows_loaded, table))
+
+
+def load_serial(conn, table, source, byte_offset, rows_loaded, chunk_bytes, batch_size):
+    """Single-worker path: parses and inserts each chunk in the main process, without shards."""
+    inserted = 0
+    for chunk_start, chunk_end in chunk_ranges(source, byte_offset, chunk_bytes):
+        conn.execute('BEGIN')
+        inserted += insert_rows(conn, table, read_chunk(source, chunk_start, chunk_end), batch_size)
+        record_progress(conn, table, chunk_end, rows_loaded + inserted)
+        conn.execute('COMMIT')
+    return inserted
+
+
+def load_parallel(conn, pool, workers, shard_dir, table, source, byte_offset, rows_loaded, chunk_bytes,
+                  batch_size):
+    """
+    Parses chunks into shard databases in the process pool and merges them in
+    file order; at most two chunks per worker are parsed ahead of the merge.
+    """
+    table_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                             (table,)).fetchone()[0]
+    inserted, in_flight = 0, deque()
+
+    def merge_oldest():
+        future, shard_path, chunk_end = in_flight.popleft()
+        rows = future.result()
+        merge_shard(conn, table, shard_path, chunk_end, rows_loaded + inserted + rows)
+        return rows
+
+    for index, (chunk_start, chunk_end) in enumerate(chunk_ranges(source, byte_offset, chunk_bytes)):
+        if len(in_flight) >= 2 * workers:
+            inserted += merge_oldest()
+        shard_path = os.path.join(shard_dir, f'{table}-{index:05d}.db')
+        in_flight.append((pool.submit(load_chunk, source, chunk_start, chunk_end, table, table_sql, shard_path,
+                                      batch_size), shard_path, chunk_end))
+    while in_flight:
+        inserted += merge_oldest()
+    return inserted
+
+
+def create_and_load_db(db_path='claims.db', workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                       batch_size=DEFAULT_BATCH_SIZE):
+    workers = workers or os.cpu_count()
+    # Transactions are managed explicitly (one per chunk)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    create_tables(conn)
+    previous_pragmas = set_pragmas(conn, LOAD_PRAGMAS)
+
+    pending = []
+    for table, source in SOURCES:
+        byte_offset, rows_loaded, completed = load_state(conn, table, source)
+        if completed:
+            print(f'{table}: already loaded from {source}, skipping')
+            continue
+        if rows_loaded:
+            print(f'{table}: resuming after {rows_loaded} rows')
+        pending.append((table, source, byte_offset, rows_loaded))
+
+    if pending:
+        # Secondary indexes only slow the inserts down; they are rebuilt below
+        for name in INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+
+    shard_dir = f'{db_path}.shards'
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and pending else None
+    if pool:
+        os.makedirs(shard_dir, exist_ok=True)
+
+    total_rows, total_start = 0, time.perf_counter()
+    for table, source, byte_offset, rows_loaded in pending:
+        start = time.perf_counter()
+        if pool:
+            inserted = load_parallel(conn, pool, workers, shard_dir, table, source, byte_offset, rows_loaded,
+                                     chunk_bytes, batch_size)
+        else:
+            inserted = load_serial(conn, table, source, byte_offset, rows_loaded, chunk_bytes, batch_size)
+        conn.execute('UPDATE load_progress SET completed = 1 WHERE table_name = ?', (table,))
+        elapsed = time.perf_counter() - start
+        total_rows += inserted
+        print(f'{table}: loaded {inserted} rows in {elapsed:.1f}s ({inserted / max(elapsed, 1e-9):,.0f} rows/s)')
+
+    if pool:
+        pool.shutdown()
+        os.rmdir(shard_dir)
 
     # Create indexes for faster queries
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cf_claimk9 ON claim_features (ClaimK9Number)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_pgr_claimk9 ON payer_gateway_responses (ClaimK9Number)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cs_clearinghousetrackingnumber ON claim_status (CLEARINGHOUSETRACKINGNUMBER)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cf_startedutc ON claim_features (startedutc)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cf_service_start_date ON claim_features (service_start_date)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cf_service_end_date ON claim_features (service_end_date)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cf_patient_birth_date ON claim_features (patient_birth_date)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_pgr_transactiontimestamp ON payer_gateway_responses (TransactionTimestamp)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_pgr_servicedate ON payer_gateway_responses (ServiceDate)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_pgr_createddate ON payer_gateway_responses (CreatedDate)')
-
-    conn.commit()
+    start = time.perf_counter()
+    for index_sql in INDEXES.values():
+        conn.execute(index_sql)
+    conn.execute('ANALYZE')
+    print(f'Built {len(INDEXES)} indexes in {time.perf_counter() - start:.1f}s')
+
+    elapsed = time.perf_counter() - total_start
+    print(f'Total: {total_rows} rows in {elapsed:.1f}s ({total_rows / max(elapsed, 1e-9):,.0f} rows/s)')
+
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    set_pragmas(conn, previous_pragmas)
     conn.close()
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk load the claims CSV extracts into SQLite.')
+    parser.add_argument('--db', default='claims.db')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parallel CSV parsing processes')
+    parser.add_argument('--chunk-mb', type=int, default=DEFAULT_CHUNK_BYTES // (1024 * 1024),
+                        help='approximate size of each parsed chunk')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='rows per executemany call')
+    args = parser.parse_args(argv)
+    create_and_load_db(args.db, args.workers, args.chunk_mb * 1024 * 1024, args.batch_size)
+
+
 if __name__ == '__main__':
-    create_and_load_db()
\ No newline at end of file
+    main()
@@ -1,134 +1,303 @@
+import argparse
+import csv
 import duckdb
+import numpy as np
 import pandas as pd
-import ast
 import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.model_selection import train_test_split
+from ccs_features import CcsPartStore, build_ccs_multi_hot, ccs_column_names, save_ccs_matrix
+import incremental_store
 
-# === Step 1: Load Claims and CCS Mapping ===
 INPUT_CLAIMS_FILE = "data/claim_data.csv"
 
 CCS_FILE_PATH = "data/ccsr_icd10cm_2025_v1.csv"  # Rename to your saved version
 
-ccs_df = pd.read_csv(CCS_FILE_PATH, dtype=str)
-ccs_df.columns = [col.strip().strip("'") for col in ccs_df.columns]
+OUTPUT_DIR = "model"
 
-ccs_df = pd.DataFrame({
-    "icd10": ccs_df["ICD-10-CM CODE"].str.replace(".", "", regex=False).str.upper().str.strip(),
-    "ccs_category": ccs_df["CCSR CATEGORY 1"].str.strip().str.strip("'"),
-    "ccs_label": ccs_df["CCSR CATEGORY 1 DESCRIPTION"].str.strip()
-})
-
-# Load claims
-print(f"Loading claims from {INPUT_CLAIMS_FILE}")
-df = pd.read_csv(INPUT_CLAIMS_FILE, on_bad_lines='skip')
-
-# === Step 2: Filter Required Columns ===
-required = [
+REQUIRED_COLUMNS = [
     "cpt", "payer", "pos", "duration", "icd_count", "modifier_count",
     "has_modifier_25", "procedures_count", "denied", "primary_icd", "icd_list"
 ]
-missing = [col for col in required if col not in df.columns]
-if missing:
-    raise ValueError(f"Missing required columns: {missing}")
-
-df = df.dropna(subset=required)
-df = df[df["denied"].isin([0, 1])]
-df["primary_icd"] = df["primary_icd"].str.replace(".", "").str.upper().str.strip()
-
-# === Step 3: Map Primary ICD to CCS Group ===
-df = df.merge(ccs_df[["icd10", "ccs_category", "ccs_label"]],
-              left_on="primary_icd", right_on="icd10", how="left")
-df = df.rename(columns={"ccs_category": "icd_ccs_id", "ccs_label": "icd_ccs_label"})
-
-# === Step 4: Multi-ICD CCS One-Hot Encoding ===
-def extract_ccs_set(icd_raw):
-    if pd.isnull(icd_raw): return set()
-    try:
-        codes = ast.literal_eval(icd_raw) if isinstance(icd_raw, str) else icd_raw
-        codes = [code.replace(".", "").upper().strip() for code in codes]
-        return set(ccs_df.loc[ccs_df["icd10"].isin(codes), "ccs_label"])
-    except Exception:
-        return set()
-
-ccs_sets = df["icd_list"].apply(extract_ccs_set)
-all_ccs_labels = sorted(set.union(*ccs_sets))
-
-# Create multi-hot CCS group columns
-multi_hot_cols = []
-for label in all_ccs_labels:
-    safe_label = label.lower().replace(" ", "_").replace("-", "_")
-    col_name = f"ccs_{safe_label}"
-    df[col_name] = ccs_sets.apply(lambda s: 1 if label in s else 0)
-    multi_hot_cols.append(col_name)
-
-# Add count of CCS groups per claim
-df["ccs_count_per_claim"] = ccs_sets.apply(len)
-
-# Save CCS feature list
-with open("ccs_features.json", "w") as f:
-    json.dump(multi_hot_cols, f)
-
-# === Step 5: Normalize Data Types ===
-df["cpt"] = df["cpt"].astype(str)
-df["payer"] = df["payer"].astype(str)
-df["pos"] = df["pos"].astype(str)
-df["has_modifier_25"] = df["has_modifier_25"].astype(int)
-df["modifier_count"] = df["modifier_count"].astype(int)
-df["icd_count"] = df["icd_count"].astype(int)
-df["procedures_count"] = df["procedures_count"].astype(int)
-
-# === Step 6: Save Intermediate to DuckDB ===
-df.to_csv("filtered_claims_with_ccs.csv", index=False)
-
-con = duckdb.connect()
-con.execute("""
-    CREATE TABLE claims AS 
-    SELECT * FROM read_csv_auto('filtered_claims_with_ccs.csv', header=True, sample_size=-1)
-""")
-
-# === Step 7: CPT Pairing Column (Guard against missing secondary_cpt) ===
-con.execute("""
-    CREATE TABLE claims_with_pair AS
-    SELECT *,
-           CASE
-               WHEN 'secondary_cpt' IN (SELECT column_name FROM information_schema.columns WHERE table_name = 'claims')
-               AND secondary_cpt IS NOT NULL THEN cpt || '_' || secondary_cpt
-               ELSE cpt || '_81001'
-           END AS code_pair_combo
-    FROM claims
-""")
-
-# === Step 8: Calculate Past Denial Rate ===
-con.execute("""
-    CREATE TABLE denial_stats AS
-    SELECT cpt, payer, AVG(denied::INTEGER)::FLOAT AS past_denial_rate
-    FROM claims_with_pair
-    GROUP BY cpt, payer
-""")
-
-# === Step 9: Join Denial Rate Back ===
-con.execute("""
-    CREATE TABLE enriched_claims AS
-    SELECT c.*, d.past_denial_rate
-    FROM claims_with_pair c
-    LEFT JOIN denial_stats d ON c.cpt = d.cpt AND c.payer = d.payer
-""")
-
-# === Step 10: Downsample Balanced Sample (~50K) ===
-df_sampled = con.execute("""
-    SELECT * FROM (
-        SELECT * FROM enriched_claims WHERE denied = 1 USING SAMPLE 20000 ROWS
-        UNION ALL
-        SELECT * FROM enriched_claims WHERE denied = 0 USING SAMPLE 30000 ROWS
-    )
-""").fetchdf()
-
-# === Step 11: Train/Val/Test Split ===
-train, temp = train_test_split(df_sampled, stratify=df_sampled["denied"], test_size=0.3, random_state=42)
-test, val = train_test_split(temp, stratify=temp["denied"], test_size=0.5, random_state=42)
-
-train.to_csv("claims_train.csv", index=False)
-test.to_csv("claims_test.csv", index=False)
-val.to_csv("claims_val.csv", index=False)
-
-print("ICD10 CCS multi-hot features and pipeline complete")
+
+# === Step 1: Load CCS Mapping ===
+def load_ccs_mapping(path=CCS_FILE_PATH):
+    ccs_df = pd.read_csv(path, dtype=str)
+    ccs_df.columns = [col.strip().strip("'") for col in ccs_df.columns]
+
+    return pd.DataFrame({
+        "icd10": ccs_df["ICD-10-CM CODE"].str.replace(".", "", regex=False).str.upper().str.strip(),
+        "ccs_category": ccs_df["CCSR CATEGORY 1"].str.strip().str.strip("'"),
+        "ccs_label": ccs_df["CCSR CATEGORY 1 DESCRIPTION"].str.strip()
+    })
+
+def prepare_claims(df, ccs_df, labels=None):
+    """
+    Runs Steps 2-5 on a batch of raw claims (the whole file or one chunk).
+    Returns the cleaned claims, their sparse CCS multi-hot block and its labels.
+    """
+    # === Step 2: Filter Required Columns ===
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+
+    df = df.dropna(subset=REQUIRED_COLUMNS)
+    df = df[df["denied"].isin([0, 1])]
+    df["primary_icd"] = df["primary_icd"].str.replace(".", "").str.upper().str.strip()
+
+    # === Step 3: Map Primary ICD to CCS Group ===
+    df = df.merge(ccs_df[["icd10", "ccs_category", "ccs_label"]],
+                  left_on="primary_icd", right_on="icd10", how="left")
+    df = df.rename(columns={"ccs_category": "icd_ccs_id", "ccs_label": "icd_ccs_label"})
+    for col in ["icd10", "icd_ccs_id", "icd_ccs_label"]:
+        df[col] = df[col].astype("string")
+
+    # === Step 4: Multi-ICD CCS Multi-Hot Encoding ===
+    # The multi-hot block is kept as a sparse uint8 matrix aligned with claim_row
+    # instead of hundreds of dense int64 columns.
+    ccs_matrix, labels = build_ccs_multi_hot(df["icd_list"], ccs_df, labels)
+
+    # Add count of CCS groups per claim
+    df["ccs_count_per_claim"] = np.asarray(ccs_matrix.sum(axis=1, dtype=np.int64)).ravel()
+
+    # === Step 5: Normalize Data Types ===
+    df["cpt"] = df["cpt"].astype(str)
+    df["payer"] = df["payer"].astype(str)
+    df["pos"] = df["pos"].astype(str)
+    df["has_modifier_25"] = df["has_modifier_25"].astype(int)
+    df["modifier_count"] = df["modifier_count"].astype(int)
+    df["icd_count"] = df["icd_count"].astype(int)
+    df["procedures_count"] = df["procedures_count"].astype(int)
+
+    return df, ccs_matrix, labels
+
+def malformed_rows(input_file):
+    """
+    Record numbers (the header is 0) of the rows with more fields than the
+    header; short rows are kept and padded with NaN, as read_csv does. They are
+    found once for the whole file and passed to read_csv as skiprows, so the
+    in-memory and chunked reads drop the same rows (on_bad_lines='skip' alone
+    judges each chunk separately). skiprows counts records, not physical lines,
+    so quoted values spanning several lines do not shift the numbers.
+    """
+    with open(input_file, newline="") as f:
+        reader = csv.reader(f)
+        width = len(next(reader))
+        return [record for record, row in enumerate(reader, start=1) if len(row) > width]
+
+def run_in_memory(con, input_file, ccs_df):
+    """Loads the whole claims file at once. Returns (take_rows, labels) for the CCS block."""
+    print(f"Loading claims from {input_file}")
+    df = pd.read_csv(input_file, skiprows=malformed_rows(input_file), on_bad_lines='skip')
+    df, ccs_matrix, labels = prepare_claims(df, ccs_df)
+    df["claim_row"] = np.arange(len(df))
+
+    # === Step 6: Hand the DataFrame to DuckDB ===
+    # DuckDB scans the registered DataFrame in place, so there is no intermediate
+    # CSV to write and re-parse and the pandas dtypes carry over.
+    con.register("claims_df", df)
+    con.execute("CREATE VIEW claims AS SELECT * FROM claims_df")
+    return (lambda rows: ccs_matrix[rows]), labels
+
+_worker_ccs_df = None
+_worker_labels = None
+
+def _init_worker(ccs_file, labels):
+    global _worker_ccs_df, _worker_labels
+    _worker_ccs_df = load_ccs_mapping(ccs_file)
+    _worker_labels = labels
+
+def _prepare_chunk(chunk, index, claims_path, ccs_path):
+    """Prepares one chunk in a worker and writes it straight to its Parquet and CCS parts."""
+    df, ccs_matrix, _ = prepare_claims(chunk, _worker_ccs_df, _worker_labels)
+    df["chunk_index"] = index
+    df["chunk_row"] = np.arange(len(df))
+    df.to_parquet(claims_path, index=False)
+    save_ccs_matrix(ccs_path, ccs_matrix)
+    return len(df), np.asarray(ccs_matrix.getnnz(axis=0) > 0)
+
+def run_chunked(con, input_file, ccs_df, ccs_file, chunksize, workers, work_dir):
+    """
+    Streams the claims file in bounded chunks. Chunks are prepared in parallel
+    worker processes against the full CCSR label vocabulary and appended in order
+    to on-disk Parquet and CCS part stores, which DuckDB then reads out of core.
+    Unobserved label columns are dropped at the end so the result matches
+    run_in_memory.
+    """
+    vocabulary = sorted(ccs_df["ccs_label"].dropna().unique())
+    parts = CcsPartStore(os.path.join(work_dir, "ccs_parts"), len(vocabulary))
+    claims_dir = os.path.join(work_dir, "claims_parts")
+    os.makedirs(claims_dir, exist_ok=True)
+    for name in os.listdir(claims_dir):
+        os.remove(os.path.join(claims_dir, name))
+    reader = pd.read_csv(input_file, skiprows=malformed_rows(input_file), on_bad_lines='skip', chunksize=chunksize)
+
+    print(f"Streaming claims from {input_file} in chunks of {chunksize} rows on {workers} workers")
+    offsets = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(ccs_file, vocabulary)) as pool:
+        pending = deque()
+
+        def append_next():
+            n_rows, observed = pending.popleft().result()
+            offsets.append((len(offsets), parts.add_part(n_rows, observed)))
+
+        # Keep at most two chunks per worker in flight so memory stays bounded
+        for index, chunk in enumerate(reader):
+            claims_path = os.path.join(claims_dir, f"part-{index:05d}.parquet")
+            pending.append(pool.submit(_prepare_chunk, chunk, index, claims_path, parts.part_path(index)))
+            if len(pending) >= 2 * workers:
+                append_next()
+        while pending:
+            append_next()
+
+    # claim_row is only known once every earlier chunk has been filtered
+    con.execute("CREATE TABLE chunk_offsets (chunk_index BIGINT, first_row BIGINT)")
+    con.executemany("INSERT INTO chunk_offsets VALUES (?, ?)", offsets)
+    con.execute(f"""
+        CREATE TABLE claims AS
+        SELECT * EXCLUDE (chunk_index, chunk_row, first_row), first_row + chunk_row AS claim_row
+        FROM read_parquet('{claims_dir}/part-*.parquet', union_by_name=true)
+        JOIN chunk_offsets USING (chunk_index)
+    """)
+
+    observed = np.flatnonzero(parts.observed)
+    labels = [vocabulary[i] for i in observed]
+    return (lambda rows: parts.take(rows)[:, observed]), labels
+
+def run_incremental(con, input_file, ccs_df, output_dir):
+    """
+    Ingests only the rows appended to input_file since the last run into the
+    persistent database, updates the denial counts, CCS rows and balanced sample
+    in place, records the watermark and re-exports the splits.
+    """
+    con.execute("BEGIN TRANSACTION")
+    vocabulary = incremental_store.init_db(con, sorted(ccs_df["ccs_label"].dropna().unique()))
+    df, watermark = incremental_store.read_new_rows(con, input_file)
+    new_count = 0
+    if df is not None:
+        df, ccs_matrix, _ = prepare_claims(df, ccs_df, vocabulary)
+        new_claims = incremental_store.store_claims(con, df, ccs_matrix, incremental_store.next_claim_row(con))
+        incremental_store.update_reservoir(con, new_claims, np.random.default_rng())
+        new_count = len(new_claims)
+    incremental_store.record_watermark(con, watermark)
+    con.execute("COMMIT")
+    print(f"Ingested {new_count} new claims from {input_file}")
+    if not incremental_store.has_claims(con):
+        print("No claims ingested yet; splits not written")
+        return []
+
+    df_sampled, ccs_matrix = incremental_store.fetch_sample(con)
+    observed = incremental_store.observed_label_ids(con)
+    sample_positions = pd.Index(df_sampled["claim_row"])
+    write_splits(con, df_sampled, lambda rows: ccs_matrix[sample_positions.get_indexer(rows)][:, observed],
+                 output_dir)
+    return [vocabulary[i] for i in observed]
+
+def build_splits(con, take_ccs_rows, output_dir):
+    # === Step 7: CPT Pairing Column (Guard against missing secondary_cpt) ===
+    con.execute("""
+        CREATE TABLE claims_with_pair AS
+        SELECT *,
+               CASE
+                   WHEN 'secondary_cpt' IN (SELECT column_name FROM information_schema.columns WHERE table_name = 'claims')
+                   AND secondary_cpt IS NOT NULL THEN cpt || '_' || secondary_cpt
+                   ELSE cpt || '_81001'
+               END AS code_pair_combo
+        FROM claims
+    """)
+
+    # === Step 8: Calculate Past Denial Rate ===
+    con.execute("""
+        CREATE TABLE denial_stats AS
+        SELECT cpt, payer, AVG(denied::INTEGER)::FLOAT AS past_denial_rate
+        FROM claims_with_pair
+        GROUP BY cpt, payer
+    """)
+
+    # === Step 9: Join Denial Rate Back ===
+    con.execute("""
+        CREATE TABLE enriched_claims AS
+        SELECT c.*, d.past_denial_rate
+        FROM claims_with_pair c
+        LEFT JOIN denial_stats d ON c.cpt = d.cpt AND c.payer = d.payer
+    """)
+
+    # === Step 10: Downsample Balanced Sample (~50K) ===
+    df_sampled = con.execute("""
+        SELECT * FROM (
+            SELECT * FROM enriched_claims WHERE denied = 1 USING SAMPLE 20000 ROWS
+            UNION ALL
+            SELECT * FROM enriched_claims WHERE denied = 0 USING SAMPLE 30000 ROWS
+        )
+    """).fetchdf()
+    write_splits(con, df_sampled, take_ccs_rows, output_dir)
+
+def write_splits(con, df_sampled, take_ccs_rows, output_dir):
+    # === Step 11: Train/Val/Test Split ===
+    train, temp = train_test_split(df_sampled, stratify=df_sampled["denied"], test_size=0.3, random_state=42)
+    test, val = train_test_split(temp, stratify=temp["denied"], test_size=0.5, random_state=42)
+
+    # Write typed Parquet splits straight from DuckDB, each with its row-aligned CCS block
+    os.makedirs(output_dir, exist_ok=True)
+    for split_name, split_df in [("train", train), ("test", test), ("val", val)]:
+        con.register("split_df", split_df)
+        con.execute(f"COPY split_df TO '{output_dir}/claims_{split_name}.parquet' (FORMAT PARQUET)")
+        con.unregister("split_df")
+        save_ccs_matrix(f"{output_dir}/ccs_{split_name}.npz", take_ccs_rows(split_df["claim_row"].to_numpy()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds the denial-risk training splits from raw claims.")
+    parser.add_argument("--input", default=INPUT_CLAIMS_FILE)
+    parser.add_argument("--ccs-file", default=CCS_FILE_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--chunksize", type=int, default=0,
+                        help="Process claims in chunks of this many rows (0 loads the whole file).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes for chunked mode.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only ingest rows appended since the last run into the persistent --db.")
+    parser.add_argument("--db", default=os.path.join(OUTPUT_DIR, "claims_incremental.duckdb"),
+                        help="Persistent DuckDB database used by --incremental.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    ccs_df = load_ccs_mapping(args.ccs_file)
+    if args.incremental:
+        con = duckdb.connect(args.db)
+        labels = run_incremental(con, args.input, ccs_df, args.output_dir)
+        with open("ccs_features.json", "w") as f:
+            json.dump(ccs_column_names(labels), f)
+        con.close()
+        print(f"Incremental refresh complete in {time.perf_counter() - start:.1f}s")
+        return
+    if args.chunksize > 0:
+        # Chunks go to an on-disk DuckDB database so the claims table never has to fit in memory
+        work_db = os.path.join(args.output_dir, "claims_work.duckdb")
+        os.makedirs(args.output_dir, exist_ok=True)
+        if os.path.exists(work_db):
+            os.remove(work_db)
+        con = duckdb.connect(work_db)
+        take_ccs_rows, labels = run_chunked(con, args.input, ccs_df, args.ccs_file,
+                                            args.chunksize, args.workers, args.output_dir)
+    else:
+        con = duckdb.connect()
+        take_ccs_rows, labels = run_in_memory(con, args.input, ccs_df)
+
+    # Save CCS feature list (column order of the sparse matrices)
+    with open("ccs_features.json", "w") as f:
+        json.dump(ccs_column_names(labels), f)
+
+    build_splits(con, take_ccs_rows, args.output_dir)
+    claim_count = con.execute("SELECT COUNT(*) FROM claims").fetchone()[0]
+    con.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"ICD10 CCS multi-hot features and pipeline complete: {claim_count} claims in {elapsed:.1f}s "
+          f"({claim_count / elapsed:,.0f} claims/s)")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,49 @@
 import csv
+import re
+from collections import namedtuple
+
 from lxml import etree
 
+CompiledFeatureMapping = namedtuple(
+    'CompiledFeatureMapping', ['feature_names', 'element_rules', 'service_rules', 'service_count', 'tags'])
+
+_SERVICE_INDEX = re.compile(r'service\[(\d+)\]')
+
+# Where the original hard-coded extraction read each feature from. Used for
+# features named without a source, e.g. a plain list of feature names or an
+# old one-name-per-line claim_feature_mapping.txt.
+DEFAULT_FEATURE_RULES = {
+    'payer-name': ('subscriber', 'payer-name'),
+    'payer-responsibility-code': ('subscriber', 'payer-responsibility-code'),
+    'payer-identifier': ('subscriber', 'payer-identifier'),
+    'relation-to-insured': ('subscriber', 'relation-to-insured-code'),
+    'billing-npi': ('billing', 'payto-npi'),
+    'billing-state': ('billing', 'payto-state'),
+    'billing-zip': ('billing', 'payto-zip'),
+    'patient-gender': ('patient', 'gender'),
+    'patient-birth-date': ('patient', 'birth-date'),
+    'claim-id': ('claim', 'claim-id'),
+    'rendering-provider-specialty-code': ('claim', 'rendering-provider-specialty-code'),
+    'rendering-provider-npi': ('claim', 'rendering-provider-npi'),
+    'referring-provider-npi': ('claim', 'referring-provider-npi'),
+    'service-facility-state': ('claim', 'service-facility-state'),
+    'service-facility-zip': ('claim', 'service-facility-zip'),
+    **{f'diagnosis-{i}': ('claim', f'diagnosis-{i}') for i in range(1, 11)},
+    'service-id': ('service', 'service-id'),
+    'procedure-code': ('service', 'procedure-code'),
+    **{f'procedure-modifier-{i}': ('service', f'procedure-modifier-{i}') for i in range(1, 5)},
+    'service-charge-amount': ('service', 'service-charge-amount'),
+    'service-units': ('service', 'service-units'),
+    'service-unit-count': ('service', 'service-unit-count'),
+    'service-start-date': ('service', 'service-date'),
+    'place-of-service-code': ('service', 'place-of-service-code'),
+    'drug-ndc-code': ('service', 'drug-ndc-code'),
+    'ordering-provider-npi': ('service', 'ordering-provider-npi'),
+    'ordering-provider-state': ('service', 'ordering-provider-state'),
+    'ordering-provider-zipcode': ('service', 'ordering-provider-zipcode'),
+    **{f'procedure-{i}': (f'service[{i}]', 'procedure-code') for i in range(1, 11)},
+}
+
 def extract_features_from_xml(xml_string, feature_mapping):
     """
     Parses an XML string and extracts features based on the provided mapping.
@@ -13,76 +56,127 @@ def extract_features_from_xml(xml_string, feature_mapping):
         print(f"XML Syntax Error: {e}")
         return []
 
-    features = {feature: '' for feature in feature_mapping}
-    
-    subscriber = root.find('.//subscriber')
-    if subscriber is not None:
-        features['payer-name'] = subscriber.get('payer-name', '')
-        features['payer-responsibility-code'] = subscriber.get('payer-responsibility-code', '')
-        features['payer-identifier'] = subscriber.get('payer-identifier', '')
-        features['relation-to-insured'] = subscriber.get('relation-to-insured-code', '')
-        
-
-    billing = root.find('.//billing')
-    if billing is not None:
-        features['billing-npi'] = billing.get('payto-npi', '')
-        features['billing-state'] = billing.get('payto-state', '')
-        features['billing-zip'] = billing.get('payto-zip', '')
-
-    patient = root.find('.//patient')
-    if patient is not None:
-        features['patient-gender'] = patient.get('gender', '')
-        features['patient-birth-date'] = patient.get('birth-date', '')
-
-    claim = root.find('.//claim')
-    if claim is not None:
-        features['claim-id'] = claim.get('claim-id', '')
-        features['rendering-provider-specialty-code'] = claim.get('rendering-provider-specialty-code', '')
-        features['rendering-provider-npi'] = claim.get('rendering-provider-npi', '')
-        features['referring-provider-npi'] = claim.get('referring-provider-npi', '')
-        features['service-facility-state'] = claim.get('service-facility-state', '')
-        features['service-facility-zip'] = claim.get('service-facility-zip', '')
-        
-        for i in range(1, 11):
-            diag_code = claim.get('diagnosis-' + str(i), '')
-            features['diagnosis-' + str(i)] = diag_code
-
-    services = root.findall('.//claim/service')
-    if services:
-        # Process the first service line for the main features
-        first_service = services[0]
-        features['service-id'] = first_service.get('service-id', '')
-        features['procedure-code'] = first_service.get('procedure-code', '')
-        features['procedure-modifier-1'] = first_service.get('procedure-modifier-1', '')
-        features['procedure-modifier-2'] = first_service.get('procedure-modifier-2', '')
-        features['procedure-modifier-3'] = first_service.get('procedure-modifier-3', '')
-        features['procedure-modifier-4'] = first_service.get('procedure-modifier-4', '')
-        features['service-charge-amount'] = first_service.get('service-charge-amount', '')
-        features['service-units'] = first_service.get('service-units', '')
-        features['service-unit-count'] = first_service.get('service-unit-count', '')
-        features['service-start-date'] = first_service.get('service-date', '')
-        features['place-of-service-code'] = first_service.get('place-of-service-code', '')
-        features['drug-ndc-code'] = first_service.get('drug-ndc-code', '')
-        features['ordering-provider-npi'] = first_service.get('ordering-provider-npi', '')
-        features['ordering-provider-state'] = first_service.get('ordering-provider-state', '')
-        features['ordering-provider-zipcode'] = first_service.get('ordering-provider-zipcode', '')
-
-        # Get all procedure codes from all service lines
-        for i, service in enumerate(services):
-            if i < 10: # Limit to 10 procedures
-                features[f'procedure-{i+1}'] = service.get('procedure-code', '')
-            else:
-                break
+    return extract_features_from_tree(root, feature_mapping)
+
+def extract_features_from_tree(root, feature_mapping):
+    """
+    Extracts features from an already parsed claim. root may be an lxml or an
+    ElementTree element, so a caller that parsed the payload for another pass
+    (see claim_message_engine.py) does not parse it again.
 
+    The tree is walked once, stopping as soon as every mapped element is found.
+    Each element is taken from its first occurrence below root, as
+    root.find('.//tag') would. Service lines are the <service> children of any
+    <claim> below root in document order, as in root.findall('.//claim/service').
+    """
+    if not isinstance(feature_mapping, CompiledFeatureMapping):
+        feature_mapping = compile_feature_mapping(feature_mapping)
+
+    if isinstance(root, etree._Element):
+        found, services = _collect_lxml(root, feature_mapping)
+    else:
+        found, services = {}, []
+        _walk(root, None, feature_mapping, found, services)
+
+    features = dict.fromkeys(feature_mapping.feature_names, '')
+    for tag, element in found.items():
+        for feature, attribute in feature_mapping.element_rules[tag]:
+            features[feature] = element.get(attribute, '')
+    for index, feature, attribute in feature_mapping.service_rules:
+        if index < len(services):
+            features[feature] = services[index].get(attribute, '')
     return [features]
 
+def _walk(element, parent_tag, feature_mapping, found, services):
+    """
+    Visits element's descendants in document order, collecting the first match
+    per mapped element and the service lines. Returns True as soon as every rule
+    has its element, so the rest of the tree (e.g. further service lines) is skipped.
+    """
+    for child in element:
+        tag = child.tag
+        if tag in feature_mapping.element_rules:
+            if tag not in found:
+                found[tag] = child
+        elif tag == 'service' and parent_tag == 'claim' and len(services) < feature_mapping.service_count:
+            services.append(child)
+        # parent_tag of root's children stays None: './/claim/service' only matches claims below root
+        if _walk(child, tag, feature_mapping, found, services):
+            return True
+    return len(found) == len(feature_mapping.element_rules) and len(services) == feature_mapping.service_count
+
+def _collect_lxml(root, feature_mapping):
+    """
+    Same as _walk for lxml trees: iter() filters the mapped tags in C, so only
+    matching elements get Python proxies, and the parent is looked up per service line.
+    """
+    found, services = {}, []
+    if not feature_mapping.tags:
+        return found, services
+    element_rules, service_count = feature_mapping.element_rules, feature_mapping.service_count
+    for element in root.iter(*feature_mapping.tags):
+        if element is root:
+            continue
+        tag = element.tag
+        if tag == 'service':
+            if len(services) < service_count:
+                parent = element.getparent()
+                if parent is not root and parent.tag == 'claim':
+                    services.append(element)
+        elif tag not in found:
+            found[tag] = element
+        if len(found) == len(element_rules) and len(services) == service_count:
+            break
+    return found, services
+
+def read_feature_mapping(path):
+    """
+    Reads claim_feature_mapping.txt. Each line is a feature name, optionally
+    followed by the element and attribute it is read from. 'service' is the
+    first service line and 'service[N]' the Nth. A feature without a source
+    is read as DEFAULT_FEATURE_RULES has it, or left blank for the caller to
+    fill if it has no default (e.g. the CSV columns).
+    """
+    mapping = []
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                mapping.append(tuple(fields[:3]) if len(fields) >= 3 else (fields[0], None, None))
+    return mapping
+
+def compile_feature_mapping(mapping):
+    """
+    Groups the mapping's rules by element for the single-pass walk. mapping is
+    read_feature_mapping's output or a plain list of feature names; names
+    without a source fall back to DEFAULT_FEATURE_RULES.
+    """
+    feature_names, element_rules, service_rules = [], {}, []
+    for entry in mapping:
+        feature, element, attribute = (entry, None, None) if isinstance(entry, str) else entry
+        feature_names.append(feature)
+        if element is None:
+            if feature not in DEFAULT_FEATURE_RULES:
+                continue
+            element, attribute = DEFAULT_FEATURE_RULES[feature]
+        service_index = _SERVICE_INDEX.fullmatch(element)
+        if service_index:
+            service_rules.append((int(service_index.group(1)) - 1, feature, attribute))
+        elif element == 'service':
+            service_rules.append((0, feature, attribute))
+        else:
+            element_rules.setdefault(element, []).append((feature, attribute))
+    service_count = max((index + 1 for index, _, _ in service_rules), default=0)
+    tags = tuple(element_rules) + (('service',) if service_rules else ())
+    return CompiledFeatureMapping(feature_names, element_rules, service_rules, service_count, tags)
+
 def extract_and_flatten_claim_data(input_file, output_file, feature_mapping_file):
     """
     Reads a CSV file, extracts features from the 'data' column based on a mapping,
     and writes the extracted data to a new CSV file, overwriting it if it exists.
     """
-    with open(feature_mapping_file, 'r') as f:
-        feature_names = [line.strip() for line in f if line.strip()]
+    feature_mapping = compile_feature_mapping(read_feature_mapping(feature_mapping_file))
+    feature_names = feature_mapping.feature_names
 
     # Open the output file in write mode ('w') to ensure it's overwritten on each run
     with open(input_file, 'r', newline='') as infile, open(output_file, 'w', newline='') as outfile:
@@ -108,7 +202,7 @@ def extract_and_flatten_claim_data(input_file, output_file, feature_mapping_file
                 claim_procedures_str = row[claim_procedures_index]
                 procedures = [p.strip() for p in claim_procedures_str.split(' ') if p.strip()]
 
-                features_list = extract_features_from_xml(xml_data, feature_names)
+                features_list = extract_features_from_xml(xml_data, feature_mapping)
                 for features in features_list:
                     features['ClaimMessageId'] = row[claim_message_id_index]
                     features['ClaimK9Number'] = row[claim_k9_number_index]
@@ -0,0 +1,204 @@
+"""
+Incremental feature materialization for data_processor.py --incremental.
+
+State lives in a persistent DuckDB database so each refresh only touches new rows:
+
+* claims            - prepared claims with code_pair_combo and their CCS label ids (ccs_ids)
+* denial_counts     - running (cpt, payer) denied/total counts, upserted per batch
+* ccs_vocabulary    - the CCSR label vocabulary the ccs_ids refer to, fixed on first run
+* ccs_observed      - label ids seen in at least one claim
+* reservoir         - balanced training sample maintained with reservoir sampling
+* reservoir_seen    - claims seen per sampling stratum
+* ingest_watermark  - byte offset and row count consumed per source file
+"""
+
+import io
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Balanced sample sizes per denied label, as in Step 10 of data_processor.py
+SAMPLE_SIZES = {1: 20000, 0: 30000}
+
+
+def init_db(con, vocabulary):
+    """Creates the state tables on first use and returns the persisted CCS vocabulary."""
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS denial_counts (
+            cpt VARCHAR, payer VARCHAR, denied_count BIGINT, total_count BIGINT,
+            PRIMARY KEY (cpt, payer))
+    """)
+    con.execute("CREATE TABLE IF NOT EXISTS ccs_vocabulary (label_id INTEGER PRIMARY KEY, label VARCHAR)")
+    con.execute("CREATE TABLE IF NOT EXISTS ccs_observed (label_id INTEGER PRIMARY KEY)")
+    con.execute("CREATE TABLE IF NOT EXISTS reservoir (denied INTEGER, slot INTEGER, claim_row BIGINT)")
+    con.execute("CREATE TABLE IF NOT EXISTS reservoir_seen (denied INTEGER PRIMARY KEY, seen BIGINT)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_watermark (
+            source VARCHAR PRIMARY KEY, byte_offset BIGINT, rows_ingested BIGINT, updated_at TIMESTAMP)
+    """)
+
+    stored = [row[0] for row in con.execute("SELECT label FROM ccs_vocabulary ORDER BY label_id").fetchall()]
+    if not stored:
+        con.executemany("INSERT INTO ccs_vocabulary VALUES (?, ?)", list(enumerate(vocabulary)))
+        return list(vocabulary)
+    unknown = set(vocabulary) - set(stored)
+    if unknown:
+        raise ValueError(f"The CCSR file has {len(unknown)} labels not in the incremental database; "
+                         "rebuild it from scratch with a new --db")
+    return stored
+
+
+def read_new_rows(con, input_file):
+    """
+    Returns the rows appended to input_file since the last refresh, plus the
+    watermark to record once they are stored. Only complete lines are consumed.
+    """
+    source = os.path.abspath(input_file)
+    watermark = con.execute("SELECT byte_offset, rows_ingested FROM ingest_watermark WHERE source = ?",
+                            [source]).fetchone()
+    with open(source, "rb") as f:
+        header = f.readline()
+        offset, rows_ingested = watermark if watermark else (f.tell(), 0)
+        f.seek(0, os.SEEK_END)
+        if f.tell() < offset:
+            raise ValueError(f"{input_file} is smaller than its watermark; it must only be appended to")
+        f.seek(offset)
+        data = f.read()
+
+    complete = data.rfind(b"\n") + 1
+    if complete == 0:
+        return None, (source, offset, rows_ingested)
+    df = pd.read_csv(io.BytesIO(header + data[:complete]), on_bad_lines='skip')
+    return df, (source, offset + complete, rows_ingested + len(df))
+
+
+def claims_table_exists(con):
+    return con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = 'claims'").fetchone()[0] > 0
+
+
+def next_claim_row(con):
+    if not claims_table_exists(con):
+        return 0
+    return con.execute("SELECT COALESCE(MAX(claim_row) + 1, 0) FROM claims").fetchone()[0]
+
+
+def has_claims(con):
+    return claims_table_exists(con) and con.execute("SELECT COUNT(*) FROM claims").fetchone()[0] > 0
+
+
+def store_claims(con, df, ccs_matrix, first_row):
+    """
+    Appends prepared claims and their CCS label ids to the claims table and
+    folds them into the (cpt, payer) denial counts and observed CCS labels.
+    """
+    if df.empty:
+        # Nothing to store; a first batch like this must not create a claims table with guessed types
+        return df.assign(claim_row=pd.Series(dtype="int64"))
+    df = df.copy()
+    df["claim_row"] = np.arange(first_row, first_row + len(df))
+    if "secondary_cpt" not in df.columns:
+        df["secondary_cpt"] = pd.NA
+    df["secondary_cpt"] = df["secondary_cpt"].astype("Int64")
+    df["code_pair_combo"] = np.where(df["secondary_cpt"].notna(),
+                                     df["cpt"] + "_" + df["secondary_cpt"].astype("string"),
+                                     df["cpt"] + "_81001")
+    ccs_matrix = ccs_matrix.tocsr()
+    indices, indptr = ccs_matrix.indices.astype(np.int32), ccs_matrix.indptr
+    df["ccs_ids"] = [indices[start:end].tolist() for start, end in zip(indptr[:-1], indptr[1:])]
+
+    con.register("new_claims", df)
+    # Databases written by earlier versions may hold an empty claims table from an empty first batch
+    if has_claims(con):
+        con.execute("INSERT INTO claims BY NAME SELECT * REPLACE (ccs_ids::INTEGER[] AS ccs_ids) FROM new_claims")
+    else:
+        con.execute("CREATE OR REPLACE TABLE claims AS SELECT * REPLACE (ccs_ids::INTEGER[] AS ccs_ids) FROM new_claims")
+
+    con.execute("""
+        INSERT INTO denial_counts
+        SELECT cpt, payer, SUM(denied::INTEGER), COUNT(*) FROM new_claims GROUP BY cpt, payer
+        ON CONFLICT (cpt, payer) DO UPDATE SET
+            denied_count = denial_counts.denied_count + EXCLUDED.denied_count,
+            total_count = denial_counts.total_count + EXCLUDED.total_count
+    """)
+    con.unregister("new_claims")
+
+    observed = np.flatnonzero(ccs_matrix.getnnz(axis=0) > 0)
+    if len(observed):
+        con.executemany("INSERT INTO ccs_observed VALUES (?) ON CONFLICT DO NOTHING",
+                        [[int(label_id)] for label_id in observed])
+    return df
+
+
+def update_reservoir(con, new_claims, rng):
+    """
+    Folds new claims into the per-stratum reservoirs (Algorithm R), so the
+    balanced sample stays uniform over the full history without rescanning it.
+    """
+    for denied, size in SAMPLE_SIZES.items():
+        rows = new_claims.loc[new_claims["denied"] == denied, "claim_row"].to_numpy()
+        if len(rows) == 0:
+            continue
+        seen_row = con.execute("SELECT seen FROM reservoir_seen WHERE denied = ?", [denied]).fetchone()
+        seen = seen_row[0] if seen_row else 0
+        slots = np.full(size, -1, dtype=np.int64)
+        current = con.execute("SELECT slot, claim_row FROM reservoir WHERE denied = ?", [denied]).fetchnumpy()
+        slots[current["slot"]] = current["claim_row"]
+
+        positions = seen + np.arange(len(rows))
+        fill = positions < size
+        slots[positions[fill]] = rows[fill]
+        # The i-th claim seen (0-based) replaces a random slot with probability size / (i + 1)
+        candidates = rng.integers(0, positions[~fill] + 1) if (~fill).any() else np.array([], dtype=np.int64)
+        keep = candidates < size
+        slots[candidates[keep]] = rows[~fill][keep]
+
+        filled = np.flatnonzero(slots >= 0)
+        con.register("new_reservoir", pd.DataFrame({"denied": denied, "slot": filled, "claim_row": slots[filled]}))
+        con.execute("DELETE FROM reservoir WHERE denied = ?", [denied])
+        con.execute("INSERT INTO reservoir SELECT denied, slot, claim_row FROM new_reservoir")
+        con.unregister("new_reservoir")
+        con.execute("""
+            INSERT INTO reservoir_seen VALUES (?, ?)
+            ON CONFLICT (denied) DO UPDATE SET seen = EXCLUDED.seen
+        """, [denied, seen + len(rows)])
+
+
+def fetch_sample(con):
+    """
+    Returns the reservoir sample joined with the current denial rates, in the
+    same shape as Steps 7-10 of data_processor.py, plus its CCS block.
+    """
+    df_sampled = con.execute("""
+        SELECT c.* EXCLUDE (ccs_ids),
+               (d.denied_count::DOUBLE / d.total_count)::FLOAT AS past_denial_rate,
+               c.ccs_ids
+        FROM reservoir r
+        JOIN claims c ON c.claim_row = r.claim_row
+        LEFT JOIN denial_counts d ON c.cpt = d.cpt AND c.payer = d.payer
+        ORDER BY r.denied DESC, r.slot
+    """).fetchdf()
+    n_labels = con.execute("SELECT COUNT(*) FROM ccs_vocabulary").fetchone()[0]
+    ccs_ids = df_sampled.pop("ccs_ids")
+    lengths = ccs_ids.map(len).to_numpy()
+    indices = np.concatenate([np.asarray(ids, dtype=np.int32) for ids in ccs_ids]) if len(ccs_ids) else []
+    ccs_matrix = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.uint8), indices, np.concatenate([[0], np.cumsum(lengths)])),
+        shape=(len(df_sampled), n_labels),
+    )
+    return df_sampled, ccs_matrix
+
+
+def observed_label_ids(con):
+    return [row[0] for row in con.execute("SELECT label_id FROM ccs_observed ORDER BY label_id").fetchall()]
+
+
+def record_watermark(con, watermark):
+    source, byte_offset, rows_ingested = watermark
+    con.execute("""
+        INSERT INTO ingest_watermark VALUES (?, ?, ?, now())
+        ON CONFLICT (source) DO UPDATE SET
+            byte_offset = EXCLUDED.byte_offset, rows_ingested = EXCLUDED.rows_ingested,
+            updated_at = EXCLUDED.updated_at
+    """, [source, byte_offset, rows_ingested])
@@ -8,59 +8,54 @@ def scrub_xml_data(xml_string):
     """
     try:
         root = ET.fromstring(xml_string)
-
-        # Scrub patient node
-        patient = root.find('.//patient')
-        if patient is not None:
-            for attr in ['first-name', 'last-name', 'street-1', 'city', 'state', 'zip']:
-                if attr in patient.attrib:
-                    patient.set(attr, 'REDACTED')
-
-        # Scrub subscriber node
-        subscriber = root.find('.//subscriber')
-        if subscriber is not None:
-            for attr in ['first-name', 'last-name', 'policy-number', 'street-1', 'city', 'state', 'zip', 'plan-name', 'payer-name']:
-                if attr in subscriber.attrib:
-                    subscriber.set(attr, 'REDACTED')
-
-        # Scrub otherpayercob nodes
-        for otherpayer in root.findall('.//otherpayercob'):
-            for attr in ['first-name', 'last-name', 'policy-number', 'street-1', 'city', 'state', 'zip']:
-                if attr in otherpayer.attrib:
-                    otherpayer.set(attr, 'REDACTED')
-
-        # Scrub transaction node
-        transaction = root.find('.//transaction')
-        if transaction is not None:
-            for attr in ['submitter-name', 'submitter-contact-name', 'submitter-contact-phone', 'submitter-contact-email', 'submitter-contact-fax', 'receiver-name']:
-                if attr in transaction.attrib:
-                    transaction.set(attr, 'REDACTED')
-
-        # Scrub billing nodes
-        for billing in root.findall('.//billing'):
-            for attr in ['name', 'street-1', 'street-2', 'city', 'state', 'zip', 'payto-name', 'payto-street-1', 'payto-street-2', 'payto-city', 'payto-state', 'payto-zip']:
-                if attr in billing.attrib:
-                    billing.set(attr, 'REDACTED')
-
-        # Scrub secondaryident nodes
-        for secondaryident in root.findall('.//secondaryident'):
-            for attr in ['provider-id', 'payto-provider-id']:
-                if attr in secondaryident.attrib:
-                    secondaryident.set(attr, 'REDACTED')
-
-        # Scrub provider nodes
-        provider_tags = ['provider', 'rendering-provider', 'referring-provider']
-        for tag in provider_tags:
-            for provider_node in root.findall('.//' + tag):
-                for attr in ['first-name', 'last-name', 'street-1', 'city', 'state', 'zip', 'npi']:
-                    if attr in provider_node.attrib:
-                        provider_node.set(attr, 'REDACTED')
-
+        scrub_tree(root)
         return ET.tostring(root, encoding='unicode')
     except ET.ParseError:
         # Return the original string if it's not valid XML
         return xml_string
 
+# Redaction policy: tag -> (PHI attributes, first_only). first_only tags are only
+# scrubbed on their first element below the root; every other match is scrubbed.
+PROVIDER_PHI = ('first-name', 'last-name', 'street-1', 'city', 'state', 'zip', 'npi')
+REDACTION_POLICY = {
+    'patient': (('first-name', 'last-name', 'street-1', 'city', 'state', 'zip'), True),
+    'subscriber': (('first-name', 'last-name', 'policy-number', 'street-1', 'city', 'state', 'zip', 'plan-name',
+                    'payer-name'), True),
+    'otherpayercob': (('first-name', 'last-name', 'policy-number', 'street-1', 'city', 'state', 'zip'), False),
+    'transaction': (('submitter-name', 'submitter-contact-name', 'submitter-contact-phone', 'submitter-contact-email',
+                     'submitter-contact-fax', 'receiver-name'), True),
+    'billing': (('name', 'street-1', 'street-2', 'city', 'state', 'zip', 'payto-name', 'payto-street-1',
+                 'payto-street-2', 'payto-city', 'payto-state', 'payto-zip'), False),
+    'secondaryident': (('provider-id', 'payto-provider-id'), False),
+    'provider': (PROVIDER_PHI, False),
+    'rendering-provider': (PROVIDER_PHI, False),
+    'referring-provider': (PROVIDER_PHI, False),
+}
+
+def scrub_tree(root):
+    """
+    Redacts the PHI attributes of an already parsed claim in place, applying
+    REDACTION_POLICY in a single walk over the elements below root. Serialize
+    with ET.tostring(root, encoding='unicode') to get scrub_xml_data's output.
+    """
+    seen_first_only = set()
+    elements = root.iter()
+    next(elements)  # like './/tag', the root itself is never scrubbed
+    for element in elements:
+        policy = REDACTION_POLICY.get(element.tag)
+        if policy is None:
+            continue
+        attributes, first_only = policy
+        if first_only:
+            if element.tag in seen_first_only:
+                continue
+            seen_first_only.add(element.tag)
+        # Only attributes already present are replaced, so their order is unchanged
+        present = element.attrib
+        for attr in attributes:
+            if attr in present:
+                element.set(attr, 'REDACTED')
+
 def scrub_csv(input_file, output_file):
     """
     Reads a CSV file, scrubs PHI from the 'data' column, and writes the
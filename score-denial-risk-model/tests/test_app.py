@@ -1,5 +1,11 @@
+import os
+import tempfile
 from fastapi.testclient import TestClient
-from app.app import app
+
+# Keep feature store snapshots written by the tests out of the project directory
+os.environ.setdefault("DENIAL_RATE_STORE_PATH", os.path.join(tempfile.mkdtemp(), "denial_rate_store.json"))
+
+from app.app import app, denial_rate_store
 
 client = TestClient(app)
 
@@ -66,3 +72,110 @@ def test_predict_denial_invalid_input_schema():
     response = client.post("/predict", json=claim_data)
     # FastAPI should return a 422 Unprocessable Entity for validation errors
     assert response.status_code == 422
+
+def test_predict_denial_repeat_is_served_from_cache():
+    """
+    Test that an identical feature tuple is scored once and then served from the cache.
+    """
+    claim_data = {
+        "cpt": "99214",
+        "payer": "UHC",
+        "pos": "12",
+        "duration": 25,
+        "icd_count": 1,
+        "modifier_count": 0,
+        "has_modifier_25": 0,
+        "procedures_count": 2,
+        "past_denial_rate": 0.37,
+        "primary_icd": "I10"
+    }
+    first = client.post("/predict", json=claim_data)
+    before = client.get("/cache-stats").json()
+    second = client.post("/predict", json=claim_data)
+    after = client.get("/cache-stats").json()
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert first.json() == second.json()
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+
+def test_reload_model_invalidates_cache():
+    """
+    Test that swapping the model drops every cached score.
+    """
+    claim_data = {
+        "cpt": "99213",
+        "payer": "Cigna",
+        "pos": "11",
+        "duration": 30,
+        "icd_count": 2,
+        "modifier_count": 1,
+        "has_modifier_25": 1,
+        "procedures_count": 1,
+        "past_denial_rate": 0.2,
+        "primary_icd": "E11.9"
+    }
+    client.post("/predict", json=claim_data)
+    assert client.get("/cache-stats").json()["size"] > 0
+
+    response = client.post("/reload-model")
+    assert response.status_code == 200
+
+    misses = client.get("/cache-stats").json()["misses"]
+    client.post("/predict", json=claim_data)
+    stats = client.get("/cache-stats").json()
+    assert stats["misses"] == misses + 1
+    assert stats["size"] == 1
+    assert stats["invalidations"] >= 1
+
+def test_predict_denial_fills_past_denial_rate_from_feature_store():
+    """
+    Test that past_denial_rate is looked up server-side when the caller omits it,
+    and that new adjudicated outcomes move the looked-up value.
+    """
+    claim_data = {
+        "cpt": "99299",
+        "payer": "Feature Store Test Payer",
+        "pos": "11",
+        "duration": 20,
+        "icd_count": 1,
+        "modifier_count": 0,
+        "has_modifier_25": 0,
+        "procedures_count": 1,
+        "primary_icd": "I10"
+    }
+    response = client.post("/predict", json=claim_data)
+    assert response.status_code == 200
+
+    outcomes = [
+        {"cpt": "99299", "payer": "Feature Store Test Payer", "denied": 1},
+        {"cpt": "99299", "payer": "Feature Store Test Payer", "denied": 1},
+        {"cpt": "99299", "payer": "Feature Store Test Payer", "denied": 0},
+        {"cpt": "99299", "payer": "Feature Store Test Payer", "denied": 1},
+    ]
+    response = client.post("/outcomes", json=outcomes)
+    assert response.status_code == 200
+    assert response.json()["applied"] == 4
+
+    supplied = client.post("/predict", json={**claim_data, "past_denial_rate": 0.75})
+    filled = client.post("/predict", json=claim_data)
+    assert filled.status_code == 200
+    assert filled.json() == supplied.json()
+
+def test_record_outcomes_rejects_invalid_label():
+    """
+    Test that outcomes with a denied value other than 0/1 are rejected.
+    """
+    response = client.post("/outcomes", json=[{"cpt": "99213", "payer": "Aetna", "denied": 2}])
+    assert response.status_code == 422
+
+def test_record_outcomes_rejects_the_whole_batch():
+    """
+    Test that a batch with one bad outcome is rejected before any outcome is applied.
+    """
+    good = {"cpt": "99298", "payer": "Batch Test Payer", "denied": 1}
+    for bad in ({**good, "denied": 2}, {**good, "service_date": "not a date"}):
+        response = client.post("/outcomes", json=[good, bad])
+        assert response.status_code == 422
+    assert denial_rate_store.lookup("99298", "Batch Test Payer") is None
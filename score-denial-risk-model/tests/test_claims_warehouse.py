@@ -0,0 +1,47 @@
+import os
+import sys
+
+import duckdb
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pre-processor"))
+from build_claims_warehouse import refresh_warehouse, source_schemas
+from create_and_load_db import SOURCES
+
+def write_source(table, rows, mode="w"):
+    path = dict(SOURCES)[table]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    columns = [name for name, _ in source_schemas()[table]]
+    pd.DataFrame(rows, columns=columns).to_csv(path, mode=mode, header=mode == "w", index=False)
+
+def line(message_id, started):
+    return {"ClaimMessageId": message_id, "ClaimK9Number": f"K9-{message_id}", "service_id": 1,
+            "startedutc": started, "service_start_date": "2024-03-05", "procedure_code": "99214"}
+
+def response(response_id, created):
+    return {"PayerGatewayResponseId": response_id, "ClaimK9Number": f"K9-{response_id}",
+            "CreatedDate": created, "TransactionTimestamp": created, "PayerProcessingStatus": "Denied"}
+
+def test_refresh_picks_up_late_rows_at_the_watermark(tmp_path, monkeypatch):
+    """
+    Test that rows sharing the stored watermark or lacking one are ingested once, without duplicates.
+    """
+    monkeypatch.chdir(tmp_path)
+    write_source("claim_features", [line(1, "2024-03-05 10:00:00"), line(2, None)])
+    write_source("payer_gateway_responses", [response(1, "2024-03-05 10:00:00"), response(2, "2024-03-06 09:00:00")])
+    write_source("claim_status", [])
+    refresh_warehouse("warehouse")
+
+    write_source("claim_features", [line(3, "2024-03-05 10:00:00"), line(4, None)], mode="a")
+    write_source("payer_gateway_responses", [response(3, "2024-03-06 09:00:00")], mode="a")
+    refresh_warehouse("warehouse")
+    refresh_warehouse("warehouse")
+
+    con = duckdb.connect(os.path.join("warehouse", "warehouse.duckdb"), read_only=True)
+    responses = con.execute("SELECT PayerGatewayResponseId FROM payer_gateway_responses ORDER BY 1").fetchall()
+    lines = con.execute("SELECT ClaimMessageId FROM read_parquet('warehouse/claim_features/*/*/*.parquet') "
+                        "ORDER BY 1").fetchall()
+    denied = con.execute("SELECT COUNT(*) FROM claim_denial_labels WHERE denied = 1").fetchone()[0]
+    assert responses == [(1,), (2,), (3,)]
+    assert lines == [(1,), (2,), (3,), (4,)]
+    assert denied == 3
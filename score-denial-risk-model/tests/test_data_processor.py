@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pre-processor"))
+from data_processor import malformed_rows
+
+def test_malformed_rows_skips_only_long_rows(tmp_path):
+    """
+    Test that only rows with extra fields are skipped, keeping short rows and multi-line quoted records.
+    """
+    path = tmp_path / "claims.csv"
+    path.write_text('cpt,icd_list,secondary_cpt\n'
+                    '99214,"[\'E11.9\']",81001\n'
+                    '99213,"[\'I10\']"\n'
+                    '99215,"[\'E11.9\',\n\'I10\']",81001,extra\n'
+                    '99212,"[\'I10\',\n\'E11.9\']",81002\n'
+                    '99211,"[\'I10\']",81003,extra\n')
+    assert malformed_rows(path) == [3, 5]
+    claims = pd.read_csv(path, skiprows=malformed_rows(path))
+    assert claims["cpt"].tolist() == [99214, 99213, 99212]
+    assert claims["secondary_cpt"].isna().tolist() == [False, True, False]
@@ -0,0 +1,56 @@
+import pandas as pd
+from app.denial_rate_store import DenialRateStore
+
+def test_incremental_updates_match_group_by():
+    """
+    Test that batch and incremental updates agree with a full GROUP BY cpt, payer.
+    """
+    claims = pd.DataFrame({
+        "cpt": [99213, 99213, 99213, 99214],
+        "payer": ["Aetna", "Aetna", "UHC", "Aetna"],
+        "denied": [1, 0, 1, 0],
+    })
+    store = DenialRateStore()
+    store.update_from_frame(claims)
+    assert store.lookup("99213", "Aetna") == 0.5
+    assert store.lookup(99213, "UHC") == 1.0
+    assert store.lookup("99215", "Aetna") is None
+
+    store.update("99213", "Aetna", 1)
+    assert store.lookup("99213", "Aetna") == 2 / 3
+
+def test_time_window_and_snapshot_round_trip(tmp_path):
+    """
+    Test that outcomes outside the window stop counting and survive a snapshot reload.
+    """
+    store = DenialRateStore(window_days=30)
+    store.update("99213", "Aetna", 1, "2025-01-01")
+    store.update("99213", "Aetna", 0, "2025-01-20")
+    assert store.lookup("99213", "Aetna") == 0.5
+
+    store.update("99214", "Aetna", 0, "2025-02-15")  # advances the window past 2025-01-01
+    assert store.lookup("99213", "Aetna") == 0.0
+
+    path = tmp_path / "store.json"
+    store.save(path)
+    restored = DenialRateStore.load(path)
+    assert restored.lookup("99213", "Aetna") == 0.0
+    assert restored.lookup("99214", "Aetna") == 0.0
+    assert len(restored) == 2
+
+def test_unparseable_service_dates_count_as_undated():
+    """
+    Test that missing or malformed service dates do not break a windowed batch update.
+    """
+    claims = pd.DataFrame({
+        "cpt": ["99213", "99213", "99213"],
+        "payer": ["Aetna", "Aetna", "Aetna"],
+        "denied": [1, 0, 1],
+        "service_date": ["2025-01-01", None, "not a date"],
+    })
+    store = DenialRateStore(window_days=30)
+    store.update_from_frame(claims)
+    assert store.lookup("99213", "Aetna") == 2 / 3
+
+    store.update("99213", "Aetna", 0, "2025-13-45")
+    assert store.lookup("99213", "Aetna") == 0.5
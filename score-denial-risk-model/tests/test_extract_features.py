@@ -0,0 +1,24 @@
+import os
+import sys
+
+from lxml import etree
+
+PRE_PROCESSOR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pre-processor")
+sys.path.insert(0, PRE_PROCESSOR)
+from benchmark_claim_xml import EDGE_CASES, legacy_extract_features, make_claim_xml
+from extract_features import compile_feature_mapping, extract_features_from_xml, read_feature_mapping
+
+MAPPING_FILE = os.path.join(PRE_PROCESSOR, "claim_feature_mapping.txt")
+
+
+def test_feature_names_alone_extract_like_the_baseline(tmp_path):
+    feature_names = [feature for feature, _, _ in read_feature_mapping(MAPPING_FILE)]
+    names_only = tmp_path / "claim_feature_mapping.txt"
+    names_only.write_text("\n".join(feature_names) + "\n")
+
+    for payload in [make_claim_xml(services, seed=services) for services in (0, 1, 12)] + EDGE_CASES:
+        expected = legacy_extract_features(etree.fromstring(payload.encode("utf-8")), feature_names)
+        assert extract_features_from_xml(payload, feature_names) == expected
+        assert extract_features_from_xml(payload, compile_feature_mapping(read_feature_mapping(names_only))) == expected
+        assert extract_features_from_xml(payload, compile_feature_mapping(read_feature_mapping(MAPPING_FILE))) == expected
+    assert extract_features_from_xml(make_claim_xml(1), feature_names)[0]["payer-name"] == "Aetna"
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import duckdb
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pre-processor"))
+from data_processor import run_incremental
+
+CCS_DF = pd.DataFrame({
+    "icd10": ["E119", "I10"],
+    "ccs_category": ["END002", "CIR007"],
+    "ccs_label": ["Diabetes mellitus without complication", "Essential hypertension"],
+})
+
+def write_claims(path, icd, rows=40, denied=None, mode="w"):
+    pd.DataFrame({
+        "cpt": ["99214"] * rows,
+        "payer": ["Aetna", "UHC"] * (rows // 2),
+        "pos": ["11"] * rows,
+        "duration": [20] * rows,
+        "icd_count": [1] * rows,
+        "modifier_count": [0] * rows,
+        "has_modifier_25": [0] * rows,
+        "procedures_count": [1] * rows,
+        "denied": denied if denied is not None else [0, 1] * (rows // 2),
+        "primary_icd": [icd] * rows,
+        "icd_list": [f"['{icd}']"] * rows,
+        "secondary_cpt": [81001] * rows,
+    }).to_csv(path, mode=mode, header=mode == "w", index=False)
+
+def claim_count(con):
+    return con.execute("SELECT COUNT(*) FROM claims").fetchone()[0]
+
+def test_incremental_first_load_and_appends(tmp_path):
+    """
+    Test that appended batches are ingested, including one whose ICDs map to no CCS label.
+    """
+    claims, output_dir = tmp_path / "claims.csv", tmp_path / "model"
+    con = duckdb.connect(str(tmp_path / "state.duckdb"))
+
+    write_claims(claims, "E11.9")
+    assert run_incremental(con, str(claims), CCS_DF, str(output_dir)) == ["Diabetes mellitus without complication"]
+    assert claim_count(con) == 40
+
+    write_claims(claims, "I10", mode="a")
+    assert len(run_incremental(con, str(claims), CCS_DF, str(output_dir))) == 2
+    assert claim_count(con) == 80
+
+    write_claims(claims, "Z99.9", mode="a")
+    assert len(run_incremental(con, str(claims), CCS_DF, str(output_dir))) == 2
+    assert claim_count(con) == 120
+    assert (output_dir / "claims_train.parquet").exists()
+
+def test_incremental_after_an_empty_first_batch(tmp_path):
+    """
+    Test that a first batch with no valid claims does not break the next refresh.
+    """
+    claims, output_dir = tmp_path / "claims.csv", tmp_path / "model"
+    con = duckdb.connect(str(tmp_path / "state.duckdb"))
+
+    write_claims(claims, "E11.9", rows=4, denied=[2, 2, 2, 2])
+    assert run_incremental(con, str(claims), CCS_DF, str(output_dir)) == []
+    assert not output_dir.exists()
+
+    write_claims(claims, "E11.9", mode="a")
+    run_incremental(con, str(claims), CCS_DF, str(output_dir))
+    assert claim_count(con) == 40
@@ -0,0 +1,30 @@
+from app.prediction_cache import PredictionCache
+
+def test_lru_eviction_and_hit_rate():
+    """
+    Test that the least recently used entry is evicted once the cache is full.
+    """
+    model = object()
+    cache = PredictionCache(maxsize=2)
+    cache.put(model, ("a",), 0.1)
+    cache.put(model, ("b",), 0.2)
+    assert cache.get(model, ("a",)) == 0.1  # "a" becomes most recent
+    cache.put(model, ("c",), 0.3)
+
+    assert cache.get(model, ("b",)) is None
+    assert cache.get(model, ("c",)) == 0.3
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hit_rate"] == round(2 / 3, 4)
+
+def test_new_model_invalidates_entries():
+    """
+    Test that entries cached for one model are never returned for another.
+    """
+    cache = PredictionCache(maxsize=10)
+    old_model, new_model = object(), object()
+    cache.put(old_model, ("a",), 0.1)
+
+    assert cache.get(new_model, ("a",)) is None
+    assert cache.stats()["invalidations"] == 1
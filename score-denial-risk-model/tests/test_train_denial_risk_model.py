@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model"))
+from train_denial_risk_model import train
+
+def write_splits(model_dir, rows=400, seed=0):
+    rng = np.random.default_rng(seed)
+    for name in ("train", "val"):
+        denied = rng.integers(0, 2, rows)
+        pd.DataFrame({
+            "cpt": rng.choice(["99213", "99214"], rows),
+            "payer": rng.choice(["Aetna", "UHC"], rows),
+            "pos": "11",
+            "duration": rng.integers(15, 40, rows),
+            "icd_count": rng.integers(1, 4, rows),
+            "modifier_count": rng.integers(0, 3, rows),
+            "has_modifier_25": denied,
+            "procedures_count": rng.integers(1, 5, rows),
+            "past_denial_rate": rng.random(rows),
+            "icd_ccs_id": rng.choice(["END002", "CIR007"], rows),
+            "denied": denied,
+        }).to_parquet(os.path.join(model_dir, f"claims_{name}.parquet"))
+
+def train_into(tmp_path, **kwargs):
+    return train(str(tmp_path), workers=1, model_path=str(tmp_path / "model.pkl"),
+                 label_encoder_path=str(tmp_path / "le.pkl"), **kwargs)
+
+def test_binary_datasets_are_cached_by_content(tmp_path):
+    """
+    Test that the first run builds the binary Datasets and a rerun on the same splits reuses them.
+    """
+    write_splits(tmp_path)
+    first = train_into(tmp_path)
+    assert not first["dataset_cache_hit"]
+    assert len(os.listdir(tmp_path / "lgb_cache")) == 2
+    assert first["metrics"]["val"]["auc"] > 0.9
+
+    second = train_into(tmp_path)
+    assert second["dataset_cache_hit"]
+    assert second["dataset_key"] == first["dataset_key"]
+
+    write_splits(tmp_path, seed=1)
+    assert not train_into(tmp_path)["dataset_cache_hit"]
+
+def test_ccs_block_trains_from_the_sparse_matrices(tmp_path):
+    """
+    Test that --ccs-block feeds the row-aligned sparse CCS matrices to LightGBM.
+    """
+    from scipy import sparse
+
+    write_splits(tmp_path)
+    for name in ("train", "val"):
+        ccs = pd.read_parquet(tmp_path / f"claims_{name}.parquet")["icd_ccs_id"].eq("END002").to_numpy()
+        matrix = sparse.csr_matrix(np.column_stack([ccs, ~ccs, np.zeros_like(ccs)]).astype(np.uint8))
+        sparse.save_npz(tmp_path / f"ccs_{name}.npz", matrix)
+
+    report = train_into(tmp_path, ccs_block=True)["ccs_block"]
+    assert report["features"] == 10 + 3
+    assert report["val_auc"] > 0.9
+    assert os.path.exists(report["artifact"])
@@ -12,6 +12,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 load_dotenv()
 
 from langgraph.billing_graph import build_graph
+from rag.document_loader import payer_for_rule
 
 class TestBillingGraph(unittest.TestCase):
     def setUp(self):
@@ -35,7 +36,8 @@ class TestBillingGraph(unittest.TestCase):
 
         with open("data/payer_rules.txt") as f:
             for line in f:
-                coll.add(documents=[line.strip()], metadatas=[{"type": "payer_rule"}], ids=[f"payer-{hash(line)}"])
+                coll.add(documents=[line.strip()], metadatas=[{"type": "payer_rule", "payer": payer_for_rule(line)}],
+                         ids=[f"payer-{hash(line)}"])
 
 
     def test_integration_billing_graph(self):
@@ -0,0 +1,183 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+
+# EncounterContext is a pydantic v1 model (langchain_core.pydantic_v1), whose list fields reject non-list iterables
+from pydantic.v1 import BaseModel
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from llm.cascade import (KNOWN_CODES, CascadeRouter, ValidationFailed, encounter_validator, validate_code_bundle,
+                         validate_modifiers)
+from llm.resilience import DeadlineExceeded
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+TEST_CODES = ({"99214", "81001"}, {"E119", "I10"})
+
+
+def reply(text, avg_logprobs=None):
+    return SimpleNamespace(text=text, candidates=[SimpleNamespace(avg_logprobs=avg_logprobs)])
+
+
+def tool_reply(args):
+    call = SimpleNamespace(name="extract_encounter_context", args=ProtoMap(args))
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(function_call=call)]))])
+
+
+class ProtoRepeated:
+    """Iterable but not a list, like the RepeatedComposite values in Vertex function call args."""
+
+    def __init__(self, items):
+        self._items = list(items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+
+class ProtoMap:
+    """Mapping access without being a dict, like MapComposite; list values become ProtoRepeated."""
+
+    def __init__(self, values):
+        self._values = values
+
+    def items(self):
+        return [(key, ProtoRepeated(value) if isinstance(value, list) else value) for key, value in self._values.items()]
+
+
+class StandInModels:
+    """Returns canned replies per model and records which models were called."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = []
+        self.timeouts = []
+
+    def __call__(self, model_name, prompt, tools=None, timeout=None):
+        self.calls.append(model_name)
+        self.timeouts.append(timeout)
+        answer = self.replies[model_name]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def validate_bundle(response):
+    return validate_code_bundle(response, TEST_CODES)
+
+
+class Encounter(BaseModel):
+    visit_type: str
+    duration: str
+    diagnosis: list[str]
+    provider: str
+
+
+class TestCascade(unittest.TestCase):
+    def test_valid_fast_reply_is_not_escalated(self):
+        models = StandInModels({"fast": reply('{"modifiers": ["25"]}'), "pro": reply('{"modifiers": []}')})
+        router = CascadeRouter(tiers=["fast", "pro"], generate=models)
+        self.assertEqual(router.route("modify", "p", validate_modifiers).text, '{"modifiers": ["25"]}')
+        self.assertEqual(models.calls, ["fast"])
+        self.assertEqual(router.stats()["modify"]["fast"]["hit_rate"], 1.0)
+
+    def test_unknown_icd_codes_escalate_to_pro(self):
+        fast = reply(json.dumps({"cpt": "99214", "icd": ["E11.9", "X99.9"], "procedures": []}))
+        pro = reply("```json\n" + json.dumps({"cpt": "99214", "icd": ["E11.9"], "procedures": ["81001"]}) + "```")
+        models = StandInModels({"fast": fast, "pro": pro})
+        router = CascadeRouter(tiers=["fast", "pro"], generate=models)
+        self.assertIs(router.route("convert", "p", validate_bundle), pro)
+        stats = router.stats()["convert"]
+        self.assertEqual((stats["fast"]["low_confidence"], stats["pro"]["accepted"]), (1, 1))
+
+    def test_cpt_codes_outside_the_seed_catalog_are_accepted(self):
+        bundle = reply(json.dumps({"cpt": "99213", "icd": ["I10"], "procedures": ["36415"]}))
+        self.assertEqual(validate_bundle(bundle), 1.0)
+        self.assertEqual(validate_code_bundle(bundle, TEST_CODES, complete={"icd", "cpt"}), 1 / 3)
+        with self.assertRaises(ValidationFailed):
+            validate_bundle(reply(json.dumps({"cpt": "office visit", "icd": ["I10"], "procedures": []})))
+
+    def test_catalog_is_loaded_relative_to_the_package(self):
+        known_cpt, known_icd = KNOWN_CODES
+        self.assertIn("99214", known_cpt)
+        self.assertIn("E119", known_icd)
+
+    def test_low_model_confidence_escalates(self):
+        models = StandInModels({"fast": reply('{"modifiers": []}', avg_logprobs=-1.0),
+                                "pro": reply('{"modifiers": ["59"]}', avg_logprobs=-0.01)})
+        router = CascadeRouter(tiers=["fast", "pro"], generate=models, min_confidence=0.7)
+        self.assertEqual(router.route("modify", "p", validate_modifiers).text, '{"modifiers": ["59"]}')
+        self.assertEqual(router.stats()["modify"]["fast"]["low_confidence"], 1)
+
+    def test_valid_low_confidence_reply_beats_an_invalid_pro_reply(self):
+        fast = reply('{"modifiers": ["25"]}', avg_logprobs=-2.0)
+        models = StandInModels({"fast": fast, "pro": reply("not json")})
+        router = CascadeRouter(tiers=["fast", "pro"], generate=models)
+        self.assertIs(router.route("modify", "p", validate_modifiers), fast)
+
+    def test_upstream_errors_on_every_tier_raise(self):
+        models = StandInModels({"fast": RuntimeError("fast down"), "pro": RuntimeError("pro down")})
+        router = CascadeRouter(tiers=["fast", "pro"], generate=models)
+        with self.assertRaisesRegex(RuntimeError, "pro down"):
+            router.route("modify", "p", validate_modifiers)
+        self.assertEqual(router.stats()["modify"]["fast"]["errors"], 1)
+
+    def test_each_tier_gets_the_stage_time_left_as_its_timeout(self):
+        models = StandInModels({"fast": reply("not json"), "pro": reply('{"modifiers": []}')})
+        router = CascadeRouter(tiers=["fast", "pro"], generate=models)
+        router.route("modify", "p", validate_modifiers, deadline=time.time() + 2)
+        self.assertEqual(models.calls, ["fast", "pro"])
+        self.assertTrue(2 >= models.timeouts[0] >= models.timeouts[1] > 1.5)
+
+        models = StandInModels({"fast": reply('{"modifiers": []}')})
+        with self.assertRaises(DeadlineExceeded):
+            CascadeRouter(tiers=["fast"], generate=models).route("modify", "p", deadline=time.time() - 1)
+        self.assertEqual(models.calls, [])
+
+    def test_slow_tier_call_is_hedged_before_escalating(self):
+        os.environ["LLM_HEDGE_DELAY"] = "0.05"
+        self.addCleanup(os.environ.pop, "LLM_HEDGE_DELAY")
+        answers = {"fast": iter([(0.4, reply("not json")), (0.01, reply("not json"))]),
+                   "pro": iter([(0.4, reply('{"modifiers": ["59"]}')), (0.01, reply('{"modifiers": ["25"]}'))])}
+        calls = []
+
+        def generate(model_name, prompt, tools=None, timeout=None):
+            calls.append(model_name)
+            delay, answer = next(answers[model_name])
+            time.sleep(delay)
+            return answer
+
+        router = CascadeRouter(tiers=["fast", "pro"], generate=generate)
+        start = time.monotonic()
+        self.assertEqual(router.route("modify", "p", validate_modifiers).text, '{"modifiers": ["25"]}')
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertEqual(calls, ["fast", "fast", "pro", "pro"])
+        stats = router.stats()["modify"]
+        self.assertEqual((stats["fast"]["hedged"], stats["fast"]["invalid"]), (1, 1))
+        self.assertEqual((stats["pro"]["hedged"], stats["pro"]["accepted"]), (1, 1))
+
+    def test_encounter_validator_checks_the_schema(self):
+        validate = encounter_validator(Encounter, required=("visit_type", "diagnosis"))
+        self.assertEqual(validate(tool_reply({"visit_type": "follow-up", "duration": "25 minutes",
+                                              "diagnosis": ["E11.9", "R63.1"], "provider": "Dr. Lee"})), 1.0)
+        # Fields the model leaves out are only required when listed in required
+        self.assertEqual(validate(tool_reply({"visit_type": "follow-up", "diagnosis": ["E11.9"]})), 1.0)
+        with self.assertRaises(ValidationFailed):
+            validate(tool_reply({"visit_type": "follow-up", "diagnosis": []}))
+        with self.assertRaises(ValidationFailed):
+            validate(tool_reply({"visit_type": "follow-up", "diagnosis": ["E11.9"], "duration": ["25"]}))
+        with self.assertRaises(ValidationFailed):
+            validate(reply("plain text"))
+
+    def test_cascade_does_not_import_vertex(self):
+        # In a fresh interpreter, since other test modules import the agents and with them vertexai
+        code = "import sys, llm.cascade; sys.exit('vertexai' in sys.modules)"
+        self.assertEqual(subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT).returncode, 0)
+
+if __name__ == '__main__':
+    unittest.main()
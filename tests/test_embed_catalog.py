@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+import unittest
+import zlib
+
+import numpy as np
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag.embed_catalog import QuantizedCatalog, build_catalog, quantize, recall_at_k
+
+
+def embed(documents):
+    """Deterministic unit vectors per document, standing in for the embedding model."""
+    vectors = np.array([np.random.default_rng(zlib.crc32(d.encode())).standard_normal(64) for d in documents],
+                       dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestEmbedCatalog(unittest.TestCase):
+    def setUp(self):
+        self.entries = [(f"icd-C{i:04d}", f"C{i:04d}: condition {i}", {"type": "icd", "code": f"C{i:04d}"})
+                        for i in range(500)]
+        self.entries.append(("cpt-99214", "99214: Office visit, est. patient, 25 minutes",
+                             {"type": "cpt", "code": "99214"}))
+
+    def test_quantize_round_trip_error_is_bounded_by_half_a_step(self):
+        vectors = embed([document for _, document, _ in self.entries])
+        quantized, scales = quantize(vectors)
+        self.assertEqual(quantized.dtype, np.int8)
+        error = np.abs(quantized * scales[:, None] - vectors)
+        self.assertTrue(np.all(error <= scales[:, None] / 2 + 1e-7))
+
+    def test_rerun_only_embeds_changed_entries(self):
+        calls = []
+
+        def counting_embed(documents):
+            calls.append(list(documents))
+            return embed(documents)
+
+        catalog, _, _ = build_catalog(self.entries, embed=counting_embed)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "catalog.npz")
+            catalog.save(path)
+            previous = QuantizedCatalog.load(path)
+
+        changed = list(self.entries)
+        changed[3] = (changed[3][0], changed[3][1] + " (revised)", changed[3][2])
+        rebuilt, _, new_rows = build_catalog(changed, previous, counting_embed)
+
+        self.assertEqual(calls[1], [changed[3][1]])
+        self.assertEqual(new_rows.tolist(), [3])
+        np.testing.assert_array_equal(np.delete(rebuilt.vectors, 3, axis=0), np.delete(catalog.vectors, 3, axis=0))
+        self.assertEqual(rebuilt.metadatas(500), [{"type": "cpt", "code": "99214"}])
+
+    def test_int8_search_recalls_the_float_top_k(self):
+        catalog, vectors, _ = build_catalog(self.entries, embed=embed)
+        self.assertGreater(recall_at_k(vectors, catalog, np.arange(50), 10), 0.9)
+        self.assertEqual(catalog.search(vectors[500], 1, entry_type="cpt").tolist(), [[500]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from llm.resilience import (CircuitBreaker, DeadlineExceeded, Hedger, LatencyTracker, ResilientCaller,
+                            UpstreamUnavailable, deadline_after, stage_timeout)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        os.environ["LLM_HEDGE_DELAY"] = "0.05"
+        os.environ["LLM_STAGE_BUDGET_TEST"] = "0.5"
+        self.clock = FakeClock()
+        self.caller = ResilientCaller(breaker=CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=self.clock))
+
+    def tearDown(self):
+        for name in ("LLM_HEDGE_DELAY", "LLM_STAGE_BUDGET_TEST"):
+            os.environ.pop(name, None)
+
+    def test_stage_timeout_is_clamped_to_the_request_deadline(self):
+        self.assertEqual(stage_timeout("test"), 0.5)
+        self.assertLess(stage_timeout("test", deadline_after(0.2)), 0.21)
+
+    def test_slow_call_is_hedged_and_the_faster_answer_wins(self):
+        calls = []
+        lock = threading.Lock()
+
+        def call():
+            with lock:
+                calls.append(len(calls))
+                attempt = calls[-1]
+            time.sleep(0.4 if attempt == 0 else 0.01)
+            return f"attempt-{attempt}"
+
+        hedger = Hedger()
+        start = time.monotonic()
+        self.assertEqual(hedger.run("test:fast", call, timeout=0.5), "attempt-1")
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertEqual(hedger.hedges(), {"test:fast": 1})
+
+    def test_stage_call_is_not_duplicated(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            time.sleep(0.2)
+            return "answer"
+
+        self.assertEqual(self.caller.call("test", call), "answer")
+        self.assertEqual(len(calls), 1)
+
+    def test_timeout_without_fallback_raises_deadline_exceeded(self):
+        with self.assertRaises(DeadlineExceeded):
+            self.caller.call("test", lambda: time.sleep(1), deadline=deadline_after(0.1))
+
+    def test_client_deadline_does_not_count_against_the_breaker(self):
+        for _ in range(3):
+            self.caller.call("test", lambda: time.sleep(0.2), deadline=deadline_after(0.05), fallback=lambda: "rule")
+        self.assertEqual(self.caller.breaker.state, "closed")
+        self.assertEqual(self.caller.stats()["stages"]["test"]["deadline"], 3)
+
+        for _ in range(2):
+            self.caller.call("test", lambda: time.sleep(1), fallback=lambda: "rule")
+        self.assertEqual(self.caller.breaker.state, "open")
+
+    def test_failure_degrades_to_cached_response_then_rule_fallback(self):
+        self.assertEqual(self.caller.call("test", lambda: "fresh", prompt="p1"), "fresh")
+
+        def fail():
+            raise RuntimeError("upstream error")
+
+        self.assertEqual(self.caller.call("test", fail, prompt="p1", fallback=lambda: "rule"), "fresh")
+        self.assertEqual(self.caller.call("test", fail, prompt="p2", fallback=lambda: "rule"), "rule")
+
+    def test_open_breaker_skips_the_upstream_until_reset(self):
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise RuntimeError("upstream error")
+
+        for _ in range(2):
+            self.caller.call("test", fail, fallback=lambda: "rule")
+        self.assertEqual(self.caller.breaker.state, "open")
+
+        self.assertEqual(self.caller.call("test", fail, fallback=lambda: "rule"), "rule")
+        self.assertEqual(len(calls), 2)
+        with self.assertRaises(UpstreamUnavailable):
+            self.caller.call("test", fail)
+
+        self.clock.now = 10
+        self.assertEqual(self.caller.breaker.state, "half_open")
+        self.assertEqual(self.caller.call("test", lambda: "recovered"), "recovered")
+        self.assertEqual(self.caller.breaker.state, "closed")
+
+    def test_hedge_delay_follows_the_observed_percentile(self):
+        tracker = LatencyTracker()
+        for i in range(1, 101):
+            tracker.record("test", i / 100)
+        self.assertAlmostEqual(tracker.hedge_delay("test"), 0.9505, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
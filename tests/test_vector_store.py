@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# rag.vector_store connects to Chroma on import; the tests only need its query filters
+with mock.patch.dict(sys.modules, {"chromadb": mock.MagicMock()}):
+    from rag import vector_store
+
+
+def query_results(*documents):
+    return {"documents": [list(documents)]}
+
+
+class TestTypedSearch(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(vector_store, "collection")
+        self.collection = patcher.start()
+        self.addCleanup(patcher.stop)
+        tagged = mock.patch.object(vector_store, "_payer_tagged", None)
+        tagged.start()
+        self.addCleanup(tagged.stop)
+        self.collection.get.return_value = {"metadatas": [{"type": "payer_rule", "payer": "Aetna"}]}
+
+    def test_code_searches_filter_on_type(self):
+        self.collection.query.return_value = query_results("99214: Office visit")
+        self.assertEqual(vector_store.search_cpt_codes("follow-up visit"), ["99214: Office visit"])
+        self.collection.query.assert_called_with(query_texts=["follow-up visit"], n_results=vector_store.CPT_TOP_K,
+                                                 where={"type": "cpt"})
+
+        vector_store.search_icd_codes("diabetes", k=5)
+        self.collection.query.assert_called_with(query_texts=["diabetes"], n_results=5, where={"type": "icd"})
+
+    def test_payer_rules_filter_on_payer_and_any_payer(self):
+        self.collection.query.return_value = query_results("Aetna: 99214 with 81001 requires modifier 25 (CO-197)")
+        docs = vector_store.search_payer_rules("99214 81001 modifier", payer="Aetna")
+        self.assertEqual(docs, ["Aetna: 99214 with 81001 requires modifier 25 (CO-197)"])
+        self.collection.query.assert_called_once_with(
+            query_texts=["99214 81001 modifier"], n_results=vector_store.PAYER_RULE_TOP_K,
+            where={"$and": [{"type": "payer_rule"}, {"payer": {"$in": ["Aetna", vector_store.ANY_PAYER]}}]})
+
+    def test_payer_rules_without_a_payer_are_unfiltered(self):
+        self.collection.query.return_value = query_results()
+        vector_store.search_payer_rules("modifier")
+        self.collection.query.assert_called_once_with(query_texts=["modifier"], n_results=vector_store.PAYER_RULE_TOP_K,
+                                                      where={"type": "payer_rule"})
+
+    def test_payer_without_rules_gets_only_rules_for_any_payer(self):
+        self.collection.query.return_value = query_results()
+        self.assertEqual(vector_store.search_payer_rules("99214 modifier", payer="Cigna"), [])
+        self.collection.query.assert_called_once()
+        self.assertEqual(self.collection.query.call_args.kwargs["where"]["$and"][1],
+                         {"payer": {"$in": ["Cigna", vector_store.ANY_PAYER]}})
+
+    def test_untagged_store_searches_all_payer_rules(self):
+        self.collection.get.return_value = {"metadatas": [{"type": "payer_rule"}]}
+        self.collection.query.return_value = query_results("CO-197 bundling rule")
+        with mock.patch("builtins.print") as warn:
+            for _ in range(2):
+                self.assertEqual(vector_store.search_payer_rules("99214 modifier", payer="Aetna"),
+                                 ["CO-197 bundling rule"])
+        self.assertEqual(self.collection.query.call_args.kwargs["where"], {"type": "payer_rule"})
+        self.collection.get.assert_called_once()
+        warn.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()